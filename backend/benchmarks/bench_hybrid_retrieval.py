@@ -0,0 +1,162 @@
+"""
+Benchmark of recall and latency of dense, BM25 and hybrid retrieval.
+
+The corpus has one chunk per SDK identifier (`TextGenerationParameters`, `generate_async`, ...). Each chunk describes
+its identifier with the words of its own topic. The fixed query set has two halves:
+
+- identifier queries name the identifier, e.g. "How do I use TextModelHandler?";
+- paraphrase queries describe the topic with synonyms that never occur in the corpus.
+
+The stand-in embedding model behaves like a real one on both: synonyms of a topic map to the same direction, and
+identifiers are split into sub-word pieces (`text`, `model`, `handler`) shared by many identifiers. It sleeps for
+the latency of an embedding API call. Chunks are searched in a FAISS store through the retrievers of the app.
+
+Run from the backend folder:
+    python -m benchmarks.bench_hybrid_retrieval
+"""
+
+import hashlib
+import re
+import tempfile
+import time
+import numpy as np
+from langchain.schema import Document
+from langchain.schema.embeddings import Embeddings
+from utils.faiss_store import build_faiss_store
+from utils.bm25 import BM25Index
+from utils.retrievers import HybridRetriever, ScoredVectorStoreRetriever
+
+DIM = 256
+EMBED_LATENCY = 0.050  # seconds, one embeddings API call
+PREFIXES = ["Text", "Model", "Prompt", "Chat", "Tune", "File", "Token", "Credential"]
+SUFFIXES = ["Parameters", "Handler", "Response", "Options", "Client", "Service"]
+VERBS = ["generate", "tokenize", "list", "create", "delete", "retrieve"]
+OBJECTS = ["async", "stream", "models", "prompts", "files", "tunes"]
+
+
+def piece_vector(piece: str) -> np.ndarray:
+    seed = int(hashlib.md5(piece.encode()).hexdigest()[:8], 16)
+    return np.random.default_rng(seed).standard_normal(DIM).astype(np.float32)
+
+
+class StandInEmbeddings(Embeddings):
+    """
+    Embeddings mapping the words of a topic and their synonyms to the topic's direction, and any other word to the
+    sum of its lower-cased sub-word pieces.
+    """
+
+    def __init__(self, topics: dict) -> None:
+        self.topics = topics
+        self.calls = 0
+
+    def vector(self, text: str) -> np.ndarray:
+        v = np.zeros(DIM, dtype=np.float32)
+        for word in re.findall(r"[A-Za-z0-9_]+", text):
+            if word in self.topics:
+                v += 2 * piece_vector(f"topic {self.topics[word]}")
+            else:
+                for piece in re.findall(r"[A-Z]?[a-z]+|[0-9]+", word):
+                    v += piece_vector(piece.lower())
+        return v / np.linalg.norm(v)
+
+    def embed_documents(self, texts):
+        return [self.vector(text).tolist() for text in texts]
+
+    def embed_query(self, text):
+        self.calls += 1
+        time.sleep(EMBED_LATENCY)
+        return self.vector(text).tolist()
+
+
+def make_dataset():
+    """
+    Builds the corpus, the queries and the topic table of the embeddings.
+
+    Returns:
+        tuple: The chunks, the (query, index of the expected chunk, kind) triples and the topic of each word.
+    """
+    names = [p + s for p in PREFIXES for s in SUFFIXES]
+    names += [f"{v}_{o}" for v in VERBS for o in OBJECTS]
+    documents, queries, topics = [], [], {}
+    for i, name in enumerate(names):
+        words = [f"w{i}x", f"w{i}y", f"w{i}z"]
+        synonyms = [f"s{i}x", f"s{i}y", f"s{i}z"]
+        topics.update({word: i for word in words + synonyms})
+        documents.append(
+            Document(
+                page_content=f"The {name} of the SDK is used to {' '.join(words)}.",
+                metadata={"source": f"https://ibm.github.io/ibm-generative-ai/{name}"},
+            )
+        )
+        queries.append((f"How do I use {name}?", i, "identifier"))
+        queries.append((f"How can I {' '.join(synonyms)}?", i, "paraphrase"))
+    return documents, queries, topics
+
+
+def evaluate(
+    retriever, queries: list, ids: dict, embeddings: StandInEmbeddings
+) -> dict:
+    """
+    Runs the queries through a retriever.
+
+    Args:
+        retriever: A retriever, or a BM25Index searched directly.
+        queries (list): The (query, expected chunk, kind) triples.
+        ids (dict): The index of each chunk by content.
+        embeddings (StandInEmbeddings): The embeddings, to count the embedding calls.
+
+    Returns:
+        dict: Recall@1 per kind of query, median latency in milliseconds and number of embedding calls.
+    """
+    embeddings.calls = 0
+    hits, latencies = {}, []
+    for query, expected, kind in queries:
+        start = time.perf_counter()
+        if isinstance(retriever, BM25Index):
+            results = retriever.search(query, 1)
+            found = results[0][0] if results else None
+        else:
+            docs = retriever.get_relevant_documents(query)
+            found = ids[docs[0].page_content] if docs else None
+        latencies.append((time.perf_counter() - start) * 1000)
+        hits.setdefault(kind, []).append(found == expected)
+    return {
+        **{kind: np.mean(h) for kind, h in hits.items()},
+        "p50": np.percentile(latencies, 50),
+        "calls": embeddings.calls,
+    }
+
+
+if __name__ == "__main__":
+    documents, queries, topics = make_dataset()
+    embeddings = StandInEmbeddings(topics)
+    ids = {doc.page_content: i for i, doc in enumerate(documents)}
+    with tempfile.TemporaryDirectory() as path:
+        store = build_faiss_store(documents, embeddings, path)
+        dense = ScoredVectorStoreRetriever(
+            vectorstore=store,
+            search_type="similarity_score_threshold",
+            search_kwargs={"score_threshold": 0.1, "k": 1},
+        )
+        hybrid = HybridRetriever.from_documents(
+            documents,
+            ScoredVectorStoreRetriever(
+                vectorstore=store,
+                search_type="similarity_score_threshold",
+                search_kwargs={"score_threshold": 0.1, "k": 4},
+            ),
+        )
+        results = {
+            "dense": evaluate(dense, queries, ids, embeddings),
+            "bm25": evaluate(hybrid.index, queries, ids, embeddings),
+            "hybrid": evaluate(hybrid, queries, ids, embeddings),
+        }
+
+    print(f"{len(documents)} chunks, {len(queries)} queries")
+    print(
+        f"{'retriever':>10} {'recall@1 ident':>15} {'recall@1 para':>14} {'p50 ms':>8} {'embed calls':>12}"
+    )
+    for name, r in results.items():
+        print(
+            f"{name:>10} {r['identifier']:>15.2f} {r['paraphrase']:>14.2f} {r['p50']:>8.2f} {r['calls']:>12}"
+        )
@@ -0,0 +1,79 @@
+"""
+Benchmark of token coalescing for StreamingResponse.
+
+A fake LLM stream produces tokens at a steady rate and is served through a StreamingResponse, either token by
+token as before or through `coalesce_stream`. The ASGI `send` callable counts the body messages: uvicorn writes
+each of them to the socket right away, so their number is the number of send syscalls (and HTTP chunks, proxy
+writes and frontend rerenders) per response.
+
+Run from the backend folder:
+    python -m benchmarks.bench_stream_coalescing
+"""
+
+import asyncio
+import time
+from fastapi.responses import StreamingResponse
+from utils.stream_buffer import coalesce_stream
+
+N_TOKENS = 500
+TOKEN_INTERVAL = 0.005  # seconds, about the pace of gpt-3.5-turbo streaming
+CONFIGS = [
+    ("per token", None),
+    ("256 B / 40 ms", (256, 40)),
+    ("1 KiB / 100 ms", (1024, 100)),
+]
+
+
+async def fake_llm_stream():
+    for i in range(N_TOKENS):
+        await asyncio.sleep(TOKEN_INTERVAL)
+        yield f" tok{i % 10}"
+
+
+async def serve(flush) -> dict:
+    """
+    Serves one response and measures what is written to the transport.
+
+    Args:
+        flush: None to stream token by token, otherwise a (bytes, milliseconds) flush configuration.
+
+    Returns:
+        dict: Number of writes, bytes per write, time to first byte and total time.
+    """
+    gen = fake_llm_stream()
+    if flush:
+        gen = coalesce_stream(gen, *flush)
+    response = StreamingResponse(gen, media_type="text/event-stream")
+    stats = {"writes": 0, "bytes": 0, "ttfb": None}
+    start = time.perf_counter()
+
+    async def receive():
+        await asyncio.sleep(3600)
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        if message["type"] == "http.response.body" and message.get("body"):
+            stats["writes"] += 1
+            stats["bytes"] += len(message["body"])
+            if stats["ttfb"] is None:
+                stats["ttfb"] = time.perf_counter() - start
+
+    await response({"type": "http"}, receive, send)
+    stats["total"] = time.perf_counter() - start
+    return stats
+
+
+async def main():
+    print(
+        f"{'mode':>16} {'writes':>7} {'bytes':>7} {'bytes/write':>12} {'TTFB ms':>8} {'total ms':>9}"
+    )
+    for name, flush in CONFIGS:
+        s = await serve(flush)
+        print(
+            f"{name:>16} {s['writes']:>7} {s['bytes']:>7} {s['bytes'] / s['writes']:>12.1f}"
+            f" {s['ttfb'] * 1000:>8.1f} {s['total'] * 1000:>9.1f}"
+        )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,102 @@
+"""
+Benchmark of the event loop lag while the agent tools run.
+
+Concurrent agent steps call a synchronous tool blocking for TOOL_SECONDS, like the DuckDuckGo search waiting for
+the network, while a ticker measures how late the event loop wakes it up: every other stream and the `/health`
+check are delayed as much. The tool is called on the event loop as a synchronous call from a coroutine would, in
+the default executor as LangChain does for tools without a coroutine, and through `offload_tool`. A last round adds
+a hanging call: only `offload_tool` returns before it ends, at the timeout of the executor.
+
+Run from the backend folder:
+    python -m benchmarks.bench_tool_offload
+"""
+
+import asyncio
+import statistics
+import time
+from langchain.tools import Tool
+from utils.tool_executor import ToolExecutor, offload_tool
+
+N_CALLS = 16
+TOOL_SECONDS = 0.2
+HANG_SECONDS = 3.0
+TIMEOUT = 1.0
+TICK = 0.005
+
+
+def search(query: str) -> str:
+    time.sleep(HANG_SECONDS if query == "hang" else TOOL_SECONDS)
+    return f"results for {query}"
+
+
+def inline_tool() -> Tool:
+    async def call(query: str) -> str:
+        return search(query)
+
+    return Tool(name="search", func=search, coroutine=call, description="search")
+
+
+def default_executor_tool() -> Tool:
+    return Tool(name="search", func=search, description="search")
+
+
+def pool_tool() -> Tool:
+    return offload_tool(
+        Tool(name="search", func=search, description="search"),
+        ToolExecutor(8, TIMEOUT),
+    )
+
+
+async def measure(tool: Tool, queries: list) -> dict:
+    """
+    Calls a tool concurrently and measures the lag of the event loop meanwhile.
+
+    Args:
+        tool (Tool): The tool.
+        queries (list): One query per call.
+
+    Returns:
+        dict: The median and maximal lag of the ticker in milliseconds and the total time in seconds.
+    """
+    lags = []
+    done = False
+
+    async def ticker():
+        while not done:
+            start = time.perf_counter()
+            await asyncio.sleep(TICK)
+            lags.append((time.perf_counter() - start - TICK) * 1000)
+
+    ticking = asyncio.create_task(ticker())
+    await asyncio.sleep(TICK * 2)
+    start = time.perf_counter()
+    await asyncio.gather(*(tool.arun(q) for q in queries))
+    total = time.perf_counter() - start
+    done = True
+    await ticking
+    return {"median": statistics.median(lags), "max": max(lags), "total": total}
+
+
+async def main():
+    rounds = [
+        ("calls", [f"query {i}" for i in range(N_CALLS)]),
+        ("calls + 1 hanging", [f"query {i}" for i in range(N_CALLS - 1)] + ["hang"]),
+    ]
+    modes = [
+        ("event loop", inline_tool),
+        ("default executor", default_executor_tool),
+        ("offload_tool", pool_tool),
+    ]
+    print(
+        f"{'round':>18} {'mode':>17} {'median lag ms':>14} {'max lag ms':>11} {'total s':>8}"
+    )
+    for round_name, queries in rounds:
+        for mode_name, build in modes:
+            s = await measure(build(), queries)
+            print(
+                f"{round_name:>18} {mode_name:>17} {s['median']:>14.1f} {s['max']:>11.1f} {s['total']:>8.2f}"
+            )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
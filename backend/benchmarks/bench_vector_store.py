@@ -0,0 +1,134 @@
+"""
+Benchmark of retrieval latency with the local FAISS store against Pinecone.
+
+Both stores hold the same random unit vectors and are queried through the retriever of the app
+(`ScoredVectorStoreRetriever` with a score threshold). Pinecone is stubbed: its `query` searches the vectors with
+numpy after sleeping for one network round trip, so only the transport differs from a real index. The embedding
+model returns precomputed vectors and takes no time.
+
+Run from the backend folder:
+    python -m benchmarks.bench_vector_store
+"""
+
+import tempfile
+import time
+import numpy as np
+import pinecone
+from langchain.schema import Document
+from langchain.schema.embeddings import Embeddings
+from langchain.vectorstores import Pinecone
+from utils.faiss_store import build_faiss_store
+from utils.retrievers import ScoredVectorStoreRetriever
+
+N_DOCS = 5_000
+DIM = 1536  # text-embedding-ada-002
+N_QUERIES = 200
+PINECONE_RTT = 0.030  # seconds, a managed index in a nearby region
+SEARCH_KWARGS = {"score_threshold": 0.1, "k": 1}
+
+
+class LookupEmbeddings(Embeddings):
+    """
+    Embeddings returning precomputed vectors, the text is the row number.
+    """
+
+    def __init__(self, vectors: np.ndarray) -> None:
+        self.vectors = vectors
+
+    def embed_documents(self, texts):
+        return [self.embed_query(text) for text in texts]
+
+    def embed_query(self, text):
+        return self.vectors[int(text.split()[0])].tolist()
+
+
+class StubPineconeIndex(pinecone.index.Index):
+    """
+    In-process stand-in of a Pinecone cosine index, delayed by one network round trip per query.
+    """
+
+    def __init__(self, vectors: np.ndarray, documents: list) -> None:
+        self.vectors = vectors
+        self.documents = documents
+
+    def query(self, vector, top_k, include_metadata, namespace, filter):
+        time.sleep(PINECONE_RTT)
+        scores = self.vectors @ np.asarray(vector[0], dtype=np.float32)
+        rows = np.argsort(-scores)[:top_k]
+        return {
+            "matches": [
+                {
+                    "score": float(scores[row]),
+                    "metadata": {
+                        "text": self.documents[row].page_content,
+                        **self.documents[row].metadata,
+                    },
+                }
+                for row in rows
+            ]
+        }
+
+
+def measure(retriever: ScoredVectorStoreRetriever, queries: list) -> dict:
+    """
+    Runs the queries one after the other through a retriever.
+
+    Args:
+        retriever (ScoredVectorStoreRetriever): The retriever to benchmark.
+        queries (list): The query strings.
+
+    Returns:
+        dict: Median and 95th percentile latency in milliseconds, and the source retrieved for each query.
+    """
+    latencies, sources = [], []
+    for query in queries:
+        start = time.perf_counter()
+        docs = retriever.get_relevant_documents(query)
+        latencies.append((time.perf_counter() - start) * 1000)
+        sources.append(docs[0].metadata["source"] if docs else None)
+    return {
+        "p50": np.percentile(latencies, 50),
+        "p95": np.percentile(latencies, 95),
+        "sources": sources,
+    }
+
+
+if __name__ == "__main__":
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((N_DOCS + N_QUERIES, DIM)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    # Queries are noisy copies of documents, so each has a clear nearest neighbour
+    vectors[N_DOCS:] = vectors[:N_QUERIES] + vectors[N_DOCS:]
+    vectors[N_DOCS:] /= np.linalg.norm(vectors[N_DOCS:], axis=1, keepdims=True)
+    embeddings = LookupEmbeddings(vectors)
+    documents = [
+        Document(page_content=f"{i} text", metadata={"source": f"https://doc/{i}"})
+        for i in range(N_DOCS)
+    ]
+    queries = [f"{N_DOCS + i} query" for i in range(N_QUERIES)]
+
+    with tempfile.TemporaryDirectory() as path:
+        stores = {
+            "pinecone (stub)": Pinecone(
+                StubPineconeIndex(vectors[:N_DOCS], documents), embeddings, "text"
+            ),
+            "faiss (mmap)": build_faiss_store(documents, embeddings, path),
+        }
+        results = {
+            name: measure(
+                ScoredVectorStoreRetriever(
+                    vectorstore=store,
+                    search_type="similarity_score_threshold",
+                    search_kwargs=SEARCH_KWARGS,
+                ),
+                queries,
+            )
+            for name, store in stores.items()
+        }
+
+    print(f"{N_DOCS} documents of dimension {DIM}, {N_QUERIES} queries")
+    print(f"{'store':>16} {'p50 ms':>8} {'p95 ms':>8}")
+    for name, r in results.items():
+        print(f"{name:>16} {r['p50']:>8.2f} {r['p95']:>8.2f}")
+    same = [r["sources"] for r in results.values()]
+    print(f"same source for all queries: {same[0] == same[1]}")
@@ -10,9 +10,95 @@ class Settings(BaseSettings):
     PINECONE_API_KEY: str = os.getenv("PINECONE_API_KEY", "default_pinecone_api_key")
     PINECONE_ENV: str = os.getenv("PINECONE_ENV", "gcp-starter")
     INDEX_NAME: str = os.getenv("INDEX_NAME", "brainsoft")
+    # Vector store of the documentation, "pinecone" or "faiss" (a local index memory-mapped from FAISS_INDEX_PATH,
+    # built with `python -m utils.faiss_store FAISS_INDEX_PATH`)
+    VECTOR_STORE: str = os.getenv("VECTOR_STORE", "pinecone")
+    FAISS_INDEX_PATH: str = os.getenv("FAISS_INDEX_PATH", "")
+    # BM25 over the same chunks fused with the vector search. The chunks of Pinecone are exported from the index at
+    # startup, or read from BM25_CORPUS_PATH where the export is saved
+    HYBRID_RETRIEVAL: bool = os.getenv("HYBRID_RETRIEVAL", "true").lower() == "true"
+    BM25_CORPUS_PATH: str = os.getenv("BM25_CORPUS_PATH", "")
+    # Documents less similar to the query than RETRIEVAL_SIMILARITY are not retrieved. Queries whose best document
+    # has a cosine similarity of at least FAST_PATH_SIMILARITY skip the agent for a single LLM chain call
+    RETRIEVAL_SIMILARITY: float = float(os.getenv("RETRIEVAL_SIMILARITY", "0.7"))
+    FAST_PATH_ENABLED: bool = os.getenv("FAST_PATH_ENABLED", "true").lower() == "true"
+    FAST_PATH_SIMILARITY: float = float(os.getenv("FAST_PATH_SIMILARITY", "0.85"))
+    # Start the agent while the routing retrieval runs: saves the retrieval time on the agent path, but the planning
+    # call of the agent is billed and counted in the rate limits on the fast path too, where it is cancelled
+    FAST_PATH_SPECULATIVE_AGENT: bool = (
+        os.getenv("FAST_PATH_SPECULATIVE_AGENT", "false").lower() == "true"
+    )
+    # Seconds allowed to answer an agent request, clients may ask for another deadline up to REQUEST_DEADLINE_MAX.
+    # The agent is stopped DEADLINE_RESERVE seconds before the deadline to write its final answer in time
+    REQUEST_DEADLINE: float = float(os.getenv("REQUEST_DEADLINE", "60"))
+    REQUEST_DEADLINE_MAX: float = float(os.getenv("REQUEST_DEADLINE_MAX", "120"))
+    DEADLINE_RESERVE: float = float(os.getenv("DEADLINE_RESERVE", "10"))
+    # Chains of the API keys and models set by sessions, the least recently used or idle ones are dropped
+    CHAIN_POOL_SIZE: int = int(os.getenv("CHAIN_POOL_SIZE", "32"))
+    CHAIN_POOL_IDLE_TTL: float = float(os.getenv("CHAIN_POOL_IDLE_TTL", "3600"))
+    # API key and model pairs validated within the TTL are accepted without calling OpenAI again
+    KEY_VALIDATION_TIMEOUT: float = float(os.getenv("KEY_VALIDATION_TIMEOUT", "10"))
+    KEY_VALIDATION_TTL: float = float(os.getenv("KEY_VALIDATION_TTL", "3600"))
+    KEY_VALIDATION_CACHE_SIZE: int = int(os.getenv("KEY_VALIDATION_CACHE_SIZE", "1024"))
+    # Build the chains in the background after the worker starts, /ready tells when they are usable
+    LAZY_STARTUP: bool = os.getenv("LAZY_STARTUP", "false").lower() == "true"
+    # File shared by the workers of the host to propagate API key and model updates, empty for a single worker
+    CONFIG_CHANNEL_PATH: str = os.getenv("CONFIG_CHANNEL_PATH", "")
+    CONFIG_POLL_INTERVAL: float = float(os.getenv("CONFIG_POLL_INTERVAL", "1"))
+    # Documents uploaded for /llm_chat, split into chunks of DOCUMENT_CHUNK_SIZE characters. The texts are kept in
+    # the SQLite file DOCUMENT_STORE_PATH shared by the workers of the host, in memory only when the path is empty
+    DOCUMENT_STORE_SIZE: int = int(os.getenv("DOCUMENT_STORE_SIZE", "64"))
+    DOCUMENT_STORE_TTL: float = float(os.getenv("DOCUMENT_STORE_TTL", "86400"))
+    DOCUMENT_STORE_PATH: str = os.getenv("DOCUMENT_STORE_PATH", "")
+    DOCUMENT_CHUNK_SIZE: int = int(os.getenv("DOCUMENT_CHUNK_SIZE", "1500"))
+    DOCUMENT_CHUNK_OVERLAP: int = int(os.getenv("DOCUMENT_CHUNK_OVERLAP", "200"))
+    # Tokens of context sent to /llm_chat, within the context window of the model minus the prompt and the answer
+    DOCUMENT_CONTEXT_TOKENS: int = int(os.getenv("DOCUMENT_CONTEXT_TOKENS", "3000"))
+    DOCUMENT_ANSWER_TOKENS: int = int(os.getenv("DOCUMENT_ANSWER_TOKENS", "1024"))
+    # Tokens of chat history added to a query, at most a quarter of the context window of the model. The token count
+    # of each past exchange is cached
+    HISTORY_TOKENS: int = int(os.getenv("HISTORY_TOKENS", "1000"))
+    HISTORY_TOKEN_CACHE_SIZE: int = int(os.getenv("HISTORY_TOKEN_CACHE_SIZE", "4096"))
+    # Rolling summary of each session, refreshed in the background by SUMMARY_MODEL once SUMMARY_EVERY_TURNS exchanges
+    # follow it, the last SUMMARY_KEEP_TURNS exchanges are always sent verbatim
+    SUMMARY_ENABLED: bool = os.getenv("SUMMARY_ENABLED", "true").lower() == "true"
+    SUMMARY_MODEL: str = os.getenv("SUMMARY_MODEL", "gpt-3.5-turbo")
+    SUMMARY_MAX_TOKENS: int = int(os.getenv("SUMMARY_MAX_TOKENS", "256"))
+    SUMMARY_EVERY_TURNS: int = int(os.getenv("SUMMARY_EVERY_TURNS", "4"))
+    SUMMARY_KEEP_TURNS: int = int(os.getenv("SUMMARY_KEEP_TURNS", "2"))
+    # Threads running the blocking calls of the agent tools and of the retriever, each call is abandoned after
+    # TOOL_TIMEOUT seconds
+    TOOL_THREADS: int = int(os.getenv("TOOL_THREADS", "8"))
+    TOOL_TIMEOUT: float = float(os.getenv("TOOL_TIMEOUT", "20"))
+    # Results of the DuckDuckGo tool by normalized query, searched again after SEARCH_CACHE_TTL seconds. Older results
+    # are kept SEARCH_CACHE_STALE_TTL seconds for when a search fails or takes longer than SEARCH_TIMEOUT seconds
+    SEARCH_CACHE_SIZE: int = int(os.getenv("SEARCH_CACHE_SIZE", "1024"))
+    SEARCH_CACHE_TTL: float = float(os.getenv("SEARCH_CACHE_TTL", "3600"))
+    SEARCH_CACHE_STALE_TTL: float = float(os.getenv("SEARCH_CACHE_STALE_TTL", "86400"))
+    SEARCH_CONCURRENCY: int = int(os.getenv("SEARCH_CONCURRENCY", "4"))
+    SEARCH_TIMEOUT: float = float(os.getenv("SEARCH_TIMEOUT", "10"))
     EMBEDDING_NAME: str = os.getenv("EMBEDDING_NAME", "default_ambeddings")
     LLM_NAME: str = os.getenv("LLM_NAME", "default_LLM")
     MONGO_DB_KEY: str = os.getenv("MONGO_DB_KEY", "default_MONGO_DB_KEY")
+    # Streamed tokens are coalesced into chunks of this many bytes or this many milliseconds
+    STREAM_FLUSH_BYTES: int = int(os.getenv("STREAM_FLUSH_BYTES", "256"))
+    STREAM_FLUSH_MS: float = float(os.getenv("STREAM_FLUSH_MS", "40"))
+    # Semantic cache of agent answers, keyed by query embedding, API key and model, SEMANTIC_CACHE_SIZE answers in all
+    SEMANTIC_CACHE_ENABLED: bool = (
+        os.getenv("SEMANTIC_CACHE_ENABLED", "true").lower() == "true"
+    )
+    SEMANTIC_CACHE_THRESHOLD: float = float(
+        os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.95")
+    )
+    SEMANTIC_CACHE_SIZE: int = int(os.getenv("SEMANTIC_CACHE_SIZE", "1000"))
+    SEMANTIC_CACHE_TTL: float = float(os.getenv("SEMANTIC_CACHE_TTL", "86400"))
+    # Exact-match cache of LLM chain answers, the on-disk tier is disabled when the path is empty
+    RESPONSE_CACHE_SIZE: int = int(os.getenv("RESPONSE_CACHE_SIZE", "512"))
+    RESPONSE_CACHE_TTL: float = float(os.getenv("RESPONSE_CACHE_TTL", "86400"))
+    RESPONSE_CACHE_PATH: str = os.getenv("RESPONSE_CACHE_PATH", "")
+    # Query embeddings cache, the memory-mapped on-disk tier is disabled when the folder is empty
+    EMBEDDING_CACHE_SIZE: int = int(os.getenv("EMBEDDING_CACHE_SIZE", "2048"))
+    EMBEDDING_CACHE_DIR: str = os.getenv("EMBEDDING_CACHE_DIR", "")
 
 
 # Instantiate settings to be imported by other modules
@@ -15,5 +15,10 @@ if [ $TEST_EXIT_CODE -ne 0 ]; then
 else
     echo "Tests passed, starting the FastAPI application..."
     echo "Starting the FastAPI application with Gunicorn"
-    exec gunicorn main:app --workers 1 --worker-class uvicorn.workers.UvicornWorker --bind 0.0.0.0:8000 --timeout 2000
+    # One worker per core by default, API key and model updates reach every worker through a shared file, the keys
+    # themselves through a file next to it that only the user running the workers can read
+    export CONFIG_CHANNEL_PATH="${CONFIG_CHANNEL_PATH:-/tmp/backend_config.json}"
+    # Uploaded documents are found by every worker
+    export DOCUMENT_STORE_PATH="${DOCUMENT_STORE_PATH:-/tmp/backend_documents.db}"
+    exec gunicorn main:app --workers "${WORKERS:-$(nproc)}" --worker-class uvicorn.workers.UvicornWorker --bind 0.0.0.0:8000 --timeout 2000
 fi
\ No newline at end of file
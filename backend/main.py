@@ -11,3 +11,25 @@ app = FastAPI(
 
 app.include_router(chat_router, tags=["generation"])
 app.include_router(chat_history_router, tags=["mongo_db"])
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Runs the backend API.")
+    parser.add_argument(
+        "--profile-startup",
+        action="store_true",
+        help="Print the import time per module and the initialization time per chain component, then exit.",
+    )
+    args = parser.parse_args()
+
+    if args.profile_startup:
+        from routers.generation import build_default_chains
+        from utils.startup_profile import print_startup_profile
+
+        print_startup_profile("main", build_default_chains)
+    else:
+        import uvicorn
+
+        uvicorn.run(app, host="0.0.0.0", port=8000)
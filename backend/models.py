@@ -1,14 +1,27 @@
 from pydantic import BaseModel
-from typing import List
+from typing import List, Optional
+
+
+class Summary(BaseModel):
+    text: str
+    turns: int
 
 
 class ChatHistoryResponse(BaseModel):
     chat_history: List[List[str]]
+    summary: Optional[Summary] = None
 
 
 class Query(BaseModel):
     text: str
+    history: Optional[List[List[str]]] = None
+    summary: Optional[Summary] = None
 
 
 class MessageResponse(BaseModel):
     message: str
+
+
+class DocumentUpload(BaseModel):
+    text: str
+    name: Optional[str] = None
@@ -3,6 +3,7 @@ from typing import List
 from models import *
 from utils.dependencies_chat_history import *
 from utils.error_handler import *
+from config import settings
 import logging
 from mongo_db import database
 
@@ -35,6 +36,8 @@ router.add_event_handler("startup", init_mongo_DB)
 async def save_chat_history(session_id: str, history_items: List[List[str]]):
     """
     Saves or updates the chat history for a given session.
+    Once enough exchanges follow the summary of the session, it is refreshed in the background, see
+    `ConversationSummarizer`.
 
     Args:
         session_id (str): The unique identifier for the chat session.
@@ -48,7 +51,10 @@ async def save_chat_history(session_id: str, history_items: List[List[str]]):
     """
     global db
     try:
-        return await update_or_insert_chat_history(db, session_id, history_items)
+        response = await update_or_insert_chat_history(db, session_id, history_items)
+        if settings.SUMMARY_ENABLED:
+            conversation_summarizer.refresh(db, session_id, settings.OPENAI_API_KEY)
+        return response
 
     except UpdateError as e:
         raise HTTPException(status_code=e.status_code, detail=e.message)
@@ -67,7 +73,8 @@ async def get_chat_history(session_id: str):
         session_id (str): The unique identifier for the chat session.
 
     Returns:
-        ChatHistoryResponse: The chat history associated with the given session.
+        ChatHistoryResponse: The chat history associated with the given session, and the summary of its first
+        exchanges once there is one.
 
     Raises:
         HTTPException: If there's an error during the retrieval of chat history.
@@ -0,0 +1,138 @@
+import asyncio
+import re
+import pytest
+from typing import Any, List, Optional
+from langchain.callbacks.manager import (
+    AsyncCallbackManagerForLLMRun,
+    CallbackManagerForLLMRun,
+)
+from langchain.chat_models.base import BaseChatModel
+from langchain.schema import (
+    AIMessage,
+    BaseMessage,
+    BaseRetriever,
+    ChatGeneration,
+    ChatResult,
+    Document,
+)
+
+REQUEST_ID = re.compile(r"request-(\d+)")
+
+
+class FakeStreamingChatModel(BaseChatModel):
+    """
+    A chat model stub that streams an answer tagged with the request id found in its prompt.
+
+    In agent format it first calls the `Doc_search` tool and answers only after seeing the tool response,
+    so every request makes two LLM calls. Each token is preceded by a yield to the event loop, so concurrent
+    requests interleave their tokens the same way real OpenAI streams do.
+
+    Attributes:
+        agent_format (bool): Whether to answer in the JSON format of the conversational agent.
+        script (List[str], optional): Tokens streamed by every call instead, e.g. a tool call repeated forever.
+        token_interval (float): Seconds before each token.
+        produced (int): Number of tokens streamed.
+        cancelled (bool): Whether a call was cancelled while streaming.
+    """
+
+    agent_format: bool = True
+    script: Optional[List[str]] = None
+    token_interval: float = 0.0
+    produced: int = 0
+    cancelled: bool = False
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-streaming-chat"
+
+    def _tokens(self, messages: List[BaseMessage]) -> List[str]:
+        if self.script is not None:
+            return list(self.script)
+        request_id = REQUEST_ID.findall(" ".join(m.content for m in messages))[-1]
+        answer = ["Answer", " for", f" request-{request_id}", "."]
+        if not self.agent_format:
+            return answer
+        if not any("TOOL RESPONSE" in m.content for m in messages):
+            action, answer = "Doc_search", [f"request-{request_id}"]
+        else:
+            action = "Final Answer"
+        return (
+            ["```json\n{\n", f'    "action": "{action[:5]}', f'{action[5:]}",\n']
+            + ['    "action_input": "']
+            + answer
+            + ['"\n}\n```']
+        )
+
+    def _generate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        raise NotImplementedError("Only async generation is used in these tests.")
+
+    async def _agenerate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        tokens = self._tokens(messages)
+        try:
+            for token in tokens:
+                await asyncio.sleep(self.token_interval)
+                self.produced += 1
+                if run_manager:
+                    await run_manager.on_llm_new_token(token)
+        except asyncio.CancelledError:
+            self.cancelled = True
+            raise
+        message = AIMessage(content="".join(tokens))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+
+class FakeRetriever(BaseRetriever):
+    """
+    A retriever stub counting its calls, slow enough to still be running when an unused prefetch is discarded.
+
+    Attributes:
+        calls (int): Number of retrievals started.
+        cancelled (int): Number of retrievals cancelled before returning.
+        delay (float): Seconds taken by a retrieval.
+    """
+
+    calls: int = 0
+    cancelled: int = 0
+    delay: float = 0.001
+
+    def _get_relevant_documents(self, query: str, *, run_manager) -> List[Document]:
+        raise NotImplementedError("Only async retrieval is used in these tests.")
+
+    async def _aget_relevant_documents(
+        self, query: str, *, run_manager
+    ) -> List[Document]:
+        self.calls += 1
+        try:
+            await asyncio.sleep(self.delay)
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        return [Document(page_content=f"Documents about {query}")]
+
+
+@pytest.fixture
+def fake_chat_model():
+    """
+    Builds fake chat models, see `FakeStreamingChatModel`.
+    """
+    return FakeStreamingChatModel
+
+
+@pytest.fixture
+def fake_retriever():
+    """
+    Builds fake retrievers, see `FakeRetriever`.
+    """
+    return FakeRetriever
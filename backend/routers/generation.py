@@ -3,32 +3,410 @@ from utils.dependencies_generation import *
 from utils.error_handler import *
 from utils.callback_handler_agent import *
 from utils.callback_handler_chain import *
+from utils.stream_buffer import *
+from utils.semantic_cache import SemanticCache
+from utils.response_cache import ResponseCache, normalize_query, response_cache_key
+from utils.single_flight import SingleFlight
+from utils.fast_path import *
+from utils.speculative import speculation_stats, start_prefetch
+from utils.deadline import request_budget, with_deadline
+from utils.chain_pool import ChainPool, key_fingerprint
+from utils.startup_profile import startup_profile
+from utils.config_channel import create_config_channel
+from utils.embedding_cache import embedding_caches
+from utils.document_store import DocumentStore, StoredDocument
+from utils.token_budget import context_window, count_tokens
+from utils.prompt_assembler import PromptAssembler
+from utils.dependencies_chat_history import (
+    chat_history_collection,
+    has_chat_history,
+    load_chat_history,
+    save_answer_later,
+    save_turn_later,
+)
 from fastapi import APIRouter, HTTPException, Body
 from config import settings
 from dotenv import load_dotenv
 from fastapi.responses import StreamingResponse
+from typing import List, Optional
+import asyncio
 import logging
-
+import threading
+import time
 
 load_dotenv()
 
 router = APIRouter()
 
+semantic_cache = SemanticCache(
+    settings.SEMANTIC_CACHE_THRESHOLD,
+    settings.SEMANTIC_CACHE_SIZE,
+    settings.SEMANTIC_CACHE_TTL,
+)
+response_cache = ResponseCache(
+    settings.RESPONSE_CACHE_SIZE,
+    settings.RESPONSE_CACHE_TTL,
+    settings.RESPONSE_CACHE_PATH or None,
+)
+single_flight = SingleFlight()
+document_store = DocumentStore(
+    settings.DOCUMENT_STORE_SIZE,
+    settings.DOCUMENT_STORE_TTL,
+    settings.DOCUMENT_CHUNK_SIZE,
+    settings.DOCUMENT_CHUNK_OVERLAP,
+    settings.DOCUMENT_STORE_PATH or None,
+)
+route_stats = RouteStats()
+prompt_assembler = PromptAssembler(
+    settings.HISTORY_TOKENS, settings.HISTORY_TOKEN_CACHE_SIZE
+)
+
+# Set once the default chains are built, in the background with LAZY_STARTUP
+chains_ready = threading.Event()
+startup_error = None
+
+# API keys and models set on any worker of the host
+config_channel = create_config_channel(
+    settings.CONFIG_CHANNEL_PATH, settings.CONFIG_POLL_INTERVAL
+)
+applied_version = 0
+
+
+def build_chains(api_key: str, model: str):
+    """
+    Builds the agent and LLM chain of an API key and model on the shared retriever and tools.
 
-def startup_event():
+    Args:
+        api_key (str): The OpenAI API key.
+        model (str): The model name.
+
+    Returns:
+        tuple: The agent and the LLM chain.
     """
-    Event handler for application startup. Initializes the conversational agent, retriever, and LLM.
-    This function sets up the conversational chain by calling `setup_conversational_chain` with the settings.
+    global tools
+
+    return setup_llm_chains(api_key, model, tools)
+
+
+chain_pool = ChainPool(
+    build_chains, settings.CHAIN_POOL_SIZE, settings.CHAIN_POOL_IDLE_TTL
+)
+
+
+def session_chains(session_id: Optional[str], client_id: Optional[str] = None):
+    """
+    Selects the chains answering a request.
+
+    Args:
+        session_id (str, optional): The session of the request.
+        client_id (str, optional): The client sending it, e.g. a browser, whose API key and model are kept when it
+            starts a new session. Defaults to None.
+
+    Returns:
+        tuple: The agent and LLM chain of the API key and model set by the client, or else by the session, or the
+        default ones.
+    """
+    global agent
+    global llm
+
+    require_ready()
+    return chain_pool.for_session(client_id or session_id) or (agent, llm)
+
+
+def load_document(document_id: Optional[str], model: str) -> Optional[StoredDocument]:
+    """
+    Loads an uploaded document and counts the tokens of its chunks for a model.
+
+    Args:
+        document_id (str, optional): The id returned by `upload_document`.
+        model (str): The name of the model the document is sent to.
+
+    Returns:
+        Optional[StoredDocument]: The document, None without an id.
 
     Raises:
-        HTTPException: An exception with the appropriate status code and message is raised if there is an error during initialization.
+        UpdateError: With status 404 if the document is unknown or expired.
+    """
+    if not document_id:
+        return None
+    document = document_store.get(document_id)
+    if document is None:
+        raise UpdateError(
+            f"Unknown or expired document {document_id}, upload it again", 404
+        )
+    document.chunk_tokens(model)
+    return document
+
+
+def select_context(
+    query: str,
+    context: Optional[str],
+    document: Optional[StoredDocument],
+    llm: object,
+    question: Optional[str] = None,
+):
+    """
+    Selects the context of an LLM chain request within the token budget of its model.
+
+    Args:
+        query (str): The query string.
+        context (str, optional): The context sent with the request.
+        document (StoredDocument, optional): The uploaded document, see `load_document`, used instead of the
+            context.
+        llm (object): The LLM chain answering the request.
+        question (str, optional): The question the chunks are ranked against, without the chat history added to
+            the query. Defaults to the query.
+
+    Returns:
+        tuple: The context sent to the model, and the number of tokens of the context and of the whole prompt.
+
+    The context is limited to DOCUMENT_CONTEXT_TOKENS, and to what the context window of the model leaves after the
+    prompt and DOCUMENT_ANSWER_TOKENS for the answer. A longer context is reduced to its chunks most relevant to the
+    query, see `StoredDocument.select`.
+
+    Raises:
+        UpdateError: With status 422 if neither a context nor a document is given.
+    """
+    model = llm.llm.model_name
+    prompt_tokens = count_tokens(llm.prompt.format(input=query, context=""), model)
+    max_tokens = max(
+        min(
+            settings.DOCUMENT_CONTEXT_TOKENS,
+            context_window(model) - settings.DOCUMENT_ANSWER_TOKENS - prompt_tokens,
+        ),
+        0,
+    )
+
+    if document is None:
+        if context is None:
+            raise UpdateError("Either a context or a document_id is required", 422)
+        context_tokens = count_tokens(context, model)
+        if context_tokens <= max_tokens:
+            return context, context_tokens, prompt_tokens + context_tokens
+        document = StoredDocument(
+            context, settings.DOCUMENT_CHUNK_SIZE, settings.DOCUMENT_CHUNK_OVERLAP
+        )
+
+    context, context_tokens = document.select(question or query, model, max_tokens)
+    return context, context_tokens, prompt_tokens + context_tokens
+
+
+def require_ready():
+    """
+    Checks that the default chains, retriever and tools are built.
+
+    Raises:
+        UpdateError: With status 503 while they are built in the background, or if building them failed.
+    """
+    if not chains_ready.is_set():
+        raise UpdateError(
+            startup_error or "The chains are still being initialized, see /ready", 503
+        )
+
+
+def apply_config(config: dict):
+    """
+    Applies the API keys and models set on any worker, so that every worker answers with the same chains.
+
+    Args:
+        config (dict): The shared configuration, see `ConfigChannel`.
+
+    The default agent and LLM are rebuilt if the default API key or model changed. Sessions are bound to their API
+    key and model, their chains are built by their next request on this worker. The configuration only holds key
+    fingerprints, the keys are read from the private key store of the channel, see `ConfigChannel.store_key`.
+    """
+    global agent
+    global llm
+    global tools
+    global applied_version
+
+    if not chains_ready.is_set() or config["version"] <= applied_version:
+        return
+    default = config["default"]
+    if default and (default["key"], default["model"]) != (
+        key_fingerprint(settings.OPENAI_API_KEY),
+        settings.LLM_NAME,
+    ):
+        api_key = known_key(default["key"])
+        agent, llm = setup_llm_chains(api_key, default["model"], tools)
+        settings.OPENAI_API_KEY = api_key
+        settings.LLM_NAME = default["model"]
+    for session_id, binding in config["sessions"].items():
+        try:
+            chain_pool.assign(session_id, known_key(binding["key"]), binding["model"])
+        except UpdateError:
+            # Logged by UpdateError, the session keeps its previous chains on this worker
+            continue
+    applied_version = config["version"]
+
+
+def known_key(fingerprint: str) -> str:
+    """
+    Returns the API key of a fingerprint, stored by any worker or set in the environment.
+
+    Args:
+        fingerprint (str): The fingerprint of the key, see `key_fingerprint`.
+
+    Returns:
+        str: The API key.
+
+    Raises:
+        UpdateError: If the key store of the channel lost the key, e.g. because it was deleted. The configuration is
+            applied again at its next change.
+    """
+    if key_fingerprint(settings.OPENAI_API_KEY) == fingerprint:
+        return settings.OPENAI_API_KEY
+    api_key = config_channel.load_key(fingerprint)
+    if api_key is None:
+        raise UpdateError(
+            f"The API key {fingerprint} is missing from the key store", 500
+        )
+    return api_key
+
+
+def set_default_key(config: dict, fingerprint: str, model: str):
+    config["default"] = {"key": fingerprint, "model": model}
+
+
+def set_session_key(config: dict, session_id: str, fingerprint: str, model: str):
+    now = time.time()
+    # Sessions inactive for longer than the chain pool TTL are dropped from the shared configuration too
+    config["sessions"] = {
+        k: v
+        for k, v in config["sessions"].items()
+        if now - v["updated"] <= settings.CHAIN_POOL_IDLE_TTL
+    }
+    config["sessions"][session_id] = {
+        "key": fingerprint,
+        "model": model,
+        "updated": now,
+    }
+
+
+def cache_scope(llm: object) -> str:
+    """
+    Returns the namespace of the semantic cache answers of an LLM chain.
+
+    Args:
+        llm (object): The LLM chain, or the one of the agent, answering the query.
+
+    Returns:
+        str: The fingerprint of its API key and its model name.
+    """
+    return f"{key_fingerprint(llm.llm.openai_api_key)}:{llm.llm.model_name}"
+
+
+async def lookup_semantic_cache(question: str, prompt: str, llm: object):
+    """
+    Embeds a standalone question and looks for a cached answer to a similar one, generated with the same API key
+    and model.
+
+    Args:
+        question (str): The question of the user.
+        prompt (str): The input of the model, the question with the part of the conversation it follows.
+        llm (object): The LLM chain answering the query, see `cache_scope`.
+
+    Returns:
+        tuple: The question embedding and the cached answer, each None if unavailable.
+
+    A question following earlier exchanges may refer to them, so it is neither looked up nor cached. Embedding
+    errors are logged and only disable the cache for this request.
+    """
+    global retriever
+
+    if not settings.SEMANTIC_CACHE_ENABLED or prompt != question:
+        return None, None
+    try:
+        vector = await embed_query(retriever, question)
+    except Exception as e:
+        logging.warning(f"Semantic cache lookup skipped, embedding failed: {str(e)}")
+        return None, None
+    return vector, semantic_cache.lookup(cache_scope(llm), vector)
+
+
+def cached_answer(answer: str):
+    """
+    Splits a cached answer and marks its metadata as served from the cache.
+
+    Args:
+        answer (str): The cached answer with its metadata event.
+
+    Returns:
+        tuple: The answer text and its metadata.
+    """
+    output, metadata = split_metadata(answer)
+    return output, {**(metadata or {}), "path": CACHE_PATH}
+
+
+def cache_answer(scope: str, vector: list, answer: str):
+    """
+    Stores an agent answer in the semantic cache, unless the agent was stopped before answering by itself.
+
+    Args:
+        scope (str): The namespace of the answer, see `cache_scope`.
+        vector (list): The question embedding.
+        answer (str): The answer with its metadata event.
+    """
+    _, metadata = split_metadata(answer)
+    if metadata and (metadata.get("early_stop") or metadata.get("partial")):
+        return
+    semantic_cache.store(scope, vector, answer)
+
+
+def build_default_chains():
+    """
+    Sets up the retriever and tools shared by every chain, then the default agent and LLM chain of the settings.
+    The duration of each step is recorded in `startup_profile`.
+
+    Raises:
+        UpdateError: If there is an error during the initialization of any component.
     """
     global agent
     global retriever
     global llm
+    global tools
 
+    startup_profile.start()
     try:
-        agent, retriever, llm = setup_conversational_chain(settings)
+        retriever, tools = setup_retrieval(settings)
+        agent, llm = setup_llm_chains(settings.OPENAI_API_KEY, settings.LLM_NAME, tools)
+    finally:
+        startup_profile.stop()
+    chains_ready.set()
+    # A worker started after a key update applies it too
+    apply_config(config_channel.read())
+
+
+def warm_up():
+    """
+    Builds the default chains in the background, keeping the error reported by `/ready` if it fails.
+    """
+    global startup_error
+
+    try:
+        build_default_chains()
+    except UpdateError as e:
+        startup_error = e.message
+    except Exception as e:
+        startup_error = f"Unexpected error during agent initialization: {str(e)}"
+        logging.error(startup_error)
+
+
+def startup_event():
+    """
+    Event handler for application startup. Initializes the conversational agent, retriever, and LLM.
+    With LAZY_STARTUP the chains are built in a background thread, so the worker accepts requests at once and
+    `/ready` tells when they can be answered. Otherwise they are built before the worker accepts requests.
+
+    Raises:
+        HTTPException: An exception with the appropriate status code and message is raised if there is an error during initialization.
+    """
+    if settings.LAZY_STARTUP:
+        threading.Thread(target=warm_up, daemon=True).start()
+        return
+
+    try:
+        build_default_chains()
 
     except UpdateError as e:
         raise HTTPException(status_code=e.status_code, detail=e.message)
@@ -41,6 +419,18 @@ def startup_event():
 router.add_event_handler("startup", startup_event)
 
 
+async def start_config_watch():
+    """
+    Event handler for application startup. Applies the API keys and models set on the other workers.
+    """
+    global config_watch
+
+    config_watch = asyncio.create_task(config_channel.watch(apply_config))
+
+
+router.add_event_handler("startup", start_config_watch)
+
+
 @router.get("/health")
 async def health():
     """
@@ -53,14 +443,45 @@ async def health():
     return {"status": "🤙"}
 
 
+@router.get("/ready")
+async def ready():
+    """
+    Readiness endpoint for the API.
+    Unlike `/health`, it only succeeds once the chains are built and requests can be answered.
+
+    Returns:
+        dict: The status of the API and the duration of each initialization step in seconds.
+
+    Raises:
+        HTTPException: With status 503 while the chains are being built or if building them failed.
+    """
+    try:
+        require_ready()
+        return {"status": "ready", "startup": startup_profile.as_dict()}
+    except UpdateError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.message)
+
+
 @router.post("/update_api_key/", status_code=200)
-def update_api_key(api_key: str, model: str):
+async def update_api_key(
+    api_key: str,
+    model: str,
+    session_id: Optional[str] = None,
+    client_id: Optional[str] = None,
+):
     """
-    Updates the OpenAI API key and model. It reinitializes the agent, retriever, and LLM with the new settings.
+    Updates the OpenAI API key and model.
+    With a client or session, its requests are answered by the chains of the new key and model, taken from
+    the chain pool. A client keeps them in the new sessions it starts, e.g. when its conversation is reset. Without one, the default agent and LLM used by requests without a session are rebuilt.
+    The retriever and tools are kept in both cases. Keys validated recently are not checked with OpenAI again,
+    see `validate_openai_api_key`. The change is published to the other workers through the configuration
+    channel, which shares the key itself in a file only readable by the workers, see `ConfigChannel.store_key`.
 
     Args:
         api_key (str): The new API key for OpenAI.
         model (str): The model to be used with the new API key.
+        session_id (str, optional): The session using the key and model. Defaults to None.
+        client_id (str, optional): The client using the key and model in all its sessions. Defaults to None.
 
     Returns:
         dict: A message indicating successful update of the API Key and model.
@@ -68,13 +489,21 @@ def update_api_key(api_key: str, model: str):
     Raises:
         HTTPException: If there's a failure in updating the API Key and model.
     """
-    global agent
-    global retriever
-    global llm
-
     try:
-        settings = update_openai_api_key(api_key, model)
-        agent, retriever, llm = setup_conversational_chain(settings)
+        require_ready()
+        await validate_openai_api_key(api_key, model)
+        owner = client_id or session_id
+        fingerprint = config_channel.store_key(api_key)
+        if owner:
+            chain_pool.bind(owner, api_key, model)
+            config = config_channel.update(
+                lambda c: set_session_key(c, owner, fingerprint, model)
+            )
+        else:
+            config = config_channel.update(
+                lambda c: set_default_key(c, fingerprint, model)
+            )
+        apply_config(config)
         return {"message": f"Your API Key and model are updated successfully."}
 
     except UpdateError as e:
@@ -89,19 +518,24 @@ def update_api_key(api_key: str, model: str):
 
 
 @router.get("/get_current_model/", status_code=200)
-def get_current_model():
+def get_current_model(
+    session_id: Optional[str] = None, client_id: Optional[str] = None
+):
     """
     Retrieves the current model used by the LLM.
 
+    Args:
+        session_id (str, optional): The session whose model is returned. Defaults to None, the default model.
+        client_id (str, optional): The client whose model is returned instead. Defaults to None.
+
     Returns:
         dict: A message containing the current model name.
 
     Raises:
         HTTPException: If there's an error in retrieving the current model.
     """
-    global llm
-
     try:
+        _, llm = session_chains(session_id, client_id)
         return {"message": f"Current model is {str(llm.llm.model_name)}"}
 
     except UpdateError as e:
@@ -116,19 +550,24 @@ def get_current_model():
 
 
 @router.get("/get_current_token/", status_code=200)
-def get_current_token():
+def get_current_token(
+    session_id: Optional[str] = None, client_id: Optional[str] = None
+):
     """
     Retrieves the current OpenAI API token used by the LLM.
 
+    Args:
+        session_id (str, optional): The session whose token is returned. Defaults to None, the default token.
+        client_id (str, optional): The client whose token is returned instead. Defaults to None.
+
     Returns:
         dict: A message containing the current OpenAI API token.
 
     Raises:
         HTTPException: If there's an error in retrieving the current token.
     """
-    global llm
-
     try:
+        _, llm = session_chains(session_id, client_id)
         return {"message": f"Current token is {str(llm.llm.openai_api_key)}"}
 
     except UpdateError as e:
@@ -143,23 +582,99 @@ def get_current_token():
 
 
 @router.get("/chat_no_stream", status_code=200)
-async def chat_nostream(query: str):
+async def chat_nostream(
+    query: str,
+    deadline: Optional[float] = None,
+    max_iterations: Optional[int] = None,
+    session_id: Optional[str] = None,
+    client_id: Optional[str] = None,
+    history: Optional[List[List[str]]] = Body(None, embed=True),
+    summary: Optional[Summary] = Body(None, embed=True),
+):
     """
     Handles conversational queries without streaming.
+    Answers to questions similar to a previous one are served from the semantic cache, see
+    `lookup_semantic_cache`, and documentation questions with a confident retrieval skip the agent, see
+    `routed_call_no_stream`.
 
     Args:
         query (str): The query string for the conversation.
+        deadline (float, optional): Seconds allowed to answer. Defaults to REQUEST_DEADLINE, capped by
+            REQUEST_DEADLINE_MAX.
+        max_iterations (int, optional): Maximal number of agent steps, at most the agent's own limit.
+            Defaults to None.
+        session_id (str, optional): The session whose API key and model answer the query, see `update_api_key`.
+            Defaults to None.
+        client_id (str, optional): The client whose API key and model answer the query instead, kept across the
+            sessions it starts. Defaults to None.
+        history (List[List[str]], optional): The past questions and answers of the conversation, oldest first, sent
+            in the JSON body. The most recent ones that fit the token budget of the model are added to the query,
+            see `PromptAssembler`. Defaults to None.
+        summary (Summary, optional): The summary of the first exchanges of the history returned by
+            `/get_chat_history/`, sent in the JSON body. Only the exchanges it does not cover are added verbatim.
+            Defaults to None.
 
     Returns:
-        Response: The response from the conversational agent.
+        Response: The response, with the source and score of the document it used, the path taken ("cache",
+            "fast" or "agent") and whether it is `partial`. A request cut off by its deadline gets an empty partial
+            answer.
 
     Raises:
         HTTPException: If there's an error during the conversation generation.
     """
-    global agent
+    global retriever
 
     try:
-        return await run_call_no_stream(agent=agent, query=query)
+        budget = request_budget(deadline, max_iterations, settings)
+        agent, llm = session_chains(session_id, client_id)
+        question = query
+        query, _ = prompt_assembler.assemble(
+            query, history, llm.llm.model_name, summary and summary.model_dump()
+        )
+        vector, answer = await lookup_semantic_cache(question, query, llm)
+        if answer is not None:
+            output, metadata = cached_answer(answer)
+            return {
+                "input": query,
+                "chat_history": [],
+                "output": output,
+                **metadata,
+                "partial": False,
+            }
+
+        if settings.FAST_PATH_ENABLED:
+            call = routed_call_no_stream(
+                agent,
+                llm,
+                retriever,
+                query,
+                settings.FAST_PATH_SIMILARITY,
+                route_stats,
+                budget,
+                speculative=settings.FAST_PATH_SPECULATIVE_AGENT,
+            )
+        else:
+            call = agent_call_no_stream(
+                agent, llm, query, start_prefetch(retriever, query), budget
+            )
+        try:
+            response = await asyncio.wait_for(call, budget.remaining())
+        except asyncio.TimeoutError:
+            return {
+                "input": query,
+                "chat_history": [],
+                "output": "",
+                "source": NOT_RETRIEVED,
+                "score": None,
+                "partial": True,
+            }
+        response["partial"] = False
+        if vector is not None and not response.get("early_stop"):
+            source = {"source": response["source"], "score": response["score"]}
+            semantic_cache.store(
+                cache_scope(llm), vector, response["output"] + metadata_event(source)
+            )
+        return response
 
     except UpdateError as e:
         raise HTTPException(status_code=e.status_code, detail=e.message)
@@ -171,25 +686,91 @@ async def chat_nostream(query: str):
         raise HTTPException(status_code=e.status_code, detail=msg)
 
 
+@router.post("/upload_document/", status_code=200)
+def upload_document(document: DocumentUpload = Body(...)):
+    """
+    Stores the text of a document once, so that the LLM chain requests on it only send its id.
+    The text is split into chunks indexed with BM25. Uploading the same text again returns the same id.
+
+    Args:
+        document (DocumentUpload): The text extracted from the document and optionally its file name.
+
+    Returns:
+        dict: The id of the document, its number of characters and of chunks.
+
+    Raises:
+        HTTPException: If the text is empty or there's an error while storing it.
+    """
+    if not document.text.strip():
+        raise HTTPException(status_code=422, detail="The document has no text")
+    try:
+        return document_store.add(document.text).as_dict()
+    except Exception as e:
+        msg = f"Unexpected error while storing the document {document.name}: {str(e)}"
+        logging.error(msg)
+        raise HTTPException(status_code=500, detail=msg)
+
+
 @router.get("/llm_chat_no_stream", status_code=200)
-async def llm_chat_nostream(query: str, context: str):
+async def llm_chat_nostream(
+    query: str,
+    context: Optional[str] = None,
+    document_id: Optional[str] = None,
+    session_id: Optional[str] = None,
+    client_id: Optional[str] = None,
+    history: Optional[List[List[str]]] = Body(None, embed=True),
+    summary: Optional[Summary] = Body(None, embed=True),
+):
     """
-    Handles LLM conversational queries without streaming, using the provided context.
+    Handles LLM conversational queries without streaming, using the provided context or uploaded document.
+    Only the chunks most relevant to the query that fit the token budget are sent, see `select_context`.
+    Answers to a query already asked on the same context and model are served from the response cache.
 
     Args:
         query (str): The query string for the conversation.
-        context (str): The context string to be used in conversation.
+        context (str, optional): The context string to be used in conversation. Defaults to None.
+        document_id (str, optional): The id of a document uploaded with `upload_document`, used as context.
+            Defaults to None.
+        session_id (str, optional): The session whose API key and model answer the query, see `update_api_key`.
+            Defaults to None.
+        client_id (str, optional): The client whose API key and model answer the query instead, kept across the
+            sessions it starts. Defaults to None.
+        history (List[List[str]], optional): The past questions and answers of the conversation, oldest first, sent
+            in the JSON body. The most recent ones that fit the token budget of the model are added to the query,
+            see `PromptAssembler`. Defaults to None.
+        summary (Summary, optional): The summary of the first exchanges of the history returned by
+            `/get_chat_history/`, sent in the JSON body. Only the exchanges it does not cover are added verbatim.
+            Defaults to None.
 
     Returns:
-        Response: The response from the LLM.
+        Response: The response from the LLM, with the context sent and the number of tokens of the context
+        (`context_tokens`) and of the prompt (`prompt_tokens`).
 
     Raises:
         HTTPException: If there's an error during the conversation generation.
     """
-    global llm
-
     try:
-        return await llm_run_call_no_stream(llm=llm, query=query, context=context)
+        _, llm = session_chains(session_id, client_id)
+        question = query
+        query, _ = prompt_assembler.assemble(
+            query, history, llm.llm.model_name, summary and summary.model_dump()
+        )
+        # Loading a document and counting its tokens takes a while, keep the event loop free meanwhile
+        document = await asyncio.to_thread(
+            load_document, document_id, llm.llm.model_name
+        )
+        context, context_tokens, prompt_tokens = await asyncio.to_thread(
+            select_context, query, context, document, llm, question
+        )
+        usage = {"context_tokens": context_tokens, "prompt_tokens": prompt_tokens}
+        key = response_cache_key(query, context, llm.llm.model_name)
+        answer = response_cache.get(key)
+        if answer is not None:
+            return {"input": query, "context": context, "text": answer, **usage}
+
+        response = await llm_run_call_no_stream(llm=llm, query=query, context=context)
+        response_cache.set(key, response["text"])
+        return {**response, **usage}
 
     except UpdateError as e:
         raise HTTPException(status_code=e.status_code, detail=e.message)
@@ -202,13 +783,40 @@ async def llm_chat_nostream(query: str, context: str):
 
 
 @router.get("/chat", status_code=200)
-async def chat(query: Query = Body(...), delay: float = 0.0):  # 0.1
+async def chat(
+    query: Query = Body(...),
+    delay: float = 0.0,
+    include_source: bool = False,
+    deadline: Optional[float] = None,
+    max_iterations: Optional[int] = None,
+    session_id: Optional[str] = None,
+    client_id: Optional[str] = None,
+):  # 0.1
     """
     Handles conversational queries with streaming.
+    Answers to questions similar to a previous one are replayed from the semantic cache, see
+    `lookup_semantic_cache`, and identical queries arriving while one is being answered share its generation. Documentation questions with a confident
+    retrieval skip the agent, see `routed_gen`.
 
     Args:
-        query (Query): The query object containing the query string.
-        delay (float, optional): Delay before sending the response. Defaults to 0.0.
+        query (Query): The query object containing the query string and optionally the past questions and
+            answers of the conversation, oldest first, with the summary of its first exchanges. The summary and the
+            most recent exchanges that fit the token budget of the model are added to the query, see
+            `PromptAssembler`. Without them, the chat history of the session is read from the database, while the
+            documentation is searched for the question, and the exchange is saved to it once the answer is
+            streamed.
+        delay (float, optional): Pause in seconds after each streamed chunk. Defaults to 0.0.
+        include_source (bool, optional): Whether to end the stream with a metadata event holding the source URL and score
+            of the documents retrieved for the answer and the path taken, see `metadata_event`. Defaults to False.
+        deadline (float, optional): Seconds allowed to answer. Defaults to REQUEST_DEADLINE, capped by
+            REQUEST_DEADLINE_MAX. Near the deadline the agent is stopped and the answer is written from the documents
+            retrieved so far. A stream cut off by the deadline ends with the metadata event `{"partial": true}`.
+        max_iterations (int, optional): Maximal number of agent steps, at most the agent's own limit.
+            Defaults to None.
+        session_id (str, optional): The session whose API key and model answer the query, see `update_api_key`.
+            Defaults to None.
+        client_id (str, optional): The client whose API key and model answer the query instead, kept across the
+            sessions it starts. Defaults to None.
 
     Returns:
         StreamingResponse: A streaming response for real-time conversation feedback.
@@ -216,11 +824,83 @@ async def chat(query: Query = Body(...), delay: float = 0.0):  # 0.1
     Raises:
         HTTPException: If there's an error during the conversation generation.
     """
-    global agent
+    global retriever
 
     try:
-        stream_it = AsyncCallbackHandler(delay)
-        gen = create_gen(agent, query, stream_it)
+        budget = request_budget(deadline, max_iterations, settings)
+        agent, llm = session_chains(session_id, client_id)
+        history, summary = query.history, query.summary and query.summary.model_dump()
+        saved = query.history is None and has_chat_history(session_id)
+        prefetch = None
+        if saved:
+            db, api_key = chat_history_collection(), llm.llm.openai_api_key
+            # The documentation is searched for the question while the chat history is read
+            prefetch = start_prefetch(retriever, query.text)
+            history, summary = await load_chat_history(db, session_id)
+        prompt, _ = prompt_assembler.assemble(
+            query.text, history, llm.llm.model_name, summary
+        )
+        vector, answer = await lookup_semantic_cache(query.text, prompt, llm)
+        if answer is not None:
+            output, metadata = cached_answer(answer)
+            tokens = replay_text(output + metadata_event(metadata))
+        else:
+            model = llm.llm.model_name
+
+            def generate():
+                if settings.FAST_PATH_ENABLED:
+                    tokens = routed_gen(
+                        agent,
+                        llm,
+                        retriever,
+                        prompt,
+                        settings.FAST_PATH_SIMILARITY,
+                        route_stats,
+                        budget,
+                        prefetch,
+                        settings.FAST_PATH_SPECULATIVE_AGENT,
+                    )
+                else:
+                    tokens = agent_gen(
+                        agent,
+                        llm,
+                        prompt,
+                        prefetch or start_prefetch(retriever, prompt),
+                        budget,
+                    )
+                if vector is None:
+                    return tokens
+                return record_stream(
+                    tokens, lambda text: cache_answer(cache_scope(llm), vector, text)
+                )
+
+            # Only requests answered with the same API key and model share a generation
+            fingerprint = key_fingerprint(llm.llm.openai_api_key)
+            key = f"chat:{fingerprint}:{model}:{normalize_query(prompt)}"
+            # Each request is cut off at its own deadline, the shared generation is budgeted by the first one
+            tokens = with_deadline(single_flight.stream(key, generate), budget)
+
+        if prefetch is not None:
+            # Not used if the answer is cached or shared with an identical request
+            tokens = finally_stream(tokens, prefetch.close)
+        if saved:
+            # Before the metadata is stripped, which tells the answers cut off by the deadline. The answers of clients
+            # that disconnected are not saved either, their stream never completes
+            tokens = record_stream(
+                tokens,
+                lambda text: save_answer_later(
+                    db, session_id, query.text, text, api_key
+                ),
+            )
+        if not include_source:
+            tokens = strip_metadata(tokens)
+
+        gen = coalesce_stream(
+            tokens,
+            settings.STREAM_FLUSH_BYTES,
+            settings.STREAM_FLUSH_MS,
+            delay,
+        )
         return StreamingResponse(gen, media_type="text/event-stream")
 
     except UpdateError as e:
@@ -232,27 +912,102 @@ async def chat(query: Query = Body(...), delay: float = 0.0):  # 0.1
 
 
 @router.get("/llm_chat", status_code=200)
-async def chat(query: str, context: str, delay: float = 0.0):  # 0.1
+async def chat(
+    query: str,
+    context: Optional[str] = None,
+    document_id: Optional[str] = None,
+    delay: float = 0.0,
+    session_id: Optional[str] = None,
+    client_id: Optional[str] = None,
+    history: Optional[List[List[str]]] = Body(None, embed=True),
+    summary: Optional[Summary] = Body(None, embed=True),
+):  # 0.1
     """
-    Handles LLM conversational queries with streaming, using the provided context.
+    Handles LLM conversational queries with streaming, using the provided context or uploaded document.
+    Only the chunks most relevant to the query that fit the token budget are sent, see `select_context`.
+    Answers to a query already asked on the same context and model are replayed from the response cache, and
+    identical queries arriving while one is being answered share its generation.
 
     Args:
         query (str): The query string for the conversation.
-        context (str): The context string to be used in conversation.
-        delay (float, optional): Delay before sending the response. Defaults to 0.0.
+        context (str, optional): The context string to be used in conversation. Defaults to None.
+        document_id (str, optional): The id of a document uploaded with `upload_document`, used as context instead
+            of sending it with every request. Defaults to None.
+        delay (float, optional): Pause in seconds after each streamed chunk. Defaults to 0.0.
+        session_id (str, optional): The session whose API key and model answer the query, see `update_api_key`.
+            Defaults to None.
+        client_id (str, optional): The client whose API key and model answer the query instead, kept across the
+            sessions it starts. Defaults to None.
+        history (List[List[str]], optional): The past questions and answers of the conversation, oldest first, sent
+            in the JSON body. The most recent ones that fit the token budget of the model are added to the query,
+            see `PromptAssembler`. Defaults to None, the chat history of the session: it is read from the database
+            and the exchange is saved to it once the answer is streamed.
+        summary (Summary, optional): The summary of the first exchanges of the history returned by
+            `/get_chat_history/`, sent in the JSON body. Only the exchanges it does not cover are added verbatim.
+            Defaults to None.
 
     Returns:
-        StreamingResponse: A streaming response for real-time LLM conversation feedback.
+        StreamingResponse: A streaming response for real-time LLM conversation feedback. The number of tokens of
+        the context and of the prompt are sent in the `X-Context-Tokens` and `X-Prompt-Tokens` headers.
 
     Raises:
         HTTPException: If there's an error during the conversation generation.
     """
-    global llm
-
     try:
-        stream_it = AsyncCallbackHandler_LLM(delay)
-        gen = llm_create_gen(llm, query, context, stream_it)  # Query = Body(...)
-        return StreamingResponse(gen, media_type="text/event-stream")
+        _, llm = session_chains(session_id, client_id)
+        model = llm.llm.model_name
+        question = query
+        summary = summary and summary.model_dump()
+        saved = history is None and has_chat_history(session_id)
+        # Loading a document and counting its tokens takes a while, it runs in a thread while the chat history
+        # of the session is read
+        loading = asyncio.to_thread(load_document, document_id, model)
+        if saved:
+            db, api_key = chat_history_collection(), llm.llm.openai_api_key
+            document, (history, summary) = await asyncio.gather(
+                loading, load_chat_history(db, session_id)
+            )
+        else:
+            document = await loading
+        query, _ = prompt_assembler.assemble(query, history, model, summary)
+        context, context_tokens, prompt_tokens = await asyncio.to_thread(
+            select_context, query, context, document, llm, question
+        )
+        key = response_cache_key(query, context, llm.llm.model_name)
+        answer = response_cache.get(key)
+        if answer is not None:
+            tokens = replay_text(answer)
+        else:
+
+            def generate():
+                stream_it = AsyncCallbackHandler_LLM()
+                return record_stream(
+                    llm_create_gen(llm, query, context, stream_it),
+                    lambda text: response_cache.set(key, text),
+                )
+
+            fingerprint = key_fingerprint(llm.llm.openai_api_key)
+            tokens = single_flight.stream(f"llm_chat:{fingerprint}:{key}", generate)
+        if saved:
+            tokens = record_stream(
+                tokens,
+                lambda text: save_turn_later(db, session_id, question, text, api_key),
+            )
+
+        gen = coalesce_stream(
+            tokens,
+            settings.STREAM_FLUSH_BYTES,
+            settings.STREAM_FLUSH_MS,
+            delay,
+        )
+        return StreamingResponse(
+            gen,
+            media_type="text/event-stream",
+            headers={
+                "X-Context-Tokens": str(context_tokens),
+                "X-Prompt-Tokens": str(prompt_tokens),
+            },
+        )
 
     except UpdateError as e:
         raise HTTPException(status_code=e.status_code, detail=e.message)
@@ -279,8 +1034,40 @@ async def get_document_source(query: str):
     global retriever
 
     try:
+        require_ready()
         return await get_source(retriever, query)
+    except UpdateError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.message)
     except Exception as e:
         msg = f"Unexpected error during document retrieval: {str(e)}"
         logging.error(msg)
         raise HTTPException(status_code=500, detail=msg)
+
+
+@router.get("/get_cache_stats/", status_code=200)
+def get_cache_stats():
+    """
+    Retrieves the hit and miss counters of the answer and embedding caches, of the coalesced generations, of
+    the paths taken by the agent queries, of the speculative retrievals, of the chain pool, of the API key
+    validations, of the token counts of the chat history, of the uploaded documents and of the web searches, and
+    the calls of the tools.
+
+    Returns:
+        dict: The statistics of each cache.
+    """
+    return {
+        "routes": route_stats.as_dict(),
+        "speculative_retrieval": speculation_stats.as_dict(),
+        "semantic_cache": semantic_cache.stats.as_dict(),
+        "response_cache": response_cache.stats.as_dict(),
+        "single_flight": single_flight.as_dict(),
+        "chain_pool": chain_pool.as_dict(),
+        "key_validation": key_validation_stats.as_dict(),
+        "history_tokens": prompt_assembler.stats.as_dict(),
+        "document_store": document_store.as_dict(),
+        "search_cache": search_cache.as_dict(),
+        "tool_calls": tool_executor.as_dict(),
+        "embedding_cache": {
+            model: cache.stats.as_dict() for model, cache in embedding_caches.items()
+        },
+    }
@@ -0,0 +1,102 @@
+import pytest
+import threading
+import time
+from bson import ObjectId
+from types import SimpleNamespace
+from utils.chain_pool import ChainPool
+from utils.config_channel import create_config_channel
+
+
+def build(api_key: str, model: str):
+    return (f"agent:{api_key}:{model}", f"llm:{api_key}:{model}")
+
+
+def test_pool_reuses_and_evicts_chains():
+    """
+    Tests the LRU and idle eviction of the chain pool.
+
+    Asserts:
+    - The chains of a key and model are built once and reused.
+    - The least recently used entry is evicted when the pool is full.
+    - An entry unused for longer than the idle TTL is dropped.
+    """
+    pool = ChainPool(build, max_size=2, idle_ttl=0.2)
+
+    first = pool.get("sk-a", "gpt-4")
+    assert pool.get("sk-a", "gpt-4") is first
+    pool.get("sk-b", "gpt-4")
+    pool.get("sk-a", "gpt-4")
+    pool.get("sk-a", "gpt-3.5-turbo-16k")
+    assert pool.as_dict()["size"] == 2
+    assert pool.get("sk-a", "gpt-4") is first
+    assert pool.stats.as_dict()["misses"] == 3
+
+    time.sleep(0.3)
+    assert pool.get("sk-a", "gpt-4") is not first
+    assert pool.as_dict()["size"] == 1
+
+
+def test_sessions_select_their_chains():
+    """
+    Tests that each session gets the chains of its own API key and model.
+
+    Asserts:
+    - Sessions bound to different keys get different chains, rebuilt if their entry was evicted.
+    - Unknown sessions get no chains, so that the default ones are used.
+    """
+    pool = ChainPool(build, max_size=1, idle_ttl=60)
+
+    pool.bind("session-a", "sk-a", "gpt-4")
+    pool.bind("session-b", "sk-b", "gpt-4")
+
+    assert pool.for_session("session-a") == build("sk-a", "gpt-4")
+    assert pool.for_session("session-b") == build("sk-b", "gpt-4")
+    assert pool.for_session("session-c") is None
+    assert pool.for_session(None) is None
+    assert all("sk-" not in fingerprint for fingerprint, _ in pool.entries)
+
+
+@pytest.mark.asyncio
+async def test_client_keeps_its_key_after_a_reset(monkeypatch):
+    """
+    Tests the API key and model of a browser across the conversations it resets.
+
+    Asserts:
+    - After validating a key, then resetting the conversation, which starts a new session id, the chat requests of
+      the browser are still answered by the chains of its key and model, not the default ones.
+    """
+    import routers.generation as generation
+
+    async def validate(api_key, model):
+        pass
+
+    def build_llm(api_key, model):
+        llm = SimpleNamespace(
+            llm=SimpleNamespace(openai_api_key=api_key, model_name=model)
+        )
+        return f"agent:{api_key}:{model}", llm
+
+    monkeypatch.setattr(generation, "validate_openai_api_key", validate)
+    monkeypatch.setattr(generation, "chain_pool", ChainPool(build_llm, 2, 60))
+    monkeypatch.setattr(generation, "agent", "agent:default", raising=False)
+    monkeypatch.setattr(
+        generation,
+        "llm",
+        build_llm("sk-default", "gpt-3.5-turbo-16k")[1],
+        raising=False,
+    )
+    monkeypatch.setattr(generation, "config_channel", create_config_channel("", 1))
+    monkeypatch.setattr(generation, "applied_version", 0)
+    monkeypatch.setattr(generation, "chains_ready", threading.Event())
+    generation.chains_ready.set()
+    client_id, session_id = str(ObjectId()), str(ObjectId())
+
+    await generation.update_api_key("sk-user", "gpt-4", session_id, client_id)
+    session_id = str(ObjectId())
+    agent, llm = generation.session_chains(session_id, client_id)
+
+    assert agent == "agent:sk-user:gpt-4"
+    assert generation.get_current_model(session_id, client_id) == {
+        "message": "Current model is gpt-4"
+    }
+    assert generation.session_chains(session_id)[0] == "agent:default"
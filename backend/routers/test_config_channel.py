@@ -0,0 +1,121 @@
+import asyncio
+import os
+import pytest
+import threading
+from utils.chain_pool import ChainPool
+from utils.config_channel import FileConfigChannel, MemoryConfigChannel
+
+POLL_INTERVAL = 0.01
+
+
+async def propagate(writer, readers):
+    """
+    Starts a watcher per simulated worker, updates the configuration from one of them and waits for the others.
+
+    Returns:
+        list: The last configuration applied by each worker.
+    """
+    applied = [[] for _ in readers]
+    watchers = [
+        asyncio.create_task(reader.watch(applied[i].append))
+        for i, reader in enumerate(readers)
+    ]
+    try:
+        await asyncio.sleep(5 * POLL_INTERVAL)
+        writer.update(lambda c: c.update(default={"key": "f-new", "model": "gpt-4"}))
+        writer.update(
+            lambda c: c["sessions"].update(s1={"key": "f-s1", "model": "gpt-4"})
+        )
+        await asyncio.sleep(10 * POLL_INTERVAL)
+    finally:
+        for watcher in watchers:
+            watcher.cancel()
+    return [worker[-1] for worker in applied]
+
+
+@pytest.mark.asyncio
+async def test_file_channel_propagates_updates(tmp_path):
+    """
+    Asserts that an update written by one worker to the shared file is applied by every worker, in order.
+    """
+    path = str(tmp_path / "config.json")
+    workers = [FileConfigChannel(path, POLL_INTERVAL) for _ in range(3)]
+
+    configs = await propagate(workers[0], workers)
+
+    for config in configs:
+        assert config["version"] == 2
+        assert config["default"] == {"key": "f-new", "model": "gpt-4"}
+        assert config["sessions"] == {"s1": {"key": "f-s1", "model": "gpt-4"}}
+    # No temporary file is left behind
+    assert sorted(p.name for p in tmp_path.iterdir()) == [
+        "config.json",
+        "config.json.lock",
+    ]
+
+
+@pytest.mark.asyncio
+async def test_memory_channel_propagates_updates():
+    """
+    Asserts that the in-memory stand-in notifies its watchers like the file channel.
+    """
+    channel = MemoryConfigChannel(POLL_INTERVAL)
+
+    configs = await propagate(channel, [channel, channel])
+
+    assert [config["version"] for config in configs] == [2, 2]
+    assert configs[0]["sessions"]["s1"]["key"] == "f-s1"
+
+
+@pytest.mark.asyncio
+async def test_key_set_on_one_worker_is_used_by_the_others(monkeypatch, tmp_path):
+    """
+    Tests API keys set on one worker and applied by another one through the file channel.
+
+    Asserts:
+    - The shared configuration holds the fingerprint of the key, the key is in a file readable by its owner only.
+    - Another worker answers the session with the chains of its key and model, and rebuilds its default chains
+      with the new default key and model.
+    """
+    import routers.generation as generation
+    from config import settings
+
+    async def validate(api_key, model):
+        pass
+
+    def build_llm(api_key, model, tools=None):
+        return f"agent:{api_key}:{model}", f"llm:{api_key}:{model}"
+
+    path = str(tmp_path / "config.json")
+    monkeypatch.setattr(generation, "validate_openai_api_key", validate)
+    monkeypatch.setattr(generation, "setup_llm_chains", build_llm)
+    monkeypatch.setattr(generation, "tools", [], raising=False)
+    monkeypatch.setattr(generation, "chains_ready", threading.Event())
+    generation.chains_ready.set()
+
+    def start_worker():
+        # The state of a worker process, sharing only the files of the channel
+        monkeypatch.setattr(generation, "agent", "agent:default", raising=False)
+        monkeypatch.setattr(generation, "llm", "llm:default", raising=False)
+        monkeypatch.setattr(settings, "OPENAI_API_KEY", "sk-default")
+        monkeypatch.setattr(settings, "LLM_NAME", "gpt-3.5-turbo-16k")
+        monkeypatch.setattr(generation, "config_channel", FileConfigChannel(path, 1))
+        monkeypatch.setattr(generation, "chain_pool", ChainPool(build_llm, 2, 60))
+        monkeypatch.setattr(generation, "applied_version", 0)
+
+    start_worker()
+    await generation.update_api_key("sk-user-secret", "gpt-4", "s1")
+    with open(path, encoding="utf-8") as f:
+        assert "sk-user-secret" not in f.read()
+    assert os.stat(f"{path}.keys").st_mode & 0o777 == 0o600
+
+    start_worker()
+    generation.apply_config(generation.config_channel.read())
+    assert generation.session_chains("s1")[0] == "agent:sk-user-secret:gpt-4"
+
+    start_worker()
+    await generation.update_api_key("sk-admin", "gpt-4")
+    start_worker()
+    generation.apply_config(generation.config_channel.read())
+    assert generation.session_chains(None)[0] == "agent:sk-admin:gpt-4"
+    assert generation.session_chains("s1")[0] == "agent:sk-user-secret:gpt-4"
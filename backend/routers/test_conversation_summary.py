@@ -0,0 +1,77 @@
+import pytest
+from bson import ObjectId
+from utils.conversation_summary import ConversationSummarizer
+from utils.prompt_assembler import PromptAssembler
+
+SESSION_ID = str(ObjectId())
+
+
+class FakeLLM:
+    def __init__(self) -> None:
+        self.prompts = []
+
+    async def apredict(self, prompt: str) -> str:
+        self.prompts.append(prompt)
+        return f"summary {len(self.prompts)}"
+
+
+class FakeCollection:
+    """
+    The chat history collection of a single session, with the operations used by the summarizer.
+    """
+
+    def __init__(self, history) -> None:
+        self.doc = {"_id": ObjectId(SESSION_ID), "chat_history": history}
+
+    async def find_one(self, query: dict):
+        return self.doc
+
+    async def update_one(self, query: dict, update: dict):
+        summary = self.doc.get("summary")
+        if summary is None or summary["turns"] < update["$set"]["summary"]["turns"]:
+            self.doc.update(update["$set"])
+
+
+@pytest.mark.asyncio
+async def test_summary_is_refreshed_every_n_turns():
+    """
+    Tests the rolling summary of a session.
+
+    Asserts:
+    - Nothing is summarized before enough exchanges follow the summary.
+    - A refresh folds all exchanges but the most recent ones into the summary, with a single LLM call.
+    - The next refresh only sends the previous summary and the new exchanges.
+    """
+    llm = FakeLLM()
+    summarizer = ConversationSummarizer(
+        lambda api_key: llm, every_turns=3, keep_turns=2
+    )
+    db = FakeCollection([[f"Question {i}?", f"Answer {i}."] for i in range(4)])
+
+    await summarizer.refresh(db, SESSION_ID, "sk-test")
+    assert "summary" not in db.doc and not llm.prompts
+
+    db.doc["chat_history"].append(["Question 4?", "Answer 4."])
+    await summarizer.refresh(db, SESSION_ID, "sk-test")
+    assert db.doc["summary"] == {"text": "summary 1", "turns": 3}
+    assert "Question 2?" in llm.prompts[0] and "Question 3?" not in llm.prompts[0]
+
+    db.doc["chat_history"] += [[f"Question {i}?", f"Answer {i}."] for i in range(5, 8)]
+    await summarizer.refresh(db, SESSION_ID, "sk-test")
+    assert db.doc["summary"] == {"text": "summary 2", "turns": 6}
+    assert "summary 1" in llm.prompts[1] and "Question 2?" not in llm.prompts[1]
+    assert summarizer.as_dict()["refreshes"] == 2
+
+
+def test_prompt_combines_summary_and_recent_turns():
+    """
+    Tests that the prompt holds the summary and only the exchanges it does not cover.
+    """
+    history = [[f"Question {i}?", f"Answer {i}."] for i in range(8)]
+    prompt, turns = PromptAssembler(1000, 100).assemble(
+        "What now?", history, "gpt-3.5-turbo-16k", {"text": "summary 2", "turns": 6}
+    )
+
+    assert turns == 2
+    assert prompt.index("summary 2") < prompt.index("Question 6?")
+    assert "Question 5?" not in prompt
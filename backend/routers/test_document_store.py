@@ -0,0 +1,86 @@
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from routers.generation import router
+from utils.document_store import DocumentStore, document_id, split_text
+
+app = FastAPI()
+app.include_router(router)
+client = TestClient(app)
+
+TEXT = "\n\n".join(
+    f"Paragraph {i} explains how the model number {i} generates text."
+    for i in range(40)
+)
+
+
+def test_split_text_bounds_chunks():
+    """
+    Tests the splitting of a document into chunks.
+
+    Asserts:
+    - No chunk is longer than the chunk size, even for a paragraph longer than a chunk.
+    - Short paragraphs are grouped and every paragraph is kept.
+    """
+    chunks = split_text(TEXT + "\n\n" + "word " * 500, chunk_size=300, overlap=50)
+
+    assert all(len(chunk) <= 300 for chunk in chunks)
+    assert all(f"Paragraph {i} " in "".join(chunks) for i in range(40))
+    assert len(chunks) < 40
+
+
+def test_store_shares_documents_through_disk(tmp_path):
+    """
+    Tests the document store and its on-disk tier.
+
+    Asserts:
+    - The id of a document is the hash of its text, and storing it again keeps it once.
+    - A store on the same file, as in another worker, finds the document and indexes its chunks.
+    """
+    path = str(tmp_path / "documents.db")
+    first = DocumentStore(4, 60, 300, 50, path)
+    document = first.add(TEXT)
+    assert document.id == document_id(TEXT)
+    assert first.add(TEXT) is document
+
+    second = DocumentStore(4, 60, 300, 50, path)
+    loaded = second.get(document.id)
+    assert loaded.chunks == document.chunks
+    assert "number 7 " in loaded.chunks[loaded.index.search("number 7", 1)[0][0]]
+    assert second.get("unknown") is None
+    assert second.as_dict()["hits"] == 1
+
+
+def test_select_fits_the_token_budget():
+    """
+    Tests the selection of the chunks sent to the model.
+
+    Asserts:
+    - A document within the budget is sent whole.
+    - Otherwise the chunks matching the query are sent first, within the budget.
+    """
+    document = DocumentStore(4, 60, 300, 50).add(TEXT)
+    tokens = document.chunk_tokens("gpt-3.5-turbo-16k")
+
+    text, used = document.select("number 7", "gpt-3.5-turbo-16k", 10**6)
+    assert text == TEXT
+    budget = tokens[0] + tokens[1] + 2
+    text, used = document.select("number 37", "gpt-3.5-turbo-16k", budget)
+    assert "number 37 " in text and used <= budget
+    assert len(text) < len(TEXT)
+
+
+def test_upload_document():
+    """
+    Tests the upload endpoint.
+
+    Asserts:
+    - The response holds the content hash of the text and its number of chunks.
+    - Empty documents are rejected.
+    """
+    response = client.post("/upload_document/", json={"text": TEXT, "name": "a.txt"})
+    assert response.status_code == 200
+    assert response.json()["document_id"] == document_id(TEXT)
+    assert response.json()["chunks"] >= 1
+
+    response = client.post("/upload_document/", json={"text": "  "})
+    assert response.status_code == 422
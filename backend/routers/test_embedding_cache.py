@@ -0,0 +1,95 @@
+import numpy as np
+import pytest
+from typing import List
+from langchain.schema.embeddings import Embeddings
+from utils.embedding_cache import CachedEmbeddings, EmbeddingCache, EmbeddingStore
+
+
+class CountingEmbeddings(Embeddings):
+    """
+    Embeddings whose vector is the length of the text, counting the queries embedded.
+    """
+
+    def __init__(self) -> None:
+        self.calls = 0
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [self.embed_query(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        self.calls += 1
+        return [float(len(text)), 1.0]
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return self.embed_query(text)
+
+
+@pytest.mark.asyncio
+async def test_queries_are_embedded_once_per_model():
+    """
+    Tests the keys of the embedding cache.
+
+    Asserts:
+    - A query is embedded once, by the synchronous or the asynchronous method.
+    - The same query embedded by another model sharing the cache gets its own entry.
+    """
+    cache, upstream = EmbeddingCache(max_size=10), CountingEmbeddings()
+    ada = CachedEmbeddings(upstream, "text-embedding-ada-002", cache)
+    other = CachedEmbeddings(upstream, "text-embedding-3-small", cache)
+
+    assert ada.embed_query("install") == [7.0, 1.0]
+    assert await ada.aembed_query("install") == [7.0, 1.0]
+    assert upstream.calls == 1
+    other.embed_query("install")
+    assert upstream.calls == 2
+    assert ada.key("install") != other.key("install")
+
+
+def test_evicted_embeddings_are_read_from_disk(tmp_path):
+    """
+    Tests the tiers of the embedding cache.
+
+    Asserts:
+    - The least recently used vector is evicted from memory when it is full.
+    - Without a store it is embedded again, with one it is read back from the memory-mapped store.
+    - Another cache on the same folder, e.g. another worker, reads the vectors stored by the first one.
+    """
+    upstream = CountingEmbeddings()
+    memory_only = CachedEmbeddings(upstream, "ada", EmbeddingCache(max_size=1))
+    stored = CachedEmbeddings(upstream, "ada", EmbeddingCache(1, str(tmp_path)))
+
+    for embeddings in (memory_only, stored):
+        embeddings.embed_query("install")
+        embeddings.embed_query("generate")
+        assert embeddings.embed_query("install") == [7.0, 1.0]
+    assert upstream.calls == 5
+    assert stored.cache.stats.as_dict()["hits"] == 1
+
+    worker = CachedEmbeddings(upstream, "ada", EmbeddingCache(1, str(tmp_path)))
+    assert worker.embed_query("generate") == [8.0, 1.0]
+    assert upstream.calls == 5
+
+
+def test_torn_write_does_not_shift_the_rows(tmp_path):
+    """
+    Tests a store left by a worker that crashed while appending a vector.
+
+    Asserts:
+    - The half-written row and key line are ignored by readers.
+    - The vectors appended after them, by a restarted worker, are read back under their own key.
+    """
+    store = EmbeddingStore(str(tmp_path))
+    store.put("install", np.array([1.0, 2.0], dtype=np.float32))
+    with open(tmp_path / "vectors.f32", "ab") as f:
+        f.write(np.array([9.0], dtype=np.float32).tobytes())
+    with open(tmp_path / "keys.txt", "ab") as f:
+        f.write(b"torn 2")
+
+    assert EmbeddingStore(str(tmp_path)).get("torn") is None
+    restarted = EmbeddingStore(str(tmp_path))
+    restarted.put("generate", np.array([3.0, 4.0], dtype=np.float32))
+
+    worker = EmbeddingStore(str(tmp_path))
+    assert list(worker.get("install")) == [1.0, 2.0]
+    assert list(worker.get("generate")) == [3.0, 4.0]
+    assert list(store.get("generate")) == [3.0, 4.0]
@@ -0,0 +1,166 @@
+import asyncio
+import pytest
+from typing import List
+from langchain.agents import initialize_agent, AgentType
+from langchain.agents.agent_toolkits import create_retriever_tool
+from langchain.chains import LLMChain
+from langchain.prompts import PromptTemplate
+from langchain.schema import Document
+from utils.fast_path import RouteStats, routed_gen
+from utils.speculative import PrefetchingRetriever
+from utils.stream_buffer import split_metadata
+
+QUERY = "request-1"
+TIMEOUT = 5
+# Keeps calling the `Doc_search` tool and never writes a final answer
+LOOPING_SCRIPT = [
+    '```json\n{\n    "action": "Doc_search",\n',
+    '    "action_input": "generate"\n}\n```',
+]
+
+
+def make_chains(agent_model, chain_model, retriever):
+    tool = create_retriever_tool(
+        PrefetchingRetriever(retriever=retriever), "Doc_search", "Searches documents"
+    )
+    agent = initialize_agent(
+        agent=AgentType.CHAT_CONVERSATIONAL_REACT_DESCRIPTION,
+        tools=[tool],
+        llm=agent_model,
+        max_iterations=10,
+        early_stopping_method="generate",
+    )
+    llm = LLMChain(
+        prompt=PromptTemplate(
+            template="Context: {context}\nQuestion: {input}",
+            input_variables=["input", "context"],
+        ),
+        llm=chain_model,
+    )
+    return agent, llm
+
+
+def observed_retriever(fake_retriever, agent_model, score: float):
+    """
+    Builds a retriever returning a documentation page with a similarity `score`, which records how many tokens the
+    agent had produced when the retrieval ended.
+    """
+
+    class ObservedRetriever(fake_retriever):
+        produced: int = -1
+
+        async def _aget_relevant_documents(
+            self, query: str, *, run_manager
+        ) -> List[Document]:
+            docs = await super()._aget_relevant_documents(
+                query, run_manager=run_manager
+            )
+            self.produced = agent_model.produced
+            for doc in docs:
+                doc.metadata = {"source": "https://sdk/docs", "score": score}
+            return docs
+
+    return ObservedRetriever(delay=0.2)
+
+
+async def collect(tokens) -> str:
+    return "".join([token async for token in tokens])
+
+
+@pytest.mark.asyncio
+async def test_agent_plans_while_the_documentation_is_searched(
+    fake_chat_model, fake_retriever
+):
+    """
+    Tests the agent path of a query whose retrieval is not confident, with the speculative agent.
+
+    Asserts:
+    - The agent produced its first tokens before the routing retrieval ended.
+    - Its Doc_search call is served the routing retrieval instead of searching again.
+    """
+    agent_model = fake_chat_model(token_interval=0.01)
+    retriever = observed_retriever(fake_retriever, agent_model, score=0.5)
+    agent, llm = make_chains(
+        agent_model, fake_chat_model(agent_format=False), retriever
+    )
+    stats = RouteStats()
+
+    output, metadata = split_metadata(
+        await asyncio.wait_for(
+            collect(
+                routed_gen(agent, llm, retriever, QUERY, 0.85, stats, speculative=True)
+            ),
+            TIMEOUT,
+        )
+    )
+
+    assert output == "Answer for request-1."
+    assert metadata["path"] == "agent" and stats.agent == 1
+    assert retriever.produced > 0
+    assert retriever.calls == 1
+
+
+@pytest.mark.asyncio
+async def test_fast_path_cancels_the_agent(fake_chat_model, fake_retriever):
+    """
+    Tests the fast path of a query whose retrieval is confident.
+
+    Asserts:
+    - The answer is written by the LLM chain from the retrieved documents.
+    - The speculative agent started next to the retrieval is cancelled.
+    """
+    agent_model = fake_chat_model(script=LOOPING_SCRIPT * 100, token_interval=0.01)
+    retriever = observed_retriever(fake_retriever, agent_model, score=0.95)
+    agent, llm = make_chains(
+        agent_model, fake_chat_model(agent_format=False), retriever
+    )
+    stats = RouteStats()
+
+    output, metadata = split_metadata(
+        await asyncio.wait_for(
+            collect(
+                routed_gen(agent, llm, retriever, QUERY, 0.85, stats, speculative=True)
+            ),
+            TIMEOUT,
+        )
+    )
+
+    assert output == "Answer for request-1."
+    assert metadata == {"source": "https://sdk/docs", "score": 0.95, "path": "fast"}
+    assert retriever.produced > 0
+    assert agent_model.cancelled
+    produced = agent_model.produced
+    await asyncio.sleep(0.1)
+    assert agent_model.produced == produced
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("score,path", [(0.95, "fast"), (0.5, "agent")])
+async def test_agent_starts_after_routing_by_default(
+    fake_chat_model, fake_retriever, score, path
+):
+    """
+    Tests the routing without the speculative agent.
+
+    Asserts:
+    - The agent makes no LLM call before the routing retrieval ended, and none at all on the fast path.
+    - On the agent path, its Doc_search call is served the routing retrieval.
+    """
+    agent_model = fake_chat_model(token_interval=0.01)
+    retriever = observed_retriever(fake_retriever, agent_model, score=score)
+    agent, llm = make_chains(
+        agent_model, fake_chat_model(agent_format=False), retriever
+    )
+
+    output, metadata = split_metadata(
+        await asyncio.wait_for(
+            collect(routed_gen(agent, llm, retriever, QUERY, 0.85, RouteStats())),
+            TIMEOUT,
+        )
+    )
+
+    assert output == "Answer for request-1."
+    assert metadata["path"] == path
+    assert retriever.produced == 0
+    assert retriever.calls == 1
+    assert (agent_model.produced == 0) == (path == "fast")
@@ -0,0 +1,54 @@
+import asyncio
+import openai
+import pytest
+from config import settings
+from utils.dependencies_generation import validate_openai_api_key, validated_keys
+from utils.error_handler import UpdateError
+
+
+@pytest.fixture
+def upstream(monkeypatch):
+    """
+    Replaces the model retrieval of OpenAI with a stub recording its calls.
+    """
+    calls = []
+
+    async def aretrieve(model, api_key=None, **kwargs):
+        calls.append((model, api_key))
+        if api_key == "sk-slow":
+            await asyncio.sleep(1)
+        if api_key != "sk-valid" and api_key != "sk-slow":
+            raise openai.error.AuthenticationError("Incorrect API key provided")
+        return {"id": model}
+
+    validated_keys.clear()
+    monkeypatch.setattr(openai.Model, "aretrieve", aretrieve)
+    monkeypatch.setattr(settings, "KEY_VALIDATION_TIMEOUT", 0.1)
+    return calls
+
+
+@pytest.mark.asyncio
+async def test_validated_keys_are_cached(upstream):
+    """
+    Asserts that a key is checked with OpenAI once, and that repeated validations are answered from the cache.
+    """
+    for _ in range(3):
+        await validate_openai_api_key("sk-valid", "gpt-4")
+
+    assert upstream == [("gpt-4", "sk-valid")]
+
+
+@pytest.mark.asyncio
+async def test_invalid_and_slow_keys_are_rejected(upstream):
+    """
+    Asserts that invalid keys and checks exceeding the timeout raise an UpdateError and are not cached.
+    """
+    for key, status_code in [("sk-wrong", 400), ("sk-wrong", 400), ("sk-slow", 504)]:
+        with pytest.raises(UpdateError) as error:
+            await validate_openai_api_key(key, "gpt-4")
+        assert error.value.status_code == status_code
+        assert error.value.message.startswith(
+            "Failed to update API key and model due to OpenAI API error:"
+        )
+
+    assert len(upstream) == 3
@@ -0,0 +1,42 @@
+from utils.prompt_assembler import PromptAssembler, format_turn
+from utils.token_budget import count_tokens
+
+MODEL = "gpt-3.5-turbo-16k"
+HISTORY = [[f"Question {i}?", f"Answer {i} " + "word " * 50] for i in range(20)]
+
+
+def test_history_fits_the_budget():
+    """
+    Tests the packing of the chat history into the query.
+
+    Asserts:
+    - The most recent exchanges that fit the budget are included, oldest first, followed by the query.
+    - Without history, or when the last exchange does not fit, the query is sent alone.
+    """
+    turn_tokens = count_tokens(format_turn(HISTORY[-1]), MODEL)
+    assembler = PromptAssembler(3 * turn_tokens + 1, 100)
+
+    prompt, turns = assembler.assemble("What now?", HISTORY, MODEL)
+    assert turns == 3
+    assert prompt.index("Question 17?") < prompt.index("Question 19?")
+    assert "Question 16?" not in prompt
+    assert prompt.endswith("What now?")
+
+    assert assembler.assemble("What now?", None, MODEL) == ("What now?", 0)
+    assert PromptAssembler(1, 100).assemble("What now?", HISTORY, MODEL)[1] == 0
+
+
+def test_turn_counts_are_cached():
+    """
+    Tests that the tokens of an exchange are counted once.
+
+    Asserts:
+    - Assembling the next turn of the conversation only counts the new exchange.
+    """
+    assembler = PromptAssembler(10**6, 100)
+    assembler.assemble("Next?", HISTORY[:10], MODEL)
+    assert assembler.stats.misses == 10
+
+    assembler.assemble("Next?", HISTORY[:11], MODEL)
+    assert assembler.stats.misses == 11
+    assert assembler.stats.hits == 10
@@ -0,0 +1,93 @@
+import asyncio
+import pytest
+import threading
+from fastapi import HTTPException
+from types import SimpleNamespace
+from config import settings
+from utils.error_handler import UpdateError
+
+
+@pytest.fixture
+def lazy_startup(monkeypatch):
+    """
+    Starts the worker with LAZY_STARTUP, building the default chains with a stub released by the test.
+
+    Returns:
+        SimpleNamespace: The generation module, the event releasing the build and the error it raises, if any.
+    """
+    import routers.generation as generation
+
+    build = SimpleNamespace(module=generation, release=threading.Event(), error=None)
+
+    def build_default_chains():
+        build.release.wait(5)
+        if build.error is not None:
+            raise build.error
+        generation.agent = "agent"
+        generation.llm = SimpleNamespace(llm=SimpleNamespace(model_name="gpt-4"))
+        generation.chains_ready.set()
+
+    monkeypatch.setattr(settings, "LAZY_STARTUP", True)
+    monkeypatch.setattr(generation, "build_default_chains", build_default_chains)
+    monkeypatch.setattr(generation, "chains_ready", threading.Event())
+    monkeypatch.setattr(generation, "startup_error", None)
+    monkeypatch.setattr(generation, "agent", None, raising=False)
+    monkeypatch.setattr(generation, "llm", None, raising=False)
+    generation.startup_event()
+    yield build
+    build.release.set()
+
+
+async def settle(generation):
+    # Waits for the background build to finish, successfully or not
+    for _ in range(100):
+        if generation.chains_ready.is_set() or generation.startup_error:
+            return
+        await asyncio.sleep(0.01)
+
+
+@pytest.mark.asyncio
+async def test_ready_once_the_chains_are_built(lazy_startup):
+    """
+    Tests the readiness of a worker started with LAZY_STARTUP.
+
+    Asserts:
+    - While the chains are building, `/ready` and the requests needing the chains answer 503.
+    - Once they are built, `/ready` answers with the startup profile and the requests are served.
+    """
+    generation = lazy_startup.module
+    with pytest.raises(HTTPException) as error:
+        await generation.ready()
+    assert error.value.status_code == 503
+    with pytest.raises(HTTPException) as error:
+        generation.get_current_model()
+    assert error.value.status_code == 503
+    with pytest.raises(HTTPException) as error:
+        await generation.update_api_key("sk-user", "gpt-4")
+    assert error.value.status_code == 503
+
+    lazy_startup.release.set()
+    await settle(generation)
+
+    assert (await generation.ready())["status"] == "ready"
+    assert generation.get_current_model() == {"message": "Current model is gpt-4"}
+
+
+@pytest.mark.asyncio
+async def test_startup_error_is_reported_by_ready(lazy_startup):
+    """
+    Asserts that when building the chains fails, `/ready` and the requests keep answering 503 with the error.
+    """
+    generation = lazy_startup.module
+    lazy_startup.error = UpdateError("Error during initialization of Pinecone", 401)
+    lazy_startup.release.set()
+    await settle(generation)
+
+    with pytest.raises(HTTPException) as error:
+        await generation.ready()
+    assert error.value.status_code == 503
+    assert "Pinecone" in error.value.detail
+    with pytest.raises(HTTPException) as error:
+        generation.get_current_model()
+    assert error.value.status_code == 503
+    assert "Pinecone" in error.value.detail
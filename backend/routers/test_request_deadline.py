@@ -0,0 +1,116 @@
+import asyncio
+import pytest
+from langchain.agents import initialize_agent, AgentType
+from langchain.agents.agent_toolkits import create_retriever_tool
+from langchain.chains import LLMChain
+from langchain.prompts import PromptTemplate
+from utils.deadline import Budget, with_deadline
+from utils.fast_path import agent_gen
+from utils.stream_buffer import split_metadata
+
+QUERY = "request-1 How do I generate text?"
+TIMEOUT = 5
+# Keeps calling the `Doc_search` tool and never writes a final answer
+LOOPING_SCRIPT = [
+    '```json\n{\n    "action": "Doc_search",\n',
+    '    "action_input": "generate"\n}\n```',
+]
+
+
+def make_agent(fake_chat_model, retriever):
+    tool = create_retriever_tool(retriever, "Doc_search", "Searches documents")
+    agent = initialize_agent(
+        agent=AgentType.CHAT_CONVERSATIONAL_REACT_DESCRIPTION,
+        tools=[tool],
+        llm=fake_chat_model(script=LOOPING_SCRIPT),
+        max_iterations=10,
+        early_stopping_method="generate",
+    )
+    llm = LLMChain(
+        prompt=PromptTemplate(
+            template="Context: {context}\nQuestion: {input}",
+            input_variables=["input", "context"],
+        ),
+        llm=fake_chat_model(agent_format=False),
+    )
+    return agent, llm
+
+
+async def collect(tokens) -> str:
+    return "".join([token async for token in tokens])
+
+
+@pytest.mark.asyncio
+async def test_iteration_budget_answers_from_retrieved_documents(
+    fake_chat_model, fake_retriever
+):
+    """
+    Asserts that an agent stopped by the iteration budget of the request streams an answer written by the LLM chain
+    from the documents retrieved so far, and reports the early stop.
+    """
+    retriever = fake_retriever()
+    agent, llm = make_agent(fake_chat_model, retriever)
+
+    budget = Budget(TIMEOUT, max_iterations=2)
+    output, metadata = split_metadata(
+        await asyncio.wait_for(
+            collect(agent_gen(agent, llm, QUERY, budget=budget)), TIMEOUT
+        )
+    )
+
+    assert output == "Answer for request-1."
+    assert retriever.calls == 2
+    assert metadata["early_stop"] and not metadata["partial"]
+    assert agent.max_iterations == 10 and agent.early_stopping_method == "generate"
+
+
+@pytest.mark.asyncio
+async def test_deadline_stops_the_agent_before_the_deadline(
+    fake_chat_model, fake_retriever
+):
+    """
+    Asserts that an agent stuck in a tool that never returns is stopped at its time limit, which cancels the tool
+    call, and that the final answer is still streamed before the deadline cuts off the stream.
+    """
+    retriever = fake_retriever(delay=3600)
+    agent, llm = make_agent(fake_chat_model, retriever)
+
+    budget = Budget(1.0, reserve=0.5)
+    output, metadata = split_metadata(
+        await asyncio.wait_for(
+            collect(with_deadline(agent_gen(agent, llm, QUERY, budget=budget), budget)),
+            TIMEOUT,
+        )
+    )
+
+    assert retriever.calls == 1 and retriever.cancelled == 1
+    assert output == "Answer for request-1."
+    assert metadata["early_stop"] and not metadata["partial"]
+
+
+@pytest.mark.asyncio
+async def test_deadline_cuts_off_the_stream():
+    """
+    Asserts that a stream still running at the deadline ends with a partial metadata event and that its generation
+    is closed.
+    """
+    closed = asyncio.Event()
+    never = asyncio.Event()
+
+    async def slow_tokens():
+        try:
+            yield "Partial"
+            yield " answer"
+            # The rest of the answer only comes after the deadline
+            await never.wait()
+            yield " never finished"
+        finally:
+            closed.set()
+
+    output, metadata = split_metadata(
+        await collect(with_deadline(slow_tokens(), Budget(0.3)))
+    )
+
+    assert output == "Partial answer"
+    assert metadata == {"partial": True}
+    assert closed.is_set()
@@ -0,0 +1,50 @@
+import time
+from utils.response_cache import ResponseCache, normalize_query, response_cache_key
+
+CONTEXT = "The SDK is installed with pip."
+
+
+def test_keys_ignore_case_and_whitespace_only():
+    """
+    Tests the keys of the response cache.
+
+    Asserts:
+    - Queries differing only by case and whitespace share a key.
+    - Another context or model gets another key.
+    """
+    key = response_cache_key("How do I  install\tthe SDK?", CONTEXT, "gpt-4")
+
+    assert (
+        normalize_query(" How do I  install\tthe SDK? ") == "how do i install the sdk?"
+    )
+    assert response_cache_key("how do i install the sdk?", CONTEXT, "gpt-4") == key
+    assert response_cache_key("how do i install the sdk?", "", "gpt-4") != key
+    assert (
+        response_cache_key("how do i install the sdk?", CONTEXT, "gpt-4-1106-preview")
+        != key
+    )
+
+
+def test_answers_are_evicted_and_expire(tmp_path):
+    """
+    Tests the lifetime of the cached answers.
+
+    Asserts:
+    - The least recently used answer is evicted from memory when it is full, and still served from disk.
+    - The disk tier is shared with another cache on the same file, e.g. another worker.
+    - Answers older than the TTL are served neither from memory nor from disk.
+    """
+    path = str(tmp_path / "responses.db")
+    cache = ResponseCache(max_size=2, ttl=0.3, path=path)
+
+    for i in range(3):
+        cache.set(f"key-{i}", f"answer-{i}")
+    assert "key-0" not in cache.memory
+    assert cache.stats.as_dict()["evictions"] == 1
+    assert cache.get("key-0") == "answer-0"
+    assert ResponseCache(max_size=2, ttl=0.3, path=path).get("key-1") == "answer-1"
+
+    time.sleep(0.4)
+    assert cache.get("key-2") is None
+    assert ResponseCache(max_size=2, ttl=0.3, path=path).get("key-2") is None
+    assert cache.stats.as_dict()["hits"] == 1
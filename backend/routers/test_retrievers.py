@@ -0,0 +1,232 @@
+import numpy as np
+import pinecone
+import pytest
+from typing import List
+from langchain.schema import Document
+from langchain.schema.embeddings import Embeddings
+from langchain.vectorstores import Pinecone
+from utils.bm25 import BM25Index
+from utils.callback_handler_agent import document_source
+from utils.faiss_store import build_faiss_store, load_faiss_store, main
+from utils.fast_path import is_confident
+from utils.retrievers import (
+    HybridRetriever,
+    ScoredVectorStoreRetriever,
+    load_corpus,
+    write_corpus,
+)
+
+# Each word is a direction, a text is the unit sum of the directions of its words
+WORDS = ["generate", "async", "parameters", "model", "install", "credentials"]
+
+
+class WordEmbeddings(Embeddings):
+    """
+    Deterministic embeddings: texts sharing more words have a higher cosine similarity.
+    """
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [self.embed_query(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        vector = np.array([float(word in text.split()) for word in WORDS]) + 1e-3
+        return list(vector / np.linalg.norm(vector))
+
+
+DOCS = [
+    Document(page_content="install", metadata={"source": "https://sdk/install"}),
+    Document(page_content="generate async", metadata={"source": "https://sdk/gen"}),
+    Document(
+        page_content="generate async parameters",
+        metadata={"source": "https://sdk/params"},
+    ),
+]
+
+
+@pytest.fixture
+def store(tmp_path):
+    return build_faiss_store(DOCS, WordEmbeddings(), str(tmp_path))
+
+
+@pytest.mark.asyncio
+async def test_source_is_the_most_similar_document(store):
+    """
+    Tests the source reported for documents scored by a cosine vector store.
+
+    Asserts:
+    - The score of each document is its cosine similarity to the query, higher for closer documents.
+    - The source is the most similar document, with its similarity as score.
+    """
+    retriever = ScoredVectorStoreRetriever(
+        vectorstore=store,
+        search_type="similarity_score_threshold",
+        search_kwargs={"score_threshold": 0.0, "k": 3},
+    )
+    query = "generate async parameters"
+
+    docs = await retriever.aget_relevant_documents(query)
+    expected = np.dot(
+        WordEmbeddings().embed_query(query), WordEmbeddings().embed_query(query)
+    )
+
+    scores = {doc.metadata["source"]: doc.metadata["score"] for doc in docs}
+    assert scores["https://sdk/params"] > scores["https://sdk/gen"]
+    assert scores["https://sdk/gen"] > scores["https://sdk/install"]
+    assert document_source(docs) == {
+        "source": "https://sdk/params",
+        "score": pytest.approx(expected, abs=1e-5),
+    }
+
+
+@pytest.mark.asyncio
+async def test_routing_compares_similarities(store):
+    """
+    Tests the routing decision on documents retrieved with a similarity threshold.
+
+    Asserts:
+    - A document matching the query takes the fast path, it is not dropped by the threshold.
+    - A document above the retrieval threshold but below the fast path similarity goes to the agent.
+    - Queries without a document above the retrieval threshold go to the agent.
+    """
+    retriever = ScoredVectorStoreRetriever(
+        vectorstore=store,
+        search_type="similarity_score_threshold",
+        search_kwargs={"score_threshold": 0.5, "k": 1},
+    )
+
+    async def confident(query: str) -> bool:
+        return is_confident(await retriever.aget_relevant_documents(query), 0.85)
+
+    assert await confident("generate async parameters")
+    assert not await confident("generate")
+    assert await retriever.aget_relevant_documents("model") == []
+    assert not await confident("model")
+
+
+CHUNKS = [
+    "Install the SDK with pip and set your credentials.",
+    "Call generate_async with TextGenerationParameters to stream the answers of a model.",
+    "The parameters of a model set the temperature of its answers.",
+]
+
+
+def test_bm25_ranks_identifier_matches_first():
+    """
+    Tests the BM25 ranking of the chunks.
+
+    Asserts:
+    - The chunk holding the identifiers of the query ranks first, chunks sharing only words with it rank after it.
+    - Chunks without any term of the query are not returned.
+    """
+    index = BM25Index(CHUNKS)
+
+    results = index.search("TextGenerationParameters temperature", 3)
+
+    assert [doc_id for doc_id, _ in results] == [1, 2]
+    assert results[0][1] > results[1][1] > 0
+    assert index.contains(1, "textgenerationparameters")
+    assert not index.contains(0, "textgenerationparameters")
+
+
+def test_fuse_keeps_dense_and_bm25_scores_apart(store):
+    """
+    Tests the fusion of the BM25 and dense rankings.
+
+    Asserts:
+    - A chunk found by both searches ranks first, with the cosine similarity in `score` and the normalized BM25
+      score in `bm25_score`.
+    - A chunk found by BM25 only has a `bm25_score` and no `score`.
+    """
+    documents = [Document(page_content=text) for text in CHUNKS]
+    retriever = HybridRetriever.from_documents(
+        documents,
+        ScoredVectorStoreRetriever(
+            vectorstore=store,
+            search_type="similarity_score_threshold",
+            search_kwargs={"score_threshold": 0.5, "k": 4},
+        ),
+        k=3,
+    )
+    query = "generate_async temperature"
+    lexical = retriever.index.search(query, 4)
+    dense = [Document(page_content=CHUNKS[1], metadata={"score": 0.8})]
+
+    docs = retriever.fuse(query, lexical, dense)
+
+    assert [doc.page_content for doc in docs] == [CHUNKS[1], CHUNKS[2]]
+    assert docs[0].metadata["score"] == 0.8
+    assert 0 < docs[0].metadata["bm25_score"] <= 1
+    assert "score" not in docs[1].metadata
+    assert 0 < docs[1].metadata["bm25_score"] <= 1
+    assert {doc.metadata["retrieval"] for doc in docs} == {"hybrid"}
+
+
+class StubPineconeIndex(pinecone.index.Index):
+    """
+    In-process stand-in of a Pinecone index holding the chunks, counting its queries.
+    """
+
+    def __init__(self, chunks: List[str]) -> None:
+        self.chunks = chunks
+        self.queries = 0
+
+    def describe_index_stats(self):
+        return {"dimension": 2, "namespaces": {"": {"vector_count": len(self.chunks)}}}
+
+    def query(self, vector, top_k, include_metadata, namespace, filter):
+        self.queries += 1
+        return {
+            "matches": [
+                {"score": 0.5, "metadata": {"text": text, "source": f"https://sdk/{i}"}}
+                for i, text in enumerate(self.chunks[:top_k])
+            ]
+        }
+
+
+def test_pinecone_chunks_are_exported_for_bm25(tmp_path):
+    """
+    Tests the BM25 corpus of a Pinecone index, which cannot list its chunks.
+
+    Asserts:
+    - All the chunks of the index are exported with their metadata, and saved to the corpus file.
+    - The corpus file is read instead of querying the index again.
+    """
+    index = StubPineconeIndex(CHUNKS)
+    vectordb = Pinecone(index, WordEmbeddings(), "text")
+    path = str(tmp_path / "corpus.jsonl")
+
+    exported = load_corpus(vectordb, path)
+    loaded = load_corpus(vectordb, path)
+
+    assert [doc.page_content for doc in exported] == CHUNKS
+    assert loaded == exported
+    assert loaded[1].metadata == {"source": "https://sdk/1"}
+    assert index.queries == 1
+
+
+def test_local_index_is_memory_mapped_and_built_from_a_corpus(monkeypatch, tmp_path):
+    """
+    Tests the local index built with `python -m utils.faiss_store` from a JSON Lines corpus.
+
+    Asserts:
+    - The vectors are searched from a read-only memory map of the index file, not a copy.
+    - A search ranks all documents by cosine similarity, and pads with -1 when k exceeds the documents.
+    """
+    import langchain.embeddings.openai
+
+    corpus, path = str(tmp_path / "corpus.jsonl"), str(tmp_path / "index")
+    write_corpus(DOCS, corpus)
+    monkeypatch.setattr(
+        langchain.embeddings.openai, "OpenAIEmbeddings", lambda **_: WordEmbeddings()
+    )
+    monkeypatch.setattr("sys.argv", ["faiss_store", path, "--corpus", corpus])
+    main()
+
+    store = load_faiss_store(path, WordEmbeddings())
+    vectors = store.index.vectors
+    assert isinstance(vectors, np.memmap) and not vectors.flags.writeable
+    query = np.array([WordEmbeddings().embed_query("generate async")], np.float32)
+    scores, rows = store.index.search(query, 4)
+    expected = vectors @ query[0]
+    assert list(rows[0]) == [1, 2, 0, -1]
+    assert np.allclose(scores[0][:3], expected[[1, 2, 0]])
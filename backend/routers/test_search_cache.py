@@ -0,0 +1,89 @@
+import asyncio
+import threading
+import time
+import pytest
+from langchain.tools.base import ToolException
+from utils.search_cache import SearchCache
+from utils.tool_executor import ToolExecutor
+
+
+class StubSearch:
+    """
+    Local search provider counting its calls, failing or hanging on demand.
+    """
+
+    def __init__(self, delay: float = 0.0) -> None:
+        self.delay = delay
+        self.fail = False
+        self.calls = 0
+        self.running = 0
+        self.max_running = 0
+        self.lock = threading.Lock()
+
+    def __call__(self, query: str) -> str:
+        with self.lock:
+            self.calls += 1
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+        try:
+            time.sleep(self.delay)
+            if self.fail:
+                raise ConnectionError("search unavailable")
+            return f"results for {query}"
+        finally:
+            with self.lock:
+                self.running -= 1
+
+
+@pytest.mark.asyncio
+async def test_results_are_cached_by_normalized_query():
+    """
+    Tests the cache of the web search tool.
+
+    Asserts:
+    - Queries differing only in case and whitespace share one search, and the hit ratio is reported.
+    - At most `max_concurrency` searches run at once.
+    """
+    provider = StubSearch(delay=0.05)
+    cache = SearchCache(16, 60, 600, 2, 5, ToolExecutor(8, 5))
+
+    assert (
+        await cache.search("What is watsonx?", provider)
+        == "results for What is watsonx?"
+    )
+    assert (
+        await cache.search("  what is  WATSONX? ", provider)
+        == "results for What is watsonx?"
+    )
+    assert provider.calls == 1
+    assert cache.as_dict()["hit_ratio"] == 0.5
+
+    await asyncio.gather(*(cache.search(f"query {i}", provider) for i in range(6)))
+    assert provider.calls == 7
+    assert provider.max_running == 2
+
+
+@pytest.mark.asyncio
+async def test_stale_result_is_served_when_the_search_fails():
+    """
+    Tests the fallbacks of the web search tool.
+
+    Asserts:
+    - An expired result is searched again, and served again when the new search fails.
+    - Without an earlier result, a failed or timed out search raises a ToolException for the agent.
+    """
+    provider = StubSearch()
+    cache = SearchCache(16, 0, 600, 2, 0.2, ToolExecutor(8, 5))
+    await cache.search("ibm sdk", provider)
+
+    provider.fail = True
+    assert await cache.search("ibm sdk", provider) == "results for ibm sdk"
+    assert provider.calls == 2
+    with pytest.raises(ToolException):
+        await cache.search("unknown", provider)
+
+    provider.fail, provider.delay = False, 1.0
+    with pytest.raises(ToolException):
+        await cache.search("slow query", provider)
+    assert cache.as_dict()["stale"] == 1
+    assert cache.as_dict()["failures"] == 3
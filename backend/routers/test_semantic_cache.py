@@ -0,0 +1,98 @@
+import pytest
+from types import SimpleNamespace
+from utils.semantic_cache import SemanticCache
+
+QUESTION = "How do I install the SDK?"
+VECTOR = [1.0, 0.0, 0.0]
+PARAPHRASE = [0.99, 0.1, 0.0]
+UNRELATED = [0.0, 1.0, 0.0]
+
+
+def test_answers_are_served_to_similar_questions_of_the_same_scope():
+    """
+    Tests the lookups of the semantic cache.
+
+    Asserts:
+    - A question similar enough to a cached one gets its answer, an unrelated one does not.
+    - Answers are not shared between scopes, e.g. other API keys or models.
+    - The least recently used answer is evicted when the cache is full.
+    """
+    cache = SemanticCache(threshold=0.95, max_size=2, ttl=60)
+
+    cache.store("key-a:gpt-4", VECTOR, "Run pip install.")
+    assert cache.lookup("key-a:gpt-4", PARAPHRASE) == "Run pip install."
+    assert cache.lookup("key-a:gpt-4", UNRELATED) is None
+    assert cache.lookup("key-b:gpt-4", VECTOR) is None
+    assert cache.lookup("key-a:gpt-3.5-turbo-16k", VECTOR) is None
+
+    cache.store("key-a:gpt-4", UNRELATED, "Use a model.")
+    cache.store("key-a:gpt-4", [0.0, 0.0, 1.0], "Set a parameter.")
+    assert cache.lookup("key-a:gpt-4", VECTOR) is None
+    assert cache.stats.as_dict()["hits"] == 1
+    assert cache.stats.as_dict()["evictions"] == 1
+
+
+def test_size_is_bounded_across_scopes():
+    """
+    Tests the semantic cache of a worker serving many API keys.
+
+    Asserts:
+    - The answers of all scopes together never exceed the maximal size, the least recently used being evicted.
+    - A scope is dropped once its last answer is evicted.
+    """
+    cache = SemanticCache(threshold=0.95, max_size=3, ttl=60)
+
+    cache.store("key-a:gpt-4", VECTOR, "Answer a.")
+    for i in range(10):
+        cache.store(f"key-{i}:gpt-4", VECTOR, f"Answer {i}.")
+        assert cache.lookup("key-a:gpt-4", VECTOR) == "Answer a."
+
+    assert len(cache.order) == 3
+    assert sorted(cache.namespaces) == ["key-8:gpt-4", "key-9:gpt-4", "key-a:gpt-4"]
+    assert cache.stats.as_dict()["evictions"] == 8
+
+
+@pytest.mark.asyncio
+async def test_only_standalone_questions_use_the_cache(monkeypatch):
+    """
+    Tests the semantic cache lookup of the chat endpoints.
+
+    Asserts:
+    - The question is embedded alone and looked up in the scope of the API key and model of the request.
+    - A question following earlier exchanges is neither embedded nor looked up.
+    """
+    import routers.generation as generation
+
+    embedded = []
+
+    async def embed_query(retriever, text):
+        embedded.append(text)
+        return VECTOR
+
+    cache = SemanticCache(threshold=0.95, max_size=10, ttl=60)
+    llm = SimpleNamespace(
+        llm=SimpleNamespace(openai_api_key="sk-user", model_name="gpt-4")
+    )
+    other = SimpleNamespace(
+        llm=SimpleNamespace(openai_api_key="sk-other", model_name="gpt-4")
+    )
+    monkeypatch.setattr(generation, "embed_query", embed_query)
+    monkeypatch.setattr(generation, "semantic_cache", cache)
+    monkeypatch.setattr(generation, "retriever", None, raising=False)
+    monkeypatch.setattr(generation.settings, "SEMANTIC_CACHE_ENABLED", True)
+    cache.store(generation.cache_scope(llm), VECTOR, "Run pip install.")
+
+    assert await generation.lookup_semantic_cache(QUESTION, QUESTION, llm) == (
+        VECTOR,
+        "Run pip install.",
+    )
+    assert await generation.lookup_semantic_cache(QUESTION, QUESTION, other) == (
+        VECTOR,
+        None,
+    )
+    prompt = f"Question: What is the SDK?\nAnswer: A library.\n\n{QUESTION}"
+    assert await generation.lookup_semantic_cache(QUESTION, prompt, llm) == (
+        None,
+        None,
+    )
+    assert embedded == [QUESTION, QUESTION]
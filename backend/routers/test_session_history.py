@@ -0,0 +1,99 @@
+import asyncio
+import pytest
+from bson import ObjectId
+from utils.deadline import Budget, with_deadline
+from utils.dependencies_chat_history import (
+    has_chat_history,
+    load_chat_history,
+    save_answer_later,
+    save_turn_later,
+)
+from utils.stream_buffer import metadata_event, record_stream, strip_metadata
+
+SESSION_ID = str(ObjectId())
+
+
+class FakeCollection:
+    """
+    The chat history collection, with the operations used to load and save the history of a session.
+    """
+
+    def __init__(self) -> None:
+        self.docs = {}
+
+    async def find_one(self, query: dict, projection: dict = None):
+        return self.docs.get(query["_id"])
+
+    async def update_one(self, query: dict, update: dict, upsert: bool = False):
+        doc = self.docs.get(query["_id"])
+        if doc is None and upsert:
+            doc = self.docs[query["_id"]] = {"_id": query["_id"], "chat_history": []}
+        doc["chat_history"].append(update["$push"]["chat_history"])
+
+
+@pytest.mark.asyncio
+async def test_turns_are_saved_and_loaded_by_session():
+    """
+    Tests the chat history kept by the backend for the sessions of `/chat` and `/llm_chat`.
+
+    Asserts:
+    - A new session has no history, and its first exchange creates it.
+    - Exchanges are appended in order, empty answers are not saved.
+    - Only ObjectId session ids have a history.
+    """
+    db = FakeCollection()
+    assert await load_chat_history(db, SESSION_ID) == ([], None)
+
+    await save_turn_later(db, SESSION_ID, "Question 1?", "Answer 1.", "sk-test")
+    await save_turn_later(db, SESSION_ID, "Question 2?", "Answer 2.", "sk-test")
+    assert save_turn_later(db, SESSION_ID, "Question 3?", "", "sk-test") is None
+
+    history, summary = await load_chat_history(db, SESSION_ID)
+    assert history == [["Question 1?", "Answer 1."], ["Question 2?", "Answer 2."]]
+    assert summary is None
+    assert has_chat_history(SESSION_ID) and not has_chat_history("my-session")
+
+
+async def answer_tokens(interval: float = 0.0):
+    for token in ["Complete", " answer."]:
+        await asyncio.sleep(interval)
+        yield token
+    yield metadata_event({"source": "docs", "score": 0.9})
+
+
+def saved_stream(db, tokens):
+    """
+    Records and strips a stream of `/chat` as its endpoint does for a client that did not ask for the metadata.
+    """
+    tokens = record_stream(
+        tokens,
+        lambda text: save_answer_later(db, SESSION_ID, "Question?", text, "sk-test"),
+    )
+    return strip_metadata(tokens)
+
+
+@pytest.mark.asyncio
+async def test_only_complete_answers_are_saved():
+    """
+    Tests the exchanges of `/chat` saved to the history of their session.
+
+    Asserts:
+    - A complete answer is saved without its metadata.
+    - An answer cut off by the deadline of its request, or closed by a client that disconnected, is not saved.
+    """
+    db = FakeCollection()
+    budget = Budget(0.05)
+    cut_off = saved_stream(db, with_deadline(answer_tokens(0.03), budget))
+    assert [token async for token in cut_off] == ["Complete"]
+
+    disconnected = saved_stream(db, answer_tokens())
+    assert await disconnected.__anext__() == "Complete"
+    await disconnected.aclose()
+    await asyncio.sleep(0)
+    assert await load_chat_history(db, SESSION_ID) == ([], None)
+
+    complete = saved_stream(db, answer_tokens())
+    assert [token async for token in complete] == ["Complete", " answer."]
+    await asyncio.sleep(0)
+    history, _ = await load_chat_history(db, SESSION_ID)
+    assert history == [["Question?", "Complete answer."]]
@@ -0,0 +1,91 @@
+import asyncio
+import pytest
+from utils.single_flight import SingleFlight
+
+TOKENS = ["Answer", " for", " the", " question."]
+
+
+class Source:
+    """
+    A generation streaming its tokens one by one, counting its starts and cancellations.
+    """
+
+    def __init__(self, interval: float = 0.01) -> None:
+        self.interval = interval
+        self.started = 0
+        self.cancelled = 0
+
+    async def generate(self):
+        self.started += 1
+        try:
+            for token in TOKENS:
+                await asyncio.sleep(self.interval)
+                yield token
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+
+
+async def collect(tokens) -> str:
+    return "".join([token async for token in tokens])
+
+
+@pytest.mark.asyncio
+async def test_identical_requests_share_a_generation():
+    """
+    Tests requests with the same key arriving while the first one is answered.
+
+    Asserts:
+    - The generation is started once and every request receives all its tokens.
+    - A request joining after the first tokens were streamed replays them.
+    - Requests with another key, e.g. another API key fingerprint, get their own generation.
+    """
+    flights, source = SingleFlight(), Source()
+
+    first = flights.stream("chat:key-a:gpt-4:question", source.generate)
+    head = [await anext(first), await anext(first)]
+    late = flights.stream("chat:key-a:gpt-4:question", source.generate)
+    other = flights.stream("chat:key-b:gpt-4:question", source.generate)
+
+    answers = await asyncio.gather(collect(first), collect(late), collect(other))
+
+    assert head == TOKENS[:2]
+    assert "".join(head) + answers[0] == "".join(TOKENS)
+    assert answers[1:] == ["".join(TOKENS)] * 2
+    assert source.started == 2
+    assert flights.as_dict() == {
+        "started": 2,
+        "joined": 1,
+        "cancelled": 0,
+        "in_flight": 0,
+    }
+
+
+@pytest.mark.asyncio
+async def test_generation_is_cancelled_when_no_request_reads_it():
+    """
+    Tests requests leaving before the end of their generation.
+
+    Asserts:
+    - A stream that is never read starts no generation and does not keep one alive.
+    - The generation is cancelled when the last request reading it goes away.
+    """
+    flights, source = SingleFlight(), Source(interval=3600)
+
+    unread = flights.stream("chat:key-a:gpt-4:question", source.generate)
+    await asyncio.sleep(0)
+    assert source.started == 0
+
+    reader = asyncio.create_task(
+        collect(flights.stream("chat:key-a:gpt-4:question", source.generate))
+    )
+    await asyncio.sleep(0.01)
+    reader.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await reader
+    await asyncio.sleep(0)
+    await unread.aclose()
+
+    assert source.started == 1 and source.cancelled == 1
+    assert flights.as_dict()["cancelled"] == 1
+    assert flights.as_dict()["in_flight"] == 0
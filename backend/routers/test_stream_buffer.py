@@ -0,0 +1,110 @@
+import asyncio
+import pytest
+from utils.stream_buffer import (
+    coalesce_stream,
+    metadata_event,
+    replay_text,
+    strip_metadata,
+)
+
+TIMEOUT = 5
+
+
+@pytest.mark.asyncio
+async def test_first_token_is_flushed_at_once():
+    """
+    Tests the chunks written to the client by `coalesce_stream`.
+
+    Asserts:
+    - The first token is written as soon as it arrives, without waiting for the flush window.
+    - The following tokens are coalesced into a single chunk.
+    """
+    first_written = asyncio.Event()
+
+    async def tokens():
+        yield "Hello"
+        # The rest of the answer only comes once the first token reached the client
+        await first_written.wait()
+        for token in [",", " world", "."]:
+            yield token
+
+    chunks = []
+
+    async def read():
+        async for chunk in coalesce_stream(tokens(), 1024, 60_000):
+            chunks.append(chunk)
+            first_written.set()
+
+    await asyncio.wait_for(read(), TIMEOUT)
+
+    assert chunks == ["Hello", ", world."]
+
+
+async def stream(tokens: list, interval: float = 0.0):
+    for token in tokens:
+        await asyncio.sleep(interval)
+        yield token
+
+
+async def coalesce(tokens, flush_bytes: int, flush_ms: float) -> list:
+    return await asyncio.wait_for(
+        collect(coalesce_stream(tokens, flush_bytes, flush_ms)), TIMEOUT
+    )
+
+
+async def collect(chunks) -> list:
+    return [chunk async for chunk in chunks]
+
+
+@pytest.mark.asyncio
+async def test_chunks_are_flushed_at_the_byte_limit():
+    """
+    Asserts that tokens arriving together are flushed once their UTF-8 size reaches the limit, counting the bytes
+    of multi-byte characters rather than the characters.
+    """
+    chunks = await coalesce(stream(["Hi", "éé", "éé", "é"]), 8, 60_000)
+
+    assert chunks == ["Hi", "éééé", "é"]
+
+
+@pytest.mark.asyncio
+async def test_chunks_are_flushed_at_the_time_limit():
+    """
+    Asserts that the tokens of a slow stream are flushed within the time window, several per chunk, instead of
+    waiting for the byte limit.
+    """
+    tokens = [f" {i}" for i in range(10)]
+
+    chunks = await coalesce(stream(tokens, 0.03), 1024, 100)
+
+    assert "".join(chunks) == "".join(tokens)
+    assert chunks[0] == " 0"
+    assert 2 < len(chunks) < len(tokens)
+
+
+@pytest.mark.asyncio
+async def test_metadata_event_is_a_chunk_of_its_own():
+    """
+    Tests the metadata event of `/chat` through `coalesce_stream`.
+
+    Asserts:
+    - The metadata event is written in its own chunk, after the answer text, also when a cached answer is replayed
+      in one piece with its event.
+    - Once stripped, nothing of it is written.
+    """
+    event = metadata_event({"source": "https://sdk/docs", "score": 0.9})
+    tokens = ["Answer", " for", " you.", event]
+
+    assert await coalesce(stream(tokens), 1024, 60_000) == [
+        "Answer",
+        " for you.",
+        event,
+    ]
+    assert await coalesce(replay_text("Cached answer." + event), 1024, 60_000) == [
+        "Cached answer.",
+        event,
+    ]
+    assert await coalesce(strip_metadata(stream(tokens)), 1024, 60_000) == [
+        "Answer",
+        " for you.",
+    ]
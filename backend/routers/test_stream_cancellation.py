@@ -0,0 +1,74 @@
+import asyncio
+import pytest
+from fastapi.responses import StreamingResponse
+from langchain.agents import initialize_agent, AgentType
+from langchain.tools import Tool
+from utils.callback_handler_agent import AsyncCallbackHandler, create_gen
+from utils.single_flight import SingleFlight
+from utils.stream_buffer import coalesce_stream
+
+N_TOKENS = 1000
+TOKEN_INTERVAL = 0.01  # seconds, the whole answer would take 10 seconds
+# The generation must be stopped within this many seconds after the disconnect
+CANCEL_BOUND = 1.0
+# A long final answer
+SCRIPT = ['```json\n{\n    "action": "Final Answer",\n    "action_input": "']
+SCRIPT += [" word"] * N_TOKENS + ['"\n}\n```']
+
+
+@pytest.mark.asyncio
+async def test_disconnect_cancels_generation(fake_chat_model):
+    """
+    Streams an agent answer through single flight, coalescing and a StreamingResponse, and disconnects the client
+    after the first chunk.
+
+    Asserts:
+    - The LLM call is cancelled within a bounded time after the disconnect and produces no more tokens.
+    - The generation is counted as cancelled and no longer in flight.
+    """
+    llm = fake_chat_model(script=SCRIPT, token_interval=TOKEN_INTERVAL)
+    tool = Tool(
+        name="Doc_search",
+        func=lambda q: "",
+        coroutine=lambda q: asyncio.sleep(0, "docs"),
+        description="Searches documents",
+    )
+    agent = initialize_agent(
+        agent=AgentType.CHAT_CONVERSATIONAL_REACT_DESCRIPTION,
+        tools=[tool],
+        llm=llm,
+        max_iterations=10,
+        early_stopping_method="generate",
+    )
+    flights = SingleFlight()
+    tokens = flights.stream(
+        "key", lambda: create_gen(agent, "question", AsyncCallbackHandler())
+    )
+    response = StreamingResponse(
+        coalesce_stream(tokens, 1, 1), media_type="text/event-stream"
+    )
+    first_chunk = asyncio.Event()
+
+    async def receive():
+        await first_chunk.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        if message["type"] == "http.response.body" and message.get("body"):
+            first_chunk.set()
+
+    await asyncio.wait_for(response({"type": "http"}, receive, send), CANCEL_BOUND)
+    disconnected = asyncio.get_running_loop().time()
+    while not llm.cancelled:
+        assert asyncio.get_running_loop().time() - disconnected < CANCEL_BOUND
+        await asyncio.sleep(0.01)
+
+    produced = llm.produced
+    await asyncio.sleep(5 * TOKEN_INTERVAL)
+    assert llm.produced == produced < N_TOKENS
+    assert flights.as_dict() == {
+        "started": 1,
+        "joined": 0,
+        "cancelled": 1,
+        "in_flight": 0,
+    }
@@ -0,0 +1,66 @@
+import json
+import pytest
+from utils.stream_parser import FinalAnswerParser, PatternMatcher
+
+
+def response(answer: str) -> str:
+    return (
+        '```json\n{\n    "action": "Final Answer",\n    "action_input": '
+        + answer
+        + "\n}\n```"
+    )
+
+
+def parse(tokens: list) -> str:
+    parser = FinalAnswerParser()
+    return "".join(parser.feed(token) for token in tokens)
+
+
+def splits(text: str):
+    """
+    Yields the text cut in two tokens at every offset, then cut in single characters.
+    """
+    for i in range(len(text) + 1):
+        yield [text[:i], text[i:]]
+    yield list(text)
+
+
+@pytest.mark.parametrize(
+    "answer",
+    [
+        r'"Line one\nLine two\ttabbed \\ backslash \/ slash"',
+        r'"Accented \u00e9, CJK \u4e2d and an emoji \ud83d\ude00."',
+        r'"Use the \"Model\" class: \"generate\""',
+    ],
+    ids=["short escapes", "unicode escapes and surrogate pair", "quote at the end"],
+)
+def test_answer_is_decoded_whatever_the_token_boundaries(answer):
+    """
+    Tests the final answer streamed by `FinalAnswerParser` for every way the response can be cut into tokens.
+
+    Asserts:
+    - Escapes split across tokens, `\\uXXXX` escapes split at every offset and surrogate pairs are decoded.
+    - An escaped quote just before the closing quote is part of the answer.
+    - The `"action_input": "` marker is found when split across tokens, and the closing quote and the end of the
+      blob after it are not streamed.
+    """
+    expected = json.loads(answer)
+    for tokens in splits(response(answer)):
+        assert parse(tokens) == expected, tokens
+
+
+def test_text_before_the_final_answer_is_not_streamed():
+    """
+    Asserts that tool calls and an `action_input` key before the `Final Answer` marker are ignored, and that a lone
+    high surrogate is replaced instead of being streamed.
+    """
+    tool_call = '{"action_input": "request", "action": "Doc_search"}'
+    assert parse([tool_call, response(r'"Done \ud83d."')]) == "Done �."
+
+
+def test_matcher_finds_overlapping_prefixes():
+    """
+    Asserts that the incremental matcher finds a pattern after a partial match sharing its prefix.
+    """
+    matcher = PatternMatcher("aab")
+    assert [matcher.step(char) for char in "aaab"] == [False, False, False, True]
@@ -0,0 +1,142 @@
+import asyncio
+import re
+import pytest
+from typing import List
+from langchain.agents import initialize_agent, AgentType
+from langchain.callbacks.base import AsyncCallbackHandler as BaseAsyncCallbackHandler
+from langchain.chains import LLMChain
+from langchain.prompts import PromptTemplate
+from langchain.agents.agent_toolkits import create_retriever_tool
+from langchain.schema import Document
+from langchain.tools import Tool
+from utils.callback_handler_agent import AsyncCallbackHandler, create_gen
+from utils.callback_handler_chain import AsyncCallbackHandler_LLM, llm_create_gen
+from utils.speculative import PrefetchingRetriever, resolved_prefetch, start_prefetch
+
+N_STREAMS = 100
+# A leaked handler leaves the robbed stream waiting forever, so bound the whole run.
+TIMEOUT = 30
+REQUEST_ID = re.compile(r"request-(\d+)")
+
+
+class TracerHandler(BaseAsyncCallbackHandler):
+    """
+    A no-op async handler attached to a chain, standing in for tracers such as LangSmith.
+    """
+
+
+async def doc_search(query: str) -> str:
+    await asyncio.sleep(0.001)
+    return f"Documents about {query}"
+
+
+def assert_isolated(streams: List[str]):
+    """
+    Asserts that every stream mentions its own request id and no other.
+    """
+    for i, text in enumerate(streams):
+        assert REQUEST_ID.findall(text) == [str(i)], text
+
+
+@pytest.mark.asyncio
+async def test_agent_streams_are_isolated(fake_chat_model):
+    """
+    Runs 100 simultaneous agent streams against one shared agent and a fake LLM.
+
+    Asserts:
+    - Each stream receives only the tokens generated for its own request.
+    """
+    llm = fake_chat_model()
+    tool = Tool(
+        name="Doc_search",
+        func=lambda q: "",
+        coroutine=doc_search,
+        description="Searches documents",
+    )
+    agent = initialize_agent(
+        agent=AgentType.CHAT_CONVERSATIONAL_REACT_DESCRIPTION,
+        tools=[tool],
+        llm=llm,
+        max_iterations=10,
+        early_stopping_method="generate",
+    )
+
+    async def collect(i):
+        stream_it = AsyncCallbackHandler()
+        return "".join([t async for t in create_gen(agent, f"request-{i}", stream_it)])
+
+    streams = await asyncio.wait_for(
+        asyncio.gather(*[collect(i) for i in range(N_STREAMS)]), TIMEOUT
+    )
+    assert_isolated(streams)
+
+
+@pytest.mark.asyncio
+async def test_prefetched_documents_are_isolated(fake_chat_model, fake_retriever):
+    """
+    Runs 100 simultaneous agent streams sharing one Doc_search tool, each with a prefetched retrieval.
+
+    Asserts:
+    - The even requests, prefetched for their own query, are served the prefetch without a new retrieval.
+    - The odd requests, prefetched for another query, retrieve their own documents and the unused prefetch is
+      cancelled.
+    - Each stream receives only the tokens generated for its own request.
+    """
+    retriever = fake_retriever()
+    slow_retriever = fake_retriever(delay=TIMEOUT)
+    tool = create_retriever_tool(
+        PrefetchingRetriever(retriever=retriever), "Doc_search", "Searches documents"
+    )
+    agent = initialize_agent(
+        agent=AgentType.CHAT_CONVERSATIONAL_REACT_DESCRIPTION,
+        tools=[tool],
+        llm=fake_chat_model(),
+        max_iterations=10,
+        early_stopping_method="generate",
+    )
+
+    async def collect(i):
+        if i % 2 == 0:
+            docs = [Document(page_content=f"Prefetched for request-{i}")]
+            prefetch = resolved_prefetch(f"request-{i}", docs)
+        else:
+            prefetch = start_prefetch(slow_retriever, "another query")
+        gen = create_gen(agent, f"request-{i}", AsyncCallbackHandler(), prefetch)
+        return "".join([t async for t in gen]), prefetch
+
+    results = await asyncio.wait_for(
+        asyncio.gather(*[collect(i) for i in range(N_STREAMS)]), TIMEOUT
+    )
+    assert_isolated([text for text, _ in results])
+    assert retriever.calls == N_STREAMS // 2
+    for i, (_, prefetch) in enumerate(results):
+        assert prefetch.used
+        if i % 2:
+            await asyncio.sleep(0)
+            assert prefetch.result.cancelled()
+
+
+@pytest.mark.asyncio
+async def test_llm_chain_streams_are_isolated(fake_chat_model):
+    """
+    Runs 100 simultaneous LLM chain streams against one shared chain and a fake LLM.
+
+    Asserts:
+    - Each stream receives only the tokens generated for its own request.
+    """
+    llm = fake_chat_model(agent_format=False)
+    prompt = PromptTemplate(
+        template="Context: {context}\nQuestion: {input}\nAnswer: ",
+        input_variables=["input", "context"],
+    )
+    chain = LLMChain(prompt=prompt, llm=llm, callbacks=[TracerHandler()])
+
+    async def collect(i):
+        stream_it = AsyncCallbackHandler_LLM()
+        gen = llm_create_gen(chain, f"request-{i}", "Some context.", stream_it)
+        return "".join([t async for t in gen])
+
+    streams = await asyncio.wait_for(
+        asyncio.gather(*[collect(i) for i in range(N_STREAMS)]), TIMEOUT
+    )
+    assert_isolated(streams)
@@ -0,0 +1,71 @@
+import asyncio
+import time
+import pytest
+from langchain.agents.agent_toolkits import create_retriever_tool
+from langchain.callbacks.base import AsyncCallbackHandler
+from langchain.tools import Tool
+from utils.tool_executor import ToolExecutor, offload_tool
+
+
+def search(query: str) -> str:
+    time.sleep(1.0 if query == "hang" else 0.1)
+    return f"results for {query}"
+
+
+@pytest.mark.asyncio
+async def test_offloaded_tool_keeps_the_event_loop_free():
+    """
+    Tests the tools wrapped by `offload_tool`.
+
+    Asserts:
+    - Concurrent calls of a blocking tool run in the pool while the event loop keeps ticking.
+    - A call past the timeout returns an observation for the agent instead of raising.
+    """
+    executor = ToolExecutor(4, 0.5)
+    tool = offload_tool(
+        Tool(name="DuckDuckGo", func=search, description="search"), executor
+    )
+    ticks = 0
+
+    async def ticker():
+        nonlocal ticks
+        while True:
+            await asyncio.sleep(0.01)
+            ticks += 1
+
+    ticking = asyncio.create_task(ticker())
+    results = await asyncio.gather(*(tool.arun(f"query {i}") for i in range(4)))
+    observation = await tool.arun("hang")
+    ticking.cancel()
+
+    assert results == [f"results for query {i}" for i in range(4)]
+    assert ticks >= 20
+    assert "did not answer within 0.5 seconds" in observation
+    assert executor.as_dict()["timeouts"] == 1
+
+
+class RetrieverEndHandler(AsyncCallbackHandler):
+    def __init__(self) -> None:
+        self.documents = []
+
+    async def on_retriever_end(self, documents, **kwargs) -> None:
+        self.documents += documents
+
+
+@pytest.mark.asyncio
+async def test_offloaded_tool_passes_the_callbacks(fake_retriever):
+    """
+    Asserts that the retriever callbacks of the run, which report the source of the answer, still fire when the
+    retriever tool is wrapped by `offload_tool`.
+    """
+    tool = offload_tool(
+        create_retriever_tool(fake_retriever(), "Doc_search", "Searches documents"),
+        ToolExecutor(4, 5),
+    )
+    handler = RetrieverEndHandler()
+
+    await tool.arun("generate text", callbacks=[handler])
+
+    assert [doc.page_content for doc in handler.documents] == [
+        "Documents about generate text"
+    ]
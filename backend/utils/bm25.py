@@ -0,0 +1,153 @@
+import math
+import re
+from collections import Counter, defaultdict
+from typing import List, Tuple
+import numpy as np
+
+# Identifiers keep their dots and underscores, e.g. `genai.model.Model` or `generate_async`
+_TOKEN = re.compile(r"[A-Za-z0-9_]+(?:\.[A-Za-z0-9_]+)*")
+_CAMEL = re.compile(r"[A-Z]+(?=[A-Z][a-z])|[A-Z]?[a-z]+|[A-Z]+|[0-9]+")
+
+
+def is_identifier(token: str) -> bool:
+    """
+    Tells whether a raw token looks like a code identifier rather than a word.
+
+    Args:
+        token (str): A token matched in the text, before lower-casing.
+
+    Returns:
+        bool: True for dotted or snake_case names and for CamelCase names with an inner capital. Acronyms such as
+        `API` are words.
+    """
+    if "_" in token or "." in token:
+        return True
+    return any(c.isupper() for c in token[1:]) and any(c.islower() for c in token)
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Splits a text into lower-cased BM25 terms, keeping SDK identifiers whole.
+
+    Args:
+        text (str): The text to tokenize.
+
+    Returns:
+        List[str]: The terms. An identifier yields itself and its parts, so `TextGenerationParameters` matches both
+        that exact name and the words `text`, `generation` and `parameters`.
+    """
+    terms = []
+    for token in _TOKEN.findall(text):
+        terms.append(token.lower())
+        if is_identifier(token):
+            for part in re.split(r"[._]", token):
+                terms.extend(p.lower() for p in _CAMEL.findall(part))
+    return terms
+
+
+def identifiers(text: str) -> List[str]:
+    """
+    Returns the lower-cased identifiers of a text, see `is_identifier`.
+
+    Args:
+        text (str): The text to scan.
+
+    Returns:
+        List[str]: The identifiers, each one a BM25 term.
+    """
+    return [token.lower() for token in _TOKEN.findall(text) if is_identifier(token)]
+
+
+class BM25Index:
+    """
+    In-memory inverted index scoring documents with Okapi BM25.
+
+    Args:
+        texts (List[str]): The texts of the documents, in the order of their ids.
+        k1 (float, optional): Term frequency saturation. Defaults to 1.5.
+        b (float, optional): Document length normalization. Defaults to 0.75.
+
+    Each term maps to two compact numpy arrays, the ids of the documents containing it and its frequency in each of
+    them, so a query only touches the postings of its own terms.
+    """
+
+    def __init__(self, texts: List[str], k1: float = 1.5, b: float = 0.75) -> None:
+        self.k1 = k1
+        self.b = b
+        self.size = len(texts)
+        postings = defaultdict(list)
+        lengths = np.zeros(self.size, dtype=np.float32)
+        for doc_id, text in enumerate(texts):
+            terms = Counter(tokenize(text))
+            lengths[doc_id] = sum(terms.values())
+            for term, tf in terms.items():
+                postings[term].append((doc_id, tf))
+
+        average_length = lengths.mean() if self.size else 0.0
+        # Length normalization of each document, precomputed once
+        self.norms = k1 * (1 - b + b * lengths / max(average_length, 1e-9))
+        self.postings = {}
+        self.idf = {}
+        for term, entries in postings.items():
+            ids, tfs = zip(*entries)
+            self.postings[term] = (
+                np.array(ids, dtype=np.int32),
+                np.array(tfs, dtype=np.float32),
+            )
+            df = len(ids)
+            self.idf[term] = math.log(1 + (self.size - df + 0.5) / (df + 0.5))
+
+    def max_score(self, query: str) -> float:
+        """
+        Returns the upper bound of the score of a query, reached by a document matching all its terms very often.
+
+        Args:
+            query (str): The query string.
+
+        Returns:
+            float: The sum of the idf of the known query terms times (k1 + 1).
+        """
+        return sum(
+            self.idf[term] * (self.k1 + 1)
+            for term in set(tokenize(query))
+            if term in self.idf
+        )
+
+    def search(self, query: str, k: int) -> List[Tuple[int, float]]:
+        """
+        Scores the documents containing at least one query term.
+
+        Args:
+            query (str): The query string.
+            k (int): Maximal number of results.
+
+        Returns:
+            List[Tuple[int, float]]: Document ids and BM25 scores, best first.
+        """
+        scores = np.zeros(self.size, dtype=np.float32)
+        for term in set(tokenize(query)):
+            if term not in self.postings:
+                continue
+            ids, tfs = self.postings[term]
+            scores[ids] += (
+                self.idf[term] * tfs * (self.k1 + 1) / (tfs + self.norms[ids])
+            )
+        top = np.argsort(-scores)[:k]
+        return [(int(i), float(scores[i])) for i in top if scores[i] > 0]
+
+    def contains(self, doc_id: int, term: str) -> bool:
+        """
+        Tells whether a document contains a term.
+
+        Args:
+            doc_id (int): The id of the document.
+            term (str): A term produced by `tokenize`.
+
+        Returns:
+            bool: True if the term occurs in the document.
+        """
+        if term not in self.postings:
+            return False
+        ids = self.postings[term][0]
+        i = np.searchsorted(ids, doc_id)
+        return i < len(ids) and ids[i] == doc_id
@@ -0,0 +1,29 @@
+class CacheStats:
+    """
+    Hit, miss and eviction counters of a cache, reported by the `/get_cache_stats/` endpoint.
+
+    Attributes:
+        hits (int): Number of lookups answered from the cache.
+        misses (int): Number of lookups not found in the cache.
+        evictions (int): Number of entries removed because the cache was full or the entry expired.
+    """
+
+    def __init__(self) -> None:
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def as_dict(self) -> dict:
+        """
+        Returns the counters together with the hit ratio.
+
+        Returns:
+            dict: The counters and the hit ratio of the cache.
+        """
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+        }
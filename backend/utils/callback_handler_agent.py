@@ -1,68 +1,151 @@
 import asyncio
-from typing import Any
-from langchain.callbacks.streaming_aiter import AsyncIteratorCallbackHandler
-from langchain.schema import LLMResult
+from typing import Any, AsyncIterator, Awaitable, Callable, List, Optional, Sequence
+from langchain.callbacks.base import AsyncCallbackHandler as BaseAsyncCallbackHandler
+from langchain.schema import Document, LLMResult
+from utils.stream_buffer import metadata_event
+from utils.stream_parser import FinalAnswerParser
+from utils.speculative import Prefetch, current_prefetch
+from utils.deadline import STOPPED_OUTPUT
+from utils.callback_handler_chain import DrainingIteratorCallbackHandler
 
+NOT_RETRIEVED = "Not retrieved"
 
-class AsyncCallbackHandler(AsyncIteratorCallbackHandler):
+
+def document_source(docs: List[Document]):
     """
-    A custom callback handler for asynchronous streaming of tokens from the language model.
+    Selects the source reported to the client among the documents retrieved for a query.
+
+    Args:
+        docs (List[Document]): The retrieved documents, optionally with a `score` metadata field, their cosine
+            similarity to the query, see `ScoredVectorStoreRetriever`.
+
+    Returns:
+        dict: The `source` URL of the most similar document and its `score`. The source is 'Not retrieved' if no
+        document was retrieved or if the most similar one comes from unrelated packaging documentation.
+    """
+    if not docs:
+        return {"source": NOT_RETRIEVED, "score": None}
+    doc = max(docs, key=lambda d: d.metadata.get("score", 0.0))
+    doc_source = doc.metadata.get("source")
+    if (
+        not doc_source
+        or ("pradyunsg" in doc_source.lower())
+        or ("sphinx" in doc_source.lower())
+    ):
+        return {"source": NOT_RETRIEVED, "score": None}
+    return {"source": doc_source, "score": doc.metadata.get("score")}
+
+
+class SourceRecorder(BaseAsyncCallbackHandler):
+    """
+    A callback handler recording the documents retrieved by the agent's tools during one call.
 
     Attributes:
-        content (str): Accumulates the tokens received from the language model.
-        final_answer (bool): Flag indicating if the final answer has been reached.
+        documents (List[Document]): The documents returned by every retriever run of the call.
+    """
 
-    Args:
-        delay (float): Delay in seconds before processing each new token. Defaults to 1.0.
+    def __init__(self) -> None:
+        self.documents = []
 
-    This class extends AsyncIteratorCallbackHandler and implements custom logic for handling new tokens and the end of a language model's response.
+    async def on_retriever_end(
+        self, documents: Sequence[Document], **kwargs: Any
+    ) -> None:
+        self.documents.extend(documents)
+
+
+class AsyncCallbackHandler(DrainingIteratorCallbackHandler):
     """
+    A custom callback handler for asynchronous streaming of tokens from the language model.
 
-    content: str = ""
-    final_answer: bool = False
+    Attributes:
+        parser (FinalAnswerParser): Incremental parser extracting the final answer from the agent's output.
+        documents (List[Document]): The documents retrieved by the agent's tools during the call.
+
+    This class extends DrainingIteratorCallbackHandler and implements custom logic for handling new tokens and the end of a language model's response.
+    Only the decoded `action_input` of the final answer is put in the queue, so the client receives clean text.
+    Pacing of the output is applied by `coalesce_stream`, not per token.
+    """
 
-    def __init__(self, delay: float = 1.0) -> None:
+    def __init__(self) -> None:
         super().__init__()
-        self.delay = delay
+        self.parser = FinalAnswerParser()
+        self.documents = []
+
+    @property
+    def final_answer(self) -> bool:
+        return self.parser.final_answer
 
     async def on_llm_new_token(self, token: str, **kwargs: Any) -> None:
-        await asyncio.sleep(self.delay)
-        self.content += token
-        # if we passed the final answer, we put tokens in queue
-        if self.final_answer:
-            if '"action_input": "' in self.content:
-                if token not in ['"', "}"]:
-                    self.queue.put_nowait(token)
-        elif "Final Answer" in self.content:
-            self.final_answer = True
-            self.content = ""
+        text = self.parser.feed(token)
+        if text:
+            self.queue.put_nowait(text)
 
     async def on_llm_end(self, response: LLMResult, **kwargs: Any) -> None:
-        if self.final_answer:
-            self.content = ""
-            self.final_answer = False
+        if self.parser.final_answer:
             self.done.set()
-        else:
-            self.content = ""
+        self.parser.reset()
+
+    async def on_retriever_end(
+        self, documents: Sequence[Document], **kwargs: Any
+    ) -> None:
+        self.documents.extend(documents)
 
 
-async def run_call_no_stream(agent: object, query: str):
+async def run_call_no_stream(
+    agent: object,
+    query: str,
+    prefetch: Optional[Prefetch] = None,
+    fallback: Optional[Callable[[List[Document]], Awaitable[str]]] = None,
+    time_limit: Optional[float] = None,
+):
     """
     Executes a non-streaming call to the language model.
 
     Args:
         agent (object): The conversational agent object.
         query (str): The input query to be processed by the agent.
+        prefetch (Prefetch, optional): Documents retrieved ahead for the query, served to the Doc_search tool.
+            Defaults to None.
+        fallback (Callable, optional): Writes the answer from the documents retrieved so far when the agent is
+            stopped by its time or iteration limit. Defaults to None, the agent's stopped output is returned.
+        time_limit (float, optional): Seconds after which the agent is stopped. Defaults to None, no limit.
 
     Returns:
-        The result from processing the input query by the agent.
+        The result from processing the input query by the agent, with the `source` and `score` of the document it used,
+        the `path` taken, "agent", and whether the agent was stopped early.
 
     This function makes an asynchronous call to the agent with the given query and an empty chat history.
     """
-    return await agent.acall(inputs={"input": query, "chat_history": []})
-
-
-async def run_acall(agent: object, query: str, stream_it: AsyncCallbackHandler):
+    recorder = SourceRecorder()
+    current_prefetch.set(prefetch)
+    try:
+        response = await asyncio.wait_for(
+            agent.acall(
+                inputs={"input": query, "chat_history": []}, callbacks=[recorder]
+            ),
+            time_limit,
+        )
+    except asyncio.TimeoutError:
+        response = {"input": query, "chat_history": [], "output": STOPPED_OUTPUT}
+    finally:
+        current_prefetch.set(None)
+        if prefetch is not None:
+            prefetch.close()
+    early_stop = response["output"] == STOPPED_OUTPUT
+    if early_stop and fallback is not None:
+        response["output"] = await fallback(recorder.documents)
+    response.update(
+        document_source(recorder.documents), path="agent", early_stop=early_stop
+    )
+    return response
+
+
+async def run_acall(
+    agent: object,
+    query: str,
+    stream_it: AsyncCallbackHandler,
+    prefetch: Optional[Prefetch] = None,
+):
     """
     Runs an asynchronous call with streaming enabled using a custom callback handler.
 
@@ -70,15 +153,34 @@ async def run_acall(agent: object, query: str, stream_it: AsyncCallbackHandler):
         agent (object): The conversational agent object.
         query (str): The input query to be processed by the agent.
         stream_it (AsyncCallbackHandler): The callback handler for streaming the response.
+        prefetch (Prefetch, optional): Documents retrieved ahead for the query, served to the Doc_search tool.
+            Defaults to None.
 
-    This function sets the callback handler for the agent and initiates an asynchronous call with the given query.
-    """
-    agent.agent.llm_chain.llm.callbacks = [stream_it]
-    # now query
-    await agent.acall(inputs={"input": query, "chat_history": []})
-
+    Returns:
+        dict: The outputs of the agent call.
 
-async def create_gen(agent: object, query: str, stream_it: AsyncCallbackHandler):
+    The callback handler is passed with the call itself instead of being assigned to the shared LLM object,
+    so concurrent requests never receive each other's tokens. The prefetch is set in the context of the task
+    running the call, so it is only visible to the tools of this call, and discarded when the call ends.
+    """
+    current_prefetch.set(prefetch)
+    try:
+        return await agent.acall(
+            inputs={"input": query, "chat_history": []}, callbacks=[stream_it]
+        )
+    finally:
+        if prefetch is not None:
+            prefetch.close()
+
+
+async def create_gen(
+    agent: object,
+    query: str,
+    stream_it: AsyncCallbackHandler,
+    prefetch: Optional[Prefetch] = None,
+    fallback: Optional[Callable[[List[Document]], AsyncIterator[str]]] = None,
+    time_limit: Optional[float] = None,
+):
     """
     Creates an asynchronous generator for streaming tokens from the language model.
 
@@ -86,14 +188,61 @@ async def create_gen(agent: object, query: str, stream_it: AsyncCallbackHandler)
         agent (object): The conversational agent object.
         query (str): The input query to be processed by the agent.
         stream_it (AsyncCallbackHandler): The callback handler for streaming the response.
+        prefetch (Prefetch, optional): Documents retrieved ahead for the query, see `run_acall`. Defaults to None.
+        fallback (Callable, optional): Streams the answer from the documents retrieved so far when the agent is
+            stopped by its time or iteration limit before answering. Defaults to None.
+        time_limit (float, optional): Seconds after which the agent is stopped, unless it is already streaming its
+            final answer. Defaults to None, no limit.
 
     Returns:
         An asynchronous generator yielding tokens from the language model.
 
     This function initiates an asynchronous call with streaming and yields tokens as they are received.
+    The call is cancelled if the generator is closed or cancelled before the end.
+    The stream ends with a metadata event holding the source of the documents retrieved during the call, the
+    path taken, "agent", whether the agent was stopped early, and whether the answer was cut off by the stop.
     """
-    task = asyncio.create_task(run_acall(agent, query, stream_it))
-
-    async for token in stream_it.aiter():
-        yield token
-    await task
+    task = asyncio.create_task(run_acall(agent, query, stream_it, prefetch))
+    # The stream also ends when the call stops without a final answer or fails
+    task.add_done_callback(lambda _: stream_it.done.set())
+    stopped = False
+
+    def stop():
+        nonlocal stopped
+        if not stream_it.final_answer and not task.done():
+            stopped = True
+            task.cancel()
+
+    timer = None
+    if time_limit is not None:
+        timer = asyncio.get_running_loop().call_later(time_limit, stop)
+
+    answered = False
+    try:
+        async for token in stream_it.aiter():
+            answered = True
+            yield token
+        try:
+            result = await task
+        except asyncio.CancelledError:
+            if not stopped:
+                raise
+            result = {"output": STOPPED_OUTPUT}
+    finally:
+        if timer is not None:
+            timer.cancel()
+        # The consumer went away, e.g. the client disconnected: stop the agent and its tool calls
+        if not task.done():
+            task.cancel()
+    early_stop = result["output"] == STOPPED_OUTPUT
+    if early_stop and not answered and fallback is not None:
+        async for token in fallback(stream_it.documents):
+            yield token
+    yield metadata_event(
+        {
+            **document_source(stream_it.documents),
+            "path": "agent",
+            "early_stop": early_stop,
+            "partial": early_stop and answered,
+        }
+    )
@@ -1,10 +1,39 @@
 import asyncio
-from typing import Any
+from typing import Any, AsyncIterator
 from langchain.callbacks.streaming_aiter import AsyncIteratorCallbackHandler
 from langchain.schema import LLMResult
 
 
-class AsyncCallbackHandler_LLM(AsyncIteratorCallbackHandler):
+class DrainingIteratorCallbackHandler(AsyncIteratorCallbackHandler):
+    """
+    AsyncIteratorCallbackHandler yielding every queued token before stopping.
+
+    The iterator of LangChain waits for the next token and for the end of the call together. When both are ready
+    at once, it may stop on the end and drop the token already taken from the queue, usually the last one.
+    """
+
+    async def aiter(self) -> AsyncIterator[str]:
+        while True:
+            get = asyncio.ensure_future(self.queue.get())
+            done = asyncio.ensure_future(self.done.wait())
+            try:
+                await asyncio.wait([get, done], return_when=asyncio.FIRST_COMPLETED)
+            except BaseException:
+                get.cancel()
+                done.cancel()
+                raise
+            if get.done():
+                done.cancel()
+                yield get.result()
+                continue
+
+            get.cancel()
+            while not self.queue.empty():
+                yield self.queue.get_nowait()
+            return
+
+
+class AsyncCallbackHandler_LLM(DrainingIteratorCallbackHandler):
     """
     A custom callback handler for asynchronous streaming of tokens from a large language model (LLM).
 
@@ -12,21 +41,14 @@ class AsyncCallbackHandler_LLM(AsyncIteratorCallbackHandler):
         content (str): Accumulates the tokens received from the LLM.
         final_answer (bool): Flag indicating if the final answer has been reached (not used in this implementation).
 
-    Args:
-        delay (float): Delay in seconds before processing each new token. Defaults to 1.0.
-
-    This class extends AsyncIteratorCallbackHandler and is designed to handle new tokens and the end of an LLM's response in a streaming context.
+    This class extends DrainingIteratorCallbackHandler and is designed to handle new tokens and the end of an LLM's response in a streaming context.
+    Pacing of the output is applied by `coalesce_stream`, not per token.
     """
 
     content: str = ""
     final_answer: bool = False
 
-    def __init__(self, delay: float = 1.0) -> None:
-        super().__init__()
-        self.delay = delay
-
     async def on_llm_new_token(self, token: str, **kwargs: Any) -> None:
-        await asyncio.sleep(self.delay)
         self.content += token
         self.queue.put_nowait(token)
 
@@ -63,12 +85,10 @@ async def llm_run_acall(
         context (str): The context in which the query should be interpreted.
         stream_it (AsyncCallbackHandler_LLM): The callback handler for streaming the response.
 
-    This function sets the callback handler for the LLM and initiates an asynchronous call with the given query and context.
+    The callback handler is passed with the call itself instead of being assigned to the shared LLM object,
+    so concurrent requests never receive each other's tokens.
     """
-    # assign callback handler
-    llm.llm.callbacks = [stream_it]
-    # now query
-    await llm.acall(inputs={"input": query, "context": context})
+    await llm.acall(inputs={"input": query, "context": context}, callbacks=[stream_it])
 
 
 async def llm_create_gen(
@@ -87,9 +107,15 @@ async def llm_create_gen(
         An asynchronous generator yielding tokens from the LLM.
 
     This function initiates an asynchronous call with streaming and yields tokens as they are received.
+    The call is cancelled if the generator is closed or cancelled before the end.
     """
     task = asyncio.create_task(llm_run_acall(llm, query, context, stream_it))
 
-    async for token in stream_it.aiter():
-        yield token
-    await task
+    try:
+        async for token in stream_it.aiter():
+            yield token
+        await task
+    finally:
+        # The consumer went away, e.g. the client disconnected: stop the LLM call
+        if not task.done():
+            task.cancel()
@@ -0,0 +1,154 @@
+import hashlib
+import time
+from collections import OrderedDict
+from typing import Callable, Optional, Tuple
+from cachetools import TTLCache
+from utils.cache_stats import CacheStats
+
+
+def key_fingerprint(api_key: str) -> str:
+    """
+    Identifies an API key without keeping it in the pool keys or the logs.
+
+    Args:
+        api_key (str): The OpenAI API key.
+
+    Returns:
+        str: The first 16 hexadecimal digits of the SHA-256 of the key.
+    """
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:16]
+
+
+class ChainPoolEntry:
+    """
+    The chains built for one API key and model, with the time they were last used.
+    """
+
+    def __init__(self, chains: Tuple[object, object]) -> None:
+        self.chains = chains
+        self.last_used = time.monotonic()
+
+
+class ChainPool:
+    """
+    LRU pool of the LLM-bound chains, keyed by API key fingerprint and model, and the binding of sessions to them.
+
+    Args:
+        build (Callable): Builds the agent and LLM chain of an API key and model. The vector store, retriever and tools
+            are shared by all of them.
+        max_size (int): Maximal number of entries. The least recently used one is evicted first.
+        idle_ttl (float): Seconds after which an unused entry, or the API key and model of an inactive session,
+            is dropped.
+        max_sessions (int, optional): Maximal number of sessions bound to an API key and model. Defaults to 10000.
+
+    Each session uses the chains of the API key and model it last set, other requests keep the default chains.
+    An entry evicted while its sessions are still active is rebuilt on their next request.
+    """
+
+    def __init__(
+        self,
+        build: Callable[[str, str], Tuple[object, object]],
+        max_size: int,
+        idle_ttl: float,
+        max_sessions: int = 10000,
+    ) -> None:
+        self.build = build
+        self.max_size = max_size
+        self.idle_ttl = idle_ttl
+        self.stats = CacheStats()
+        self.entries = OrderedDict()
+        self.sessions = TTLCache(max_sessions, idle_ttl)
+
+    def get(self, api_key: str, model: str) -> Tuple[object, object]:
+        """
+        Returns the chains of an API key and model, building them on a miss.
+
+        Args:
+            api_key (str): The OpenAI API key.
+            model (str): The model name.
+
+        Returns:
+            tuple: The agent and the LLM chain.
+        """
+        self._expire()
+        key = (key_fingerprint(api_key), model)
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.stats.hits += 1
+            self.entries.move_to_end(key)
+            entry.last_used = time.monotonic()
+            return entry.chains
+
+        self.stats.misses += 1
+        entry = ChainPoolEntry(self.build(api_key, model))
+        self.entries[key] = entry
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+            self.stats.evictions += 1
+        return entry.chains
+
+    def bind(self, session_id: str, api_key: str, model: str) -> Tuple[object, object]:
+        """
+        Selects the API key and model of a session.
+
+        Args:
+            session_id (str): The session identifier.
+            api_key (str): The OpenAI API key, already validated.
+            model (str): The model name.
+
+        Returns:
+            tuple: The agent and the LLM chain of the session.
+        """
+        chains = self.get(api_key, model)
+        self.assign(session_id, api_key, model)
+        return chains
+
+    def assign(self, session_id: str, api_key: str, model: str) -> None:
+        """
+        Selects the API key and model of a session without building its chains, e.g. for a session set on
+        another worker. They are built by the first request of the session.
+
+        Args:
+            session_id (str): The session identifier.
+            api_key (str): The OpenAI API key, already validated.
+            model (str): The model name.
+        """
+        self.sessions[session_id] = (api_key, model)
+
+    def for_session(self, session_id: Optional[str]) -> Optional[Tuple[object, object]]:
+        """
+        Returns the chains of a session.
+
+        Args:
+            session_id (str, optional): The session identifier.
+
+        Returns:
+            Optional[tuple]: The agent and the LLM chain, or None if the session never set an API key or was inactive
+            for longer than the idle TTL.
+        """
+        binding = self.sessions.get(session_id) if session_id else None
+        if binding is None:
+            return None
+        # Setting the binding again restarts its TTL
+        self.sessions[session_id] = binding
+        return self.get(*binding)
+
+    def _expire(self) -> None:
+        now = time.monotonic()
+        idle = [k for k, e in self.entries.items() if now - e.last_used > self.idle_ttl]
+        for key in idle:
+            del self.entries[key]
+        self.stats.evictions += len(idle)
+
+    def as_dict(self) -> dict:
+        """
+        Returns the counters of the pool.
+
+        Returns:
+            dict: The hit, miss and eviction counters, the number of entries and of bound sessions.
+        """
+        return {
+            **self.stats.as_dict(),
+            "size": len(self.entries),
+            "sessions": len(self.sessions),
+        }
@@ -0,0 +1,236 @@
+import asyncio
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+import copy
+import fcntl
+import json
+import logging
+import os
+import tempfile
+import threading
+from typing import Callable, Optional
+from utils.chain_pool import key_fingerprint
+
+
+def empty_config() -> dict:
+    return {"version": 0, "default": None, "sessions": {}}
+
+
+def referenced_keys(config: dict) -> set:
+    # Fingerprints of the default key and of the keys of the sessions
+    bindings = [config["default"], *config["sessions"].values()]
+    return {binding["key"] for binding in bindings if binding}
+
+
+class ConfigChannel(ABC):
+    """
+    Configuration shared by the workers of the host: the default API key and model, and those set by each session.
+    The configuration identifies API keys by their fingerprint, the keys themselves are kept apart, see `store_key`.
+
+    Args:
+        poll_interval (float): Seconds between two checks for changes made by other workers.
+
+    Every change increments the version of the configuration. Each worker polls the channel and applies the
+    configurations newer than the last one it applied, so all workers end up with the same chains.
+    """
+
+    def __init__(self, poll_interval: float) -> None:
+        self.poll_interval = poll_interval
+
+    @abstractmethod
+    def read(self) -> dict:
+        """
+        Returns the current configuration.
+
+        Returns:
+            dict: The version, the default API key fingerprint and model, and the API key fingerprint and model of
+            each session.
+        """
+
+    @abstractmethod
+    def update(self, change: Callable[[dict], None]) -> dict:
+        """
+        Changes the configuration atomically with respect to the other workers.
+
+        Args:
+            change (Callable): Modifies the configuration in place.
+
+        Returns:
+            dict: The new configuration, with its version incremented.
+        """
+
+    @abstractmethod
+    def store_key(self, api_key: str) -> str:
+        """
+        Shares an API key with the other workers, apart from the configuration.
+
+        Args:
+            api_key (str): The OpenAI API key, already validated.
+
+        Returns:
+            str: Its fingerprint, the only part of it written to the configuration.
+
+        Keys no longer referenced by the configuration are dropped at the same time.
+        """
+
+    @abstractmethod
+    def load_key(self, fingerprint: str) -> Optional[str]:
+        """
+        Returns an API key stored by any worker.
+
+        Args:
+            fingerprint (str): The fingerprint of the key, see `key_fingerprint`.
+
+        Returns:
+            Optional[str]: The API key, or None if no worker stored it.
+        """
+
+    async def watch(self, apply: Callable[[dict], None]) -> None:
+        """
+        Applies the configuration whenever its version changes, until cancelled.
+
+        Args:
+            apply (Callable): Applies a configuration to the worker. Errors are logged and the configuration is
+                applied again at the next change.
+        """
+        version = None
+        while True:
+            try:
+                config = self.read()
+                if config["version"] != version:
+                    apply(config)
+                    version = config["version"]
+            except Exception as e:
+                logging.error(f"Unable to apply the shared configuration: {e}")
+            await asyncio.sleep(self.poll_interval)
+
+
+class MemoryConfigChannel(ConfigChannel):
+    """
+    Configuration channel within a single process, for a single worker and for tests.
+    """
+
+    def __init__(self, poll_interval: float) -> None:
+        super().__init__(poll_interval)
+        self.config = empty_config()
+        self.keys = {}
+        self.lock = threading.Lock()
+
+    def read(self) -> dict:
+        with self.lock:
+            return copy.deepcopy(self.config)
+
+    def update(self, change: Callable[[dict], None]) -> dict:
+        with self.lock:
+            config = copy.deepcopy(self.config)
+            change(config)
+            config["version"] += 1
+            self.config = config
+            return copy.deepcopy(config)
+
+    def store_key(self, api_key: str) -> str:
+        fingerprint = key_fingerprint(api_key)
+        with self.lock:
+            kept = referenced_keys(self.config)
+            self.keys = {k: v for k, v in self.keys.items() if k in kept}
+            self.keys[fingerprint] = api_key
+        return fingerprint
+
+    def load_key(self, fingerprint: str) -> Optional[str]:
+        with self.lock:
+            return self.keys.get(fingerprint)
+
+
+class FileConfigChannel(ConfigChannel):
+    """
+    Configuration channel stored in a local JSON file shared by the workers of the host.
+
+    Args:
+        path (str): Path of the file. A lock file and the key file are created next to it.
+        poll_interval (float): Seconds between two reads of the file.
+
+    Updates are serialized with an exclusive lock and written to a temporary file moved over the previous one, so
+    readers never see a partial file. The configuration holds no API key, only their fingerprints. The keys are
+    written the same way to `<path>.keys`, a file only readable by the user running the workers.
+    """
+
+    def __init__(self, path: str, poll_interval: float) -> None:
+        super().__init__(poll_interval)
+        self.path = path
+        self.keys_path = f"{path}.keys"
+
+    def read(self) -> dict:
+        return read_json(self.path) or empty_config()
+
+    def update(self, change: Callable[[dict], None]) -> dict:
+        with self.locked():
+            config = self.read()
+            change(config)
+            config["version"] += 1
+            write_private(self.path, config)
+        return config
+
+    def store_key(self, api_key: str) -> str:
+        fingerprint = key_fingerprint(api_key)
+        with self.locked():
+            kept = referenced_keys(self.read())
+            keys = {
+                k: v for k, v in (read_json(self.keys_path) or {}).items() if k in kept
+            }
+            keys[fingerprint] = api_key
+            write_private(self.keys_path, keys)
+        return fingerprint
+
+    def load_key(self, fingerprint: str) -> Optional[str]:
+        return (read_json(self.keys_path) or {}).get(fingerprint)
+
+    @contextmanager
+    def locked(self):
+        with open(f"{self.path}.lock", "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            yield
+
+
+def read_json(path: str) -> Optional[dict]:
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def write_private(path: str, data: dict) -> None:
+    """
+    Replaces a JSON file atomically, readable by its owner only.
+
+    Args:
+        path (str): The file.
+        data (dict): Its new content.
+    """
+    # mkstemp creates the file with mode 0600, kept when it is moved over the previous one
+    fd, temporary = tempfile.mkstemp(
+        dir=os.path.dirname(os.path.abspath(path)), prefix=".config-"
+    )
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        os.replace(temporary, path)
+    except Exception:
+        os.unlink(temporary)
+        raise
+
+
+def create_config_channel(path: Optional[str], poll_interval: float) -> ConfigChannel:
+    """
+    Creates the configuration channel of the worker.
+
+    Args:
+        path (str, optional): Path of the file shared by the workers. None or empty for a single worker.
+        poll_interval (float): Seconds between two checks for changes.
+
+    Returns:
+        ConfigChannel: A file channel if a path is given, an in-memory channel otherwise.
+    """
+    if path:
+        return FileConfigChannel(path, poll_interval)
+    return MemoryConfigChannel(poll_interval)
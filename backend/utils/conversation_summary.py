@@ -0,0 +1,169 @@
+import asyncio
+import logging
+from typing import Callable, List, Optional
+from bson import ObjectId
+from utils.prompt_assembler import format_turn
+
+SUMMARY_PROMPT = """Progressively summarize the conversation between a user and an assistant, adding the new exchanges to \
+the previous summary. Keep the names of the functions, classes and parameters discussed, and what the user asked \
+for, so that the assistant can answer follow-up questions. Answer with the new summary only.
+
+Previous summary:
+{summary}
+
+New exchanges:
+{exchanges}
+
+New summary:"""
+# Long answers, e.g. complete scripts, are cut before being summarized
+MAX_EXCHANGE_CHARACTERS = 2000
+
+
+def empty_summary() -> dict:
+    return {"text": "", "turns": 0}
+
+
+def summary_llm(api_key: str, model: str, max_tokens: int) -> object:
+    """
+    Builds the chat model writing the summaries.
+
+    Args:
+        api_key (str): The OpenAI API key.
+        model (str): The name of a cheap chat model.
+        max_tokens (int): Maximal number of tokens of a summary.
+
+    Returns:
+        ChatOpenAI: The chat model, without streaming.
+    """
+    from langchain.chat_models import ChatOpenAI
+
+    return ChatOpenAI(
+        openai_api_key=api_key,
+        model_name=model,
+        temperature=0,
+        max_tokens=max_tokens,
+    )
+
+
+class ConversationSummarizer:
+    """
+    Keeps a rolling summary of each session next to its chat history, refreshed in the background.
+
+    Args:
+        build_llm (Callable): Builds the chat model writing the summaries from an API key, see `summary_llm`.
+        every_turns (int): Number of new exchanges folded into the summary at each refresh.
+        keep_turns (int): Number of most recent exchanges never summarized, they are sent verbatim.
+
+    The summary covers the `turns` first exchanges of the history. Once `every_turns + keep_turns` exchanges follow
+    it, all of them but the last `keep_turns` are added to the summary by a single LLM call, so the prompt holds a
+    summary and a bounded number of recent exchanges however long the session grows.
+    """
+
+    def __init__(
+        self, build_llm: Callable[[str], object], every_turns: int, keep_turns: int
+    ) -> None:
+        self.build_llm = build_llm
+        self.every_turns = every_turns
+        self.keep_turns = keep_turns
+        self.tasks = {}
+        self.refreshes = 0
+        self.failures = 0
+
+    def due(self, summary: Optional[dict], history_length: int) -> bool:
+        """
+        Tells whether enough exchanges followed the summary to refresh it.
+
+        Args:
+            summary (dict, optional): The current summary of the session.
+            history_length (int): Number of exchanges of the session.
+
+        Returns:
+            bool: True if at least `every_turns + keep_turns` exchanges are not summarized.
+        """
+        turns = (summary or empty_summary())["turns"]
+        return history_length - turns >= self.every_turns + self.keep_turns
+
+    async def summarize(
+        self, api_key: str, summary: str, turns: List[List[str]]
+    ) -> str:
+        """
+        Adds exchanges to a summary.
+
+        Args:
+            api_key (str): The OpenAI API key paying for the call.
+            summary (str): The previous summary, empty for the first one.
+            turns (List[List[str]]): The exchanges to add, oldest first.
+
+        Returns:
+            str: The new summary.
+        """
+        exchanges = "\n\n".join(
+            format_turn(turn)[:MAX_EXCHANGE_CHARACTERS] for turn in turns
+        )
+        prompt = SUMMARY_PROMPT.format(summary=summary or "(none)", exchanges=exchanges)
+        return (await self.build_llm(api_key).apredict(prompt)).strip()
+
+    def refresh(
+        self, db: object, session_id: str, api_key: str
+    ) -> Optional[asyncio.Task]:
+        """
+        Refreshes the summary of a session in the background if it is due, at most once at a time per session.
+
+        Args:
+            db (object): The chat history collection.
+            session_id (str): The session identifier.
+            api_key (str): The OpenAI API key paying for the call.
+
+        Returns:
+            Optional[asyncio.Task]: The refresh task, None if one is already running for the session.
+        """
+        if session_id in self.tasks:
+            return None
+        task = asyncio.create_task(self._refresh(db, session_id, api_key))
+        # Keeping a reference prevents the task from being garbage collected while it runs
+        self.tasks[session_id] = task
+        task.add_done_callback(lambda _: self.tasks.pop(session_id, None))
+        return task
+
+    async def _refresh(self, db: object, session_id: str, api_key: str) -> None:
+        try:
+            doc = await db.find_one({"_id": ObjectId(session_id)})
+            if not doc:
+                return
+            history = doc.get("chat_history", [])
+            summary = doc.get("summary") or empty_summary()
+            if not self.due(summary, len(history)):
+                return
+
+            turns = len(history) - self.keep_turns
+            text = await self.summarize(
+                api_key, summary["text"], history[summary["turns"] : turns]
+            )
+            # Only replace an older summary, another worker may have written a newer one meanwhile
+            await db.update_one(
+                {
+                    "_id": ObjectId(session_id),
+                    "$or": [
+                        {"summary": {"$exists": False}},
+                        {"summary.turns": {"$lt": turns}},
+                    ],
+                },
+                {"$set": {"summary": {"text": text, "turns": turns}}},
+            )
+            self.refreshes += 1
+        except Exception as e:
+            self.failures += 1
+            logging.error(f"Unable to refresh the summary of session {session_id}: {e}")
+
+    def as_dict(self) -> dict:
+        """
+        Returns the counters of the summarizer.
+
+        Returns:
+            dict: The number of summaries refreshed, of failed refreshes and of refreshes running.
+        """
+        return {
+            "refreshes": self.refreshes,
+            "failures": self.failures,
+            "running": len(self.tasks),
+        }
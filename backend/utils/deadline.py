@@ -0,0 +1,125 @@
+import asyncio
+from typing import AsyncIterator, Optional
+from utils.stream_buffer import metadata_event
+
+# Output of an agent stopped by its time or iteration limit with early_stopping_method="force"
+STOPPED_OUTPUT = "Agent stopped due to iteration limit or time limit."
+
+
+class Budget:
+    """
+    Latency deadline and iteration budget of one request.
+
+    Args:
+        seconds (float): Time allowed to answer, from now.
+        max_iterations (int, optional): Maximal number of agent steps, capped by the one of the agent.
+            Defaults to None, the agent's own limit.
+        reserve (float, optional): Seconds kept before the deadline to write a final answer once the agent is stopped.
+            Defaults to 0.0.
+    """
+
+    def __init__(
+        self,
+        seconds: float,
+        max_iterations: Optional[int] = None,
+        reserve: float = 0.0,
+    ) -> None:
+        self.deadline = asyncio.get_running_loop().time() + seconds
+        self.max_iterations = max_iterations
+        self.reserve = reserve
+
+    def remaining(self) -> float:
+        return max(self.deadline - asyncio.get_running_loop().time(), 0.0)
+
+    def time_limit(self) -> float:
+        """
+        Returns the time left to the agent, keeping the reserve to write the final answer.
+
+        Returns:
+            float: Seconds before the deadline minus the reserve, or half of the remaining time if it is shorter.
+        """
+        remaining = self.remaining()
+        return max(remaining - self.reserve, remaining / 2)
+
+    def agent(self, agent: object) -> object:
+        """
+        Returns a copy of the agent limited to the iteration budget, sharing its LLM and tools.
+
+        Args:
+            agent (object): The conversational agent.
+
+        Returns:
+            object: The agent executor.
+
+        The copy stops with a constant output, see `STOPPED_OUTPUT`, instead of the extra blocking LLM call of
+        early_stopping_method="generate", so the final answer can be streamed from what was retrieved so far.
+        The time limit is enforced by the caller, see `time_limit`: the max_execution_time of the executor raises
+        instead of stopping it in async calls.
+        """
+        max_iterations = agent.max_iterations
+        if self.max_iterations is not None:
+            max_iterations = min(max(self.max_iterations, 1), max_iterations)
+        # A shallow copy without validation, `copy` would drop the callbacks of the executor and its tools
+        return agent.construct(
+            **{
+                **agent.__dict__,
+                "max_iterations": max_iterations,
+                "early_stopping_method": "force",
+            }
+        )
+
+
+def request_budget(
+    seconds: Optional[float],
+    max_iterations: Optional[int],
+    settings: object,
+) -> Budget:
+    """
+    Builds the budget of a request from the client override and the server settings.
+
+    Args:
+        seconds (float, optional): Deadline asked by the client, in seconds. Defaults to REQUEST_DEADLINE when None,
+            and is capped by REQUEST_DEADLINE_MAX.
+        max_iterations (int, optional): Maximal number of agent steps asked by the client.
+        settings (object): The application settings.
+
+    Returns:
+        Budget: The budget, starting now.
+    """
+    if seconds is None or seconds <= 0:
+        seconds = settings.REQUEST_DEADLINE
+    return Budget(
+        min(seconds, settings.REQUEST_DEADLINE_MAX),
+        max_iterations,
+        settings.DEADLINE_RESERVE,
+    )
+
+
+async def with_deadline(
+    tokens: AsyncIterator[str], budget: Budget
+) -> AsyncIterator[str]:
+    """
+    Stops a token stream at the deadline of its request.
+
+    Args:
+        tokens (AsyncIterator[str]): The tokens of the answer, possibly ending with a metadata event.
+        budget (Budget): The budget of the request.
+
+    Returns:
+        An asynchronous generator yielding the tokens received before the deadline. A stream cut off by the deadline
+        ends with the metadata event `{"partial": true}`.
+
+    The upstream generator is closed when the stream is cut off, which cancels the generation.
+    """
+    try:
+        while True:
+            try:
+                token = await asyncio.wait_for(tokens.__anext__(), budget.remaining())
+            except StopAsyncIteration:
+                return
+            except asyncio.TimeoutError:
+                yield metadata_event({"partial": True})
+                return
+            yield token
+    finally:
+        await tokens.aclose()
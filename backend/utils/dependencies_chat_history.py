@@ -1,13 +1,53 @@
 # from mongo_db import db
 from utils.error_handler import *
-from typing import List, Tuple
+from utils.conversation_summary import ConversationSummarizer, summary_llm
+from utils.stream_buffer import split_metadata
+from typing import List, Optional, Tuple
 from bson import ObjectId
 from fastapi import Body
 from models import *
 from fastapi.responses import JSONResponse
+from config import settings
+import asyncio
+import logging
 
 # chat_history_collection = db.chat_history_collection
 
+conversation_summarizer = ConversationSummarizer(
+    lambda api_key: summary_llm(
+        api_key, settings.SUMMARY_MODEL, settings.SUMMARY_MAX_TOKENS
+    ),
+    settings.SUMMARY_EVERY_TURNS,
+    settings.SUMMARY_KEEP_TURNS,
+)
+# Turns being saved after their answer was streamed, referenced so they are not garbage collected
+saving_tasks = set()
+
+
+def chat_history_collection():
+    """
+    Returns the chat history collection, connecting to MongoDB on first use.
+
+    Returns:
+        object: The chat history collection.
+    """
+    from mongo_db import database
+
+    return database.chat_history_collection
+
+
+def has_chat_history(session_id: Optional[str]) -> bool:
+    """
+    Tells whether the chat history of a session can be kept in the database, whose ids are ObjectIds.
+
+    Args:
+        session_id (str, optional): The session ID.
+
+    Returns:
+        bool: True if the session ID is a valid ObjectId.
+    """
+    return bool(session_id) and ObjectId.is_valid(session_id)
+
 
 async def update_or_insert_chat_history(db: object, session_id: str, new_history: List):
     """
@@ -48,6 +88,107 @@ async def update_or_insert_chat_history(db: object, session_id: str, new_history
     return {"message": suc_message}
 
 
+async def load_chat_history(
+    db: object, session_id: str
+) -> Tuple[List[List[str]], Optional[dict]]:
+    """
+    Loads the chat history of a session to answer its next query.
+
+    Args:
+        db (object): The database object.
+        session_id (str): The session ID.
+
+    Returns:
+        Tuple[List[List[str]], Optional[dict]]: The past questions and answers, oldest first, and the summary of the
+        first ones if any. No history for a new session, or if the database cannot be read, in which case the query
+        is answered without it.
+    """
+    try:
+        doc = await db.find_one(
+            {"_id": ObjectId(session_id)}, {"chat_history": 1, "summary": 1}
+        )
+    except Exception as e:
+        logging.error(f"Unable to load the chat history of session {session_id}: {e}")
+        return [], None
+    if not doc:
+        return [], None
+    return doc.get("chat_history", []), doc.get("summary")
+
+
+async def save_turn(
+    db: object, session_id: str, question: str, answer: str, api_key: str
+) -> None:
+    """
+    Appends an exchange to the chat history of a session, creating it for a new session, then refreshes the summary
+    of the session if it is due.
+
+    Args:
+        db (object): The database object.
+        session_id (str): The session ID.
+        question (str): The user's question, without the chat history added to the prompt.
+        answer (str): The answer streamed to the user.
+        api_key (str): The OpenAI API key paying for the summary.
+    """
+    try:
+        # A single upsert, whether the session already has a history or not
+        await db.update_one(
+            {"_id": ObjectId(session_id)},
+            {"$push": {"chat_history": [question, answer]}},
+            upsert=True,
+        )
+    except Exception as e:
+        logging.error(f"Unable to save the chat history of session {session_id}: {e}")
+        return
+    if settings.SUMMARY_ENABLED:
+        conversation_summarizer.refresh(db, session_id, api_key)
+
+
+def save_turn_later(
+    db: object, session_id: str, question: str, answer: str, api_key: str
+) -> Optional[asyncio.Task]:
+    """
+    Saves an exchange in the background, so that the end of the answer stream does not wait for the database.
+
+    Args:
+        db (object): The database object.
+        session_id (str): The session ID.
+        question (str): The user's question.
+        answer (str): The answer streamed to the user.
+        api_key (str): The OpenAI API key paying for the summary.
+
+    Returns:
+        Optional[asyncio.Task]: The task saving the exchange, None for an empty answer, which is not saved.
+    """
+    if not answer:
+        return None
+    task = asyncio.create_task(save_turn(db, session_id, question, answer, api_key))
+    saving_tasks.add(task)
+    task.add_done_callback(saving_tasks.discard)
+    return task
+
+
+def save_answer_later(
+    db: object, session_id: str, question: str, response: str, api_key: str
+) -> Optional[asyncio.Task]:
+    """
+    Saves an exchange of `/chat` in the background, unless its answer was cut off by the deadline of the request.
+
+    Args:
+        db (object): The database object.
+        session_id (str): The session ID.
+        question (str): The user's question.
+        response (str): The streamed response, with its metadata event.
+        api_key (str): The OpenAI API key paying for the summary.
+
+    Returns:
+        Optional[asyncio.Task]: The task saving the exchange, None for a partial or empty answer, which is not saved.
+    """
+    answer, metadata = split_metadata(response)
+    if metadata and metadata.get("partial"):
+        return None
+    return save_turn_later(db, session_id, question, answer, api_key)
+
+
 async def get_chat_history_item(db: object, session_id: str):
     """
     Retrieves the chat history for a specific session ID from the database.
@@ -57,14 +198,14 @@ async def get_chat_history_item(db: object, session_id: str):
         session_id (str): The session ID for which chat history needs to be retrieved.
 
     Returns:
-        dict: The chat history associated with the given session ID.
+        dict: The chat history associated with the given session ID, and the summary of its first exchanges if any.
 
     Raises:
         UpdateError: If there is an exception during the database query.
     """
     try:
         doc = await db.find_one({"_id": ObjectId(session_id)})
-        return {"chat_history": doc["chat_history"]}
+        return {"chat_history": doc["chat_history"], "summary": doc.get("summary")}
 
     except Exception as e:
         raise UpdateError(
@@ -1,144 +1,266 @@
 from config import settings
-import pinecone
-import openai
+import asyncio
+from cachetools import TTLCache
 from utils.callback_handler_agent import *
 from utils.callback_handler_chain import *
 from utils.error_handler import *
-from langchain.embeddings.openai import OpenAIEmbeddings
-from langchain.chat_models import ChatOpenAI
-from langchain.vectorstores import Pinecone
-from langchain.tools import DuckDuckGoSearchRun, Tool
-from langchain.agents import initialize_agent, AgentType
-from langchain.callbacks.streaming_stdout import StreamingStdOutCallbackHandler
-from langchain.agents.agent_toolkits import create_retriever_tool
-from langchain.prompts import PromptTemplate
-from langchain.chains import LLMChain
+from utils.embedding_cache import CachedEmbeddings, get_embedding_cache
+from utils.speculative import PrefetchingRetriever
+from utils.chain_pool import key_fingerprint
+from utils.cache_stats import CacheStats
+from utils.startup_profile import startup_profile
+from utils.prompt_assembler import CODE_INSTRUCTION
+from utils.tool_executor import ToolExecutor, offload_tool
+from utils.search_cache import SearchCache
+
+# The OpenAI, Pinecone, FAISS and LangChain agent, model and vector store modules take seconds to import. They are
+# imported by the functions using them, so that a worker with LAZY_STARTUP accepts requests before loading them.
 
 
 # Add your utility functions here. This is a placeholder.
-def update_openai_api_key(new_key: str, model: str):
+
+# Fingerprints of the API key and model pairs that passed validation recently
+validated_keys = TTLCache(
+    settings.KEY_VALIDATION_CACHE_SIZE, settings.KEY_VALIDATION_TTL
+)
+key_validation_stats = CacheStats()
+# Runs the blocking calls of the tools and retriever shared by every chain
+tool_executor = ToolExecutor(settings.TOOL_THREADS, settings.TOOL_TIMEOUT)
+search_cache = SearchCache(
+    settings.SEARCH_CACHE_SIZE,
+    settings.SEARCH_CACHE_TTL,
+    settings.SEARCH_CACHE_STALE_TTL,
+    settings.SEARCH_CONCURRENCY,
+    settings.SEARCH_TIMEOUT,
+    tool_executor,
+)
+
+
+async def validate_openai_api_key(new_key: str, model: str):
     """
-    Updates the OpenAI API key and model in the application settings.
+    Checks that an OpenAI API key can use a model, without changing the application settings.
 
     Args:
-        new_key (str): The new OpenAI API key.
-        model (str): The model to be used with the new API key.
+        new_key (str): The OpenAI API key.
+        model (str): The model to be used with the API key.
 
-    Returns:
-        object: The updated application settings.
-
-    This function updates the OpenAI API key and model, and performs a test call to OpenAI's chat API to verify the new key.
-    If the test call fails, it raises an UpdateError.
+    This function retrieves the model with the key, which fails for an invalid key or a model the key has no
+    access to, without generating a completion. Pairs validated within KEY_VALIDATION_TTL seconds are accepted
+    without calling OpenAI again.
 
     Raises:
-        UpdateError: If the test call to OpenAI's API fails.
+        UpdateError: If the test call to OpenAI's API fails or times out.
     """
+    import openai
+
+    key = (key_fingerprint(new_key), model)
+    if key in validated_keys:
+        key_validation_stats.hits += 1
+        return
+    key_validation_stats.misses += 1
 
     try:
-        openai.api_key = new_key
-
-        # Making a simple test call to OpenAI's chat API
-        openai.ChatCompletion.create(
-            model=model,  # Specify the chat model here
-            messages=[
-                {"role": "system", "content": "You are a helpful assistant."},
-                {"role": "user", "content": "Hello, who are you?"},
-            ],
+        await asyncio.wait_for(
+            openai.Model.aretrieve(model, api_key=new_key),
+            settings.KEY_VALIDATION_TIMEOUT,
         )
 
-        settings.OPENAI_API_KEY = new_key
-        settings.LLM_NAME = model
-
-        # If the call is successful, the key is working
-        return settings
-
     except openai.error.OpenAIError as e:
         raise UpdateError(
             f"Failed to update API key and model due to OpenAI API error: {e}", 400
         )
+    except asyncio.TimeoutError:
+        raise UpdateError(
+            "Failed to update API key and model due to OpenAI API error: "
+            f"no answer within {settings.KEY_VALIDATION_TIMEOUT} seconds",
+            504,
+        )
 
+    # If the call is successful, the key is working
+    validated_keys[key] = True
 
-def setup_conversational_chain(settings: object):
+
+def setup_retrieval(settings: object):
     """
-    Initializes the conversational chain with various tools and configurations.
+    Initializes the vector database, the retriever and the tools, shared by the chains of every API key and model.
 
     Args:
         settings (object): Application settings containing configuration details.
 
     Returns:
-        tuple: A tuple containing the agent, retriever, and language model chain.
+        tuple: A tuple containing the retriever and the tools of the agent.
 
-    This function sets up the conversational agent with various tools (like retrievers and search functions)
-    and configures the language model chain. It handles the initialization of the database, vector database,
-    language model, and other components required for the conversational chain.
+    Query embeddings are served from a two-tier cache (see `CachedEmbeddings`), so recurring queries need no embedding call.
+    With `VECTOR_STORE="faiss"` the documents are searched in a local memory-mapped index instead of Pinecone.
+    With `HYBRID_RETRIEVAL` the retriever also searches a BM25 index of the chunks, see `HybridRetriever`, and
+    startup fails if the chunks cannot be listed, see `load_corpus`.
+    The blocking vector searches and tool calls run in the bounded thread pool of `tool_executor`, see `offload_tool`.
 
     Raises:
         UpdateError: If there is an error during the initialization of any component.
     """
-    global agent
-    global retriever
-    global llm
-
+    import pinecone
+    from langchain.embeddings.openai import OpenAIEmbeddings
+    from langchain.vectorstores import Pinecone
+    from langchain.tools import DuckDuckGoSearchRun, Tool
+    from langchain.agents.agent_toolkits import create_retriever_tool
+    from utils.retrievers import (
+        HybridRetriever,
+        ScoredVectorStoreRetriever,
+        load_corpus,
+    )
+    from utils.faiss_store import load_faiss_store
+
+    startup_profile.lap("retrieval imports")
     tools = []
 
     # Initialize database
 
     try:
-        pinecone.init(
-            api_key=settings.PINECONE_API_KEY, environment=settings.PINECONE_ENV
-        )
-
-        embeddings_model = OpenAIEmbeddings(
-            model=settings.EMBEDDING_NAME, openai_api_key=settings.OPENAI_API_KEY
+        embeddings_model = CachedEmbeddings(
+            OpenAIEmbeddings(
+                model=settings.EMBEDDING_NAME, openai_api_key=settings.OPENAI_API_KEY
+            ),
+            settings.EMBEDDING_NAME,
+            get_embedding_cache(
+                settings.EMBEDDING_NAME,
+                settings.EMBEDDING_CACHE_SIZE,
+                settings.EMBEDDING_CACHE_DIR or None,
+            ),
         )
 
-        vectordb = Pinecone.from_existing_index(settings.INDEX_NAME, embeddings_model)
+        if settings.VECTOR_STORE == "faiss":
+            vectordb = load_faiss_store(settings.FAISS_INDEX_PATH, embeddings_model)
+        else:
+            pinecone.init(
+                api_key=settings.PINECONE_API_KEY, environment=settings.PINECONE_ENV
+            )
+            vectordb = Pinecone.from_existing_index(
+                settings.INDEX_NAME, embeddings_model
+            )
 
     except Exception as e:
         raise UpdateError(f"Error during initialization of vector database: {e}", 401)
+    startup_profile.lap("vector database")
 
-    # Initialize database LLM model
-
-    try:
-        llm = ChatOpenAI(
-            openai_api_key=settings.OPENAI_API_KEY,
-            model_name=settings.LLM_NAME,
-            temperature=0,
-            streaming=True,
-            callbacks=[StreamingStdOutCallbackHandler()],
-        )
-    except Exception as e:
-        raise UpdateError(f"Error during initialization of LLM: {e}", 402)
     # Prepare retriever
 
     try:
-        retriever = vectordb.as_retriever(
-            search_type="similarity_score_threshold",
-            search_kwargs={"score_threshold": 0.1, "k": 1},
-        )
+        corpus = []
+        if settings.HYBRID_RETRIEVAL:
+            corpus = load_corpus(vectordb, settings.BM25_CORPUS_PATH)
+            if not corpus:
+                raise ValueError(
+                    "HYBRID_RETRIEVAL is set but the vector store has no chunks to index with BM25"
+                )
+
+        if corpus:
+            retriever = HybridRetriever.from_documents(
+                corpus,
+                ScoredVectorStoreRetriever(
+                    vectorstore=vectordb,
+                    search_type="similarity_score_threshold",
+                    search_kwargs={
+                        "score_threshold": settings.RETRIEVAL_SIMILARITY,
+                        "k": 4,
+                    },
+                    executor=tool_executor,
+                ),
+                k=1,
+                fetch_k=4,
+            )
+        else:
+            retriever = ScoredVectorStoreRetriever(
+                vectorstore=vectordb,
+                search_type="similarity_score_threshold",
+                search_kwargs={
+                    "score_threshold": settings.RETRIEVAL_SIMILARITY,
+                    "k": 1,
+                },
+                executor=tool_executor,
+            )
     except Exception as e:
         raise UpdateError(f"Error during initialization of retriever: {e}", 403)
+    startup_profile.lap("retriever")
 
     # Initialize tools
 
     try:
+        # The tool serves the documents prefetched for the user query, see `PrefetchingRetriever`
         tool_retrieve = create_retriever_tool(
-            retriever,
+            PrefetchingRetriever(retriever=retriever),
             "Doc_search",
             "Searches and returns documents regarding the IBM Generative AI Python SDK documentation",
         )
 
         search = DuckDuckGoSearchRun()
+
+        async def cached_search(query: str) -> str:
+            return await search_cache.search(query, search.run)
+
         search_tool = Tool(
             name="DuckDuckGo",
-            func=search,  # .run
+            func=search.run,
+            coroutine=cached_search,
             description="This tool is used when you need to do a search on the internet to find information that another tool Doc_search can't find.",
         )
 
-        tools.append(tool_retrieve)
-        tools.append(search_tool)
+        # The search is synchronous, it runs in the thread pool so that it does not stall the other streams.
+        # Its results are cached, see `SearchCache`
+        tools.append(offload_tool(tool_retrieve, tool_executor))
+        tools.append(offload_tool(search_tool, tool_executor))
+
+    except Exception as e:
+        raise UpdateError(f"Error during initialization of tools: {e}", 404)
+    startup_profile.lap("tools")
+
+    return retriever, tools
+
+
+def setup_llm_chains(api_key: str, model: str, tools: list):
+    """
+    Initializes the parts of the conversational chain bound to an API key and model.
+
+    Args:
+        api_key (str): The OpenAI API key.
+        model (str): The name of the chat model.
+        tools (list): The tools of the agent, see `setup_retrieval`.
+
+    Returns:
+        tuple: A tuple containing the agent and the language model chain.
+
+    Raises:
+        UpdateError: If there is an error during the initialization of any component.
+    """
+    from langchain.chat_models import ChatOpenAI
+    from langchain.agents import initialize_agent, AgentType
+    from langchain.callbacks.streaming_stdout import StreamingStdOutCallbackHandler
+    from langchain.prompts import (
+        ChatPromptTemplate,
+        HumanMessagePromptTemplate,
+        SystemMessagePromptTemplate,
+    )
+    from langchain.chains import LLMChain
+
+    startup_profile.lap("LLM imports")
+
+    # Initialize database LLM model
+
+    try:
+        llm = ChatOpenAI(
+            openai_api_key=api_key,
+            model_name=model,
+            temperature=0,
+            streaming=True,
+            callbacks=[StreamingStdOutCallbackHandler()],
+        )
+    except Exception as e:
+        raise UpdateError(f"Error during initialization of LLM: {e}", 402)
+    startup_profile.lap("LLM")
+
+    # Initialize agent
 
-        #        Initialize tools
+    try:
         agent = initialize_agent(
             agent=AgentType.CHAT_CONVERSATIONAL_REACT_DESCRIPTION,
             tools=tools,
@@ -164,27 +286,53 @@ def setup_conversational_chain(settings: object):
         )
 
         agent.agent.llm_chain.prompt.messages[2].prompt.template = template_new
+        # The formatting instruction is sent once in the system message, not with every user input
+        agent.agent.llm_chain.prompt.messages[0].prompt.template += (
+            "\n\n" + CODE_INSTRUCTION
+        )
 
     except Exception as e:
         raise UpdateError(f"Unable to set custom template: {e}", 405)
+    startup_profile.lap("agent")
 
     try:
-        template = (
-            """Answer the following question based on the context provided. Generate a precise and accurate answer, ensuring it is fully"""
-            """supported by the provided context. Make sure you never include symbol " in your output.
-        Context: {context}
+        instruction = (
+            """Answer the following question based on the context provided. Generate a precise and accurate answer, ensuring it is fully """
+            """supported by the provided context. Make sure you never include symbol " in your output.\n\n"""
+            + CODE_INSTRUCTION
+        )
+        template = """Context: {context}
         Question:{input}
         Answer: """
-        )
 
-        prompt = PromptTemplate(template=template, input_variables=["input", "context"])
+        prompt = ChatPromptTemplate.from_messages(
+            [
+                SystemMessagePromptTemplate.from_template(instruction),
+                HumanMessagePromptTemplate.from_template(template),
+            ]
+        )
 
         llm_chain = LLMChain(prompt=prompt, llm=llm)
 
     except Exception as e:
         raise UpdateError(f"Unable to set OpenAI chain: {e}", 406)
+    startup_profile.lap("LLM chain")
 
-    return agent, retriever, llm_chain
+    return agent, llm_chain
+
+
+async def embed_query(retriever_obj: object, query: str):
+    """
+    Embeds a query with the embedding model of the retriever's vector store.
+
+    Args:
+        retriever_obj (object): The retriever whose vector store embeddings are used.
+        query (str): The query to embed.
+
+    Returns:
+        List[float]: The embedding of the query.
+    """
+    return await retriever_obj.vectorstore.embeddings.aembed_query(query)
 
 
 # Retrieve the relevant document
@@ -202,24 +350,13 @@ async def get_source(retriever_obj: object, query: str):
         str: The source of the relevant document if found, otherwise a default value.
 
     This function queries the retriever object for relevant documents based on the input query.
-    It returns the source of the first relevant document if found, or a default value ('DuckDuckGo' or 'No ibm related source found') otherwise.
+    It returns the source of the best scored relevant document if found, or 'Not retrieved' otherwise.
 
     Note:
-        The function returns 'DuckDuckGo' if no documents are found or if an exception occurs.
+        The function returns 'Not retrieved' if no documents are found or if an exception occurs.
     """
     try:
         docs = await retriever_obj.aget_relevant_documents(query)
     except Exception as e:
-        return "Not retrieved"
-    if docs == []:
-        return "Not retrieved"
-    else:
-        try:
-            doc_source = docs[0].metadata["source"]
-        except Exception as e:
-            return "Not retrieved"
-
-        if ("pradyunsg" in doc_source.lower()) or ("sphinx" in  doc_source.lower()):
-            return "Not retrieved"
-        else:
-            return doc_source
+        return NOT_RETRIEVED
+    return document_source(docs)["source"]
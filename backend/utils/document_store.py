@@ -0,0 +1,258 @@
+import hashlib
+import re
+import sqlite3
+import threading
+import time
+from typing import List, Optional, Tuple
+from utils.bm25 import BM25Index
+from utils.cache_stats import CacheStats
+from utils.response_cache import EvictionCountingTTLCache
+from utils.token_budget import count_tokens, encoding_name
+
+_PARAGRAPHS = re.compile(r"\n\s*\n")
+
+
+def document_id(text: str) -> str:
+    """
+    Identifies a document by its content, so uploading the same file twice stores it once.
+
+    Args:
+        text (str): The text extracted from the document.
+
+    Returns:
+        str: The SHA-256 of the text in hexadecimal.
+    """
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def split_text(text: str, chunk_size: int, overlap: int) -> List[str]:
+    """
+    Splits a text into chunks of at most `chunk_size` characters, keeping paragraphs whole when they fit.
+
+    Args:
+        text (str): The text to split.
+        chunk_size (int): Maximal number of characters of a chunk.
+        overlap (int): Number of characters repeated between consecutive windows of a paragraph longer than a chunk.
+
+    Returns:
+        List[str]: The chunks, in the order of the text.
+    """
+    pieces = []
+    for paragraph in _PARAGRAPHS.split(text):
+        paragraph = paragraph.strip()
+        if len(paragraph) <= chunk_size:
+            if paragraph:
+                pieces.append(paragraph)
+            continue
+        # Paragraphs longer than a chunk are cut into overlapping windows ending on whitespace when possible
+        start = 0
+        while start < len(paragraph):
+            end = min(start + chunk_size, len(paragraph))
+            if end < len(paragraph):
+                space = paragraph.rfind(" ", start + overlap + 1, end)
+                end = space if space > 0 else end
+            pieces.append(paragraph[start:end].strip())
+            if end == len(paragraph):
+                break
+            start = max(end - overlap, start + 1)
+
+    chunks = []
+    for piece in pieces:
+        if chunks and len(chunks[-1]) + 2 + len(piece) <= chunk_size:
+            chunks[-1] += "\n\n" + piece
+        else:
+            chunks.append(piece)
+    return chunks
+
+
+class StoredDocument:
+    """
+    An uploaded document, its chunks and the BM25 index of the chunks.
+
+    Args:
+        text (str): The text extracted from the document.
+        chunk_size (int): Maximal number of characters of a chunk.
+        overlap (int): Number of characters repeated between the windows of a long paragraph.
+
+    The number of tokens of each chunk is counted once per encoding, the first time the document is sent to a model
+    using it.
+    """
+
+    def __init__(self, text: str, chunk_size: int, overlap: int) -> None:
+        self.id = document_id(text)
+        self.text = text
+        self.chunks = split_text(text, chunk_size, overlap)
+        self.index = BM25Index(self.chunks)
+        self.token_counts = {}
+
+    def chunk_tokens(self, model: str) -> List[int]:
+        """
+        Returns the number of tokens of each chunk for a model.
+
+        Args:
+            model (str): The model name.
+
+        Returns:
+            List[int]: The token counts, in the order of the chunks.
+        """
+        name = encoding_name(model)
+        if name not in self.token_counts:
+            self.token_counts[name] = [count_tokens(c, model) for c in self.chunks]
+        return self.token_counts[name]
+
+    def select(self, query: str, model: str, max_tokens: int) -> Tuple[str, int]:
+        """
+        Selects the chunks most relevant to a query that fit a token budget.
+
+        Args:
+            query (str): The query string.
+            model (str): The name of the model the chunks are sent to.
+            max_tokens (int): Maximal number of tokens of the selected text.
+
+        Returns:
+            Tuple[str, int]: The selected chunks in the order of the document, and their number of tokens. The whole
+            text if it fits the budget.
+
+        Chunks are taken by decreasing BM25 score, then in the order of the document for the chunks sharing no term
+        with the query, skipping those too long for the remaining budget. If no chunk fits, the best one is cut to
+        the budget.
+        """
+        tokens = self.chunk_tokens(model)
+        # Chunks are joined by a blank line, about one token each
+        if sum(tokens) + len(tokens) <= max_tokens:
+            return self.text, sum(tokens) + len(tokens)
+
+        ranked = [doc_id for doc_id, _ in self.index.search(query, len(self.chunks))]
+        matched = set(ranked)
+        ranked += [i for i in range(len(self.chunks)) if i not in matched]
+        selected, used = [], 0
+        for i in ranked:
+            if used + tokens[i] + 1 <= max_tokens:
+                selected.append(i)
+                used += tokens[i] + 1
+        if not selected and ranked and max_tokens > 0:
+            # Not even one chunk fits, send the beginning of the best one
+            best = self.chunks[ranked[0]]
+            text = best[: len(best) * max_tokens // tokens[ranked[0]]]
+            return text, count_tokens(text, model)
+        return "\n\n".join(self.chunks[i] for i in sorted(selected)), used
+
+    def as_dict(self) -> dict:
+        return {
+            "document_id": self.id,
+            "characters": len(self.text),
+            "chunks": len(self.chunks),
+        }
+
+
+class DocumentStore:
+    """
+    Store of the documents uploaded for the LLM chain, keyed by the hash of their content.
+
+    Args:
+        max_size (int): Maximal number of parsed documents kept in memory. The least recently used one is evicted first.
+        ttl (float): Time to live of a document in seconds, in memory and on disk.
+        chunk_size (int): Maximal number of characters of a chunk.
+        overlap (int): Number of characters repeated between the windows of a long paragraph.
+        path (str, optional): Path of an SQLite file keeping the texts, so that documents uploaded to one worker of
+            the host are found by the others and survive restarts. Defaults to None, which keeps them in memory only.
+
+    A document is split and indexed once, when it is uploaded or first read from disk by a worker. The store is
+    used from the threads of the endpoints, its memory tier and database connection are guarded by a lock.
+    """
+
+    def __init__(
+        self,
+        max_size: int,
+        ttl: float,
+        chunk_size: int,
+        overlap: int,
+        path: Optional[str] = None,
+    ) -> None:
+        self.ttl = ttl
+        self.chunk_size = chunk_size
+        self.overlap = overlap
+        self.stats = CacheStats()
+        self.memory = EvictionCountingTTLCache(max_size, ttl, self.stats)
+        self.lock = threading.Lock()
+        self.db = None
+        if path:
+            self.db = sqlite3.connect(path, check_same_thread=False)
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS documents "
+                "(id TEXT PRIMARY KEY, text TEXT NOT NULL, created REAL NOT NULL)"
+            )
+            self.db.execute(
+                "DELETE FROM documents WHERE created < ?", (time.time() - ttl,)
+            )
+            self.db.commit()
+
+    def add(self, text: str) -> StoredDocument:
+        """
+        Stores a document, unless the same text is already stored.
+
+        Args:
+            text (str): The text extracted from the document.
+
+        Returns:
+            StoredDocument: The stored document.
+        """
+        document = self._load(document_id(text))
+        if document is not None:
+            return document
+
+        document = StoredDocument(text, self.chunk_size, self.overlap)
+        with self.lock:
+            self.memory[document.id] = document
+            if self.db is not None:
+                self.db.execute(
+                    "INSERT OR REPLACE INTO documents (id, text, created) VALUES (?, ?, ?)",
+                    (document.id, text, time.time()),
+                )
+                self.db.commit()
+        return document
+
+    def get(self, doc_id: str) -> Optional[StoredDocument]:
+        """
+        Looks up a document, first in memory and then on disk.
+
+        Args:
+            doc_id (str): The id returned when the document was uploaded.
+
+        Returns:
+            Optional[StoredDocument]: The document, or None if it is unknown or expired.
+        """
+        document = self._load(doc_id)
+        with self.lock:
+            if document is None:
+                self.stats.misses += 1
+            else:
+                self.stats.hits += 1
+        return document
+
+    def _load(self, doc_id: str) -> Optional[StoredDocument]:
+        with self.lock:
+            document = self.memory.get(doc_id)
+            row = None
+            if document is None and self.db is not None:
+                row = self.db.execute(
+                    "SELECT text FROM documents WHERE id = ? AND created >= ?",
+                    (doc_id, time.time() - self.ttl),
+                ).fetchone()
+        if row:
+            # Indexed outside the lock, a concurrent load of the same document only repeats the work
+            document = StoredDocument(row[0], self.chunk_size, self.overlap)
+            with self.lock:
+                self.memory[doc_id] = document
+        return document
+
+    def as_dict(self) -> dict:
+        """
+        Returns the counters of the store.
+
+        Returns:
+            dict: The hit, miss and eviction counters and the number of documents in memory.
+        """
+        with self.lock:
+            return {**self.stats.as_dict(), "size": len(self.memory)}
@@ -0,0 +1,207 @@
+import fcntl
+import hashlib
+import os
+import threading
+from typing import List, Optional
+import numpy as np
+from cachetools import LRUCache
+from langchain.schema.embeddings import Embeddings
+from utils.cache_stats import CacheStats
+
+
+class EmbeddingStore:
+    """
+    Append-only on-disk store of float32 vectors, read through a memory map.
+
+    Args:
+        directory (str): The folder holding `vectors.f32` (raw rows of float32) and `keys.txt` (one line per row
+            with its key, dimension and row number).
+
+    A row is written before its key, so every key in `keys.txt` points to a complete vector. Appends are serialized
+    with an exclusive file lock, so all workers of the host can share one store; each of them picks up the rows
+    appended by the others when it misses a key. A writer that crashed or ran out of space between the two writes
+    leaves bytes after the last complete row and key, the next append truncates them first.
+    """
+
+    def __init__(self, directory: str) -> None:
+        os.makedirs(directory, exist_ok=True)
+        self.vectors_path = os.path.join(directory, "vectors.f32")
+        self.keys_path = os.path.join(directory, "keys.txt")
+        self.lock_path = os.path.join(directory, ".lock")
+        self.rows = {}
+        self.keys_offset = 0
+        self.dim = None
+        self.matrix = None
+        self.refresh()
+
+    def refresh(self) -> None:
+        """
+        Reads the keys appended since the last refresh.
+        """
+        if not os.path.exists(self.keys_path):
+            return
+        with open(self.keys_path, "rb") as f:
+            f.seek(self.keys_offset)
+            data = f.read()
+        # Ignore a trailing line that is still being written
+        complete = data[: data.rfind(b"\n") + 1]
+        for line in complete.decode("ascii").splitlines():
+            key, dim, row = line.split(" ")
+            self.dim = int(dim)
+            self.rows[key] = int(row)
+        self.keys_offset += len(complete)
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        """
+        Reads a vector.
+
+        Args:
+            key (str): The key of the vector.
+
+        Returns:
+            Optional[np.ndarray]: A copy of the stored vector, or None if the key is unknown.
+        """
+        row = self.rows.get(key)
+        if row is None:
+            self.refresh()
+            row = self.rows.get(key)
+            if row is None:
+                return None
+        if self.matrix is None or row >= self.matrix.shape[0]:
+            # Only the rows of known keys, the file may end with a row being written
+            self.matrix = np.memmap(
+                self.vectors_path,
+                dtype=np.float32,
+                mode="r",
+                shape=(len(self.rows), self.dim),
+            )
+        return np.array(self.matrix[row])
+
+    def put(self, key: str, vector: np.ndarray) -> None:
+        """
+        Appends a vector unless another worker stored it already.
+
+        Args:
+            key (str): The key of the vector.
+            vector (np.ndarray): The float32 vector. All vectors of a store have the same dimension.
+        """
+        with open(self.lock_path, "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            self.refresh()
+            if key in self.rows:
+                return
+            row = len(self.rows)
+            vector = vector.astype(np.float32)
+            with open(self.vectors_path, "ab") as f:
+                f.truncate(row * vector.nbytes)
+                f.write(vector.tobytes())
+            with open(self.keys_path, "ab") as f:
+                f.truncate(self.keys_offset)
+                f.write(f"{key} {vector.shape[0]} {row}\n".encode("ascii"))
+            self.refresh()
+
+
+class EmbeddingCache:
+    """
+    Two-tier cache of query embeddings: an in-process LRU in front of an optional memory-mapped store.
+
+    Args:
+        max_size (int): Maximal number of vectors kept in the in-process LRU.
+        directory (str, optional): Folder of the on-disk store. Defaults to None, which keeps the cache in memory only.
+    """
+
+    def __init__(self, max_size: int, directory: Optional[str] = None) -> None:
+        self.memory = LRUCache(max_size)
+        self.store = EmbeddingStore(directory) if directory else None
+        self.stats = CacheStats()
+        self.lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        with self.lock:
+            vector = self.memory.get(key)
+            if vector is None and self.store is not None:
+                vector = self.store.get(key)
+                if vector is not None:
+                    self.memory[key] = vector
+            if vector is None:
+                self.stats.misses += 1
+            else:
+                self.stats.hits += 1
+            return vector
+
+    def put(self, key: str, vector: np.ndarray) -> None:
+        with self.lock:
+            self.memory[key] = vector
+            if self.store is not None:
+                self.store.put(key, vector)
+
+
+# One cache per embedding model, kept across chain rebuilds
+embedding_caches = {}
+
+
+def get_embedding_cache(
+    model: str, max_size: int, directory: Optional[str] = None
+) -> EmbeddingCache:
+    """
+    Returns the process-wide embedding cache of a model, creating it on first use.
+
+    Args:
+        model (str): The name of the embedding model.
+        max_size (int): Maximal number of vectors kept in the in-process LRU.
+        directory (str, optional): Root folder of the on-disk stores, one sub-folder per model. Defaults to None.
+
+    Returns:
+        EmbeddingCache: The cache of the model.
+    """
+    if model not in embedding_caches:
+        model_directory = os.path.join(directory, model) if directory else None
+        embedding_caches[model] = EmbeddingCache(max_size, model_directory)
+    return embedding_caches[model]
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Embeddings wrapper serving query embeddings from an `EmbeddingCache`.
+
+    Args:
+        embeddings (Embeddings): The embedding model computing the vectors on a cache miss.
+        model (str): The name of the embedding model, part of every cache key.
+        cache (EmbeddingCache): The cache of this model.
+
+    Only queries are cached; documents are embedded once when the index is built and are passed through.
+    """
+
+    def __init__(
+        self, embeddings: Embeddings, model: str, cache: EmbeddingCache
+    ) -> None:
+        self.embeddings = embeddings
+        self.model = model
+        self.cache = cache
+
+    def key(self, text: str) -> str:
+        return hashlib.sha256(f"{self.model}\0{text}".encode("utf-8")).hexdigest()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.embeddings.embed_documents(texts)
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        return await self.embeddings.aembed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        key = self.key(text)
+        vector = self.cache.get(key)
+        if vector is None:
+            vector = np.asarray(self.embeddings.embed_query(text), dtype=np.float32)
+            self.cache.put(key, vector)
+        return vector.tolist()
+
+    async def aembed_query(self, text: str) -> List[float]:
+        key = self.key(text)
+        vector = self.cache.get(key)
+        if vector is None:
+            vector = np.asarray(
+                await self.embeddings.aembed_query(text), dtype=np.float32
+            )
+            self.cache.put(key, vector)
+        return vector.tolist()
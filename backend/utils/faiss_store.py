@@ -0,0 +1,160 @@
+import argparse
+import os
+import pickle
+from typing import List, Tuple
+import numpy as np
+from langchain.docstore.in_memory import InMemoryDocstore
+from langchain.schema import Document
+from langchain.schema.embeddings import Embeddings
+from langchain.vectorstores import FAISS
+from langchain.vectorstores.utils import DistanceStrategy
+
+VECTORS_FILE = "vectors.npy"
+DOCSTORE_FILE = "index.pkl"
+
+
+class MemmapFlatIndex:
+    """
+    Exact inner-product index over vectors memory-mapped from a `.npy` file, searched like a FAISS index.
+
+    Args:
+        vectors (np.ndarray): The L2-normalized vectors, one row per document, e.g. a read-only `np.memmap`.
+
+    faiss-cpu only memory-maps the inverted lists of IVF indexes, a flat index read with `IO_FLAG_MMAP` is still
+    copied into every process. The rows of a memory map stay in the OS page cache, shared by all the workers of the
+    host, and a search scans them like `IndexFlatIP` does.
+    """
+
+    def __init__(self, vectors: np.ndarray) -> None:
+        self.vectors = vectors
+        self.ntotal, self.d = vectors.shape
+
+    def search(self, queries: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Returns the k rows with the highest inner product with each query.
+
+        Args:
+            queries (np.ndarray): The query vectors, one per row.
+            k (int): The number of rows returned per query.
+
+        Returns:
+            tuple: The inner products and the row numbers, best first, with the shapes of a FAISS search. Missing
+            results, when the index holds fewer than k rows, have the row number -1.
+        """
+        scores = np.asarray(queries, dtype=np.float32) @ self.vectors.T
+        distances = np.full((len(scores), k), np.finfo(np.float32).min, np.float32)
+        labels = np.full((len(scores), k), -1, np.int64)
+        n = min(k, self.ntotal)
+        if n:
+            # The n best rows in any order, then sorted by decreasing score
+            rows = np.argpartition(-scores, n - 1, axis=1)[:, :n]
+            best = np.take_along_axis(scores, rows, 1)
+            order = np.argsort(-best, axis=1)
+            distances[:, :n] = np.take_along_axis(best, order, 1)
+            labels[:, :n] = np.take_along_axis(rows, order, 1)
+        return distances, labels
+
+    def reconstruct(self, row: int) -> np.ndarray:
+        return np.array(self.vectors[row])
+
+
+def build_faiss_store(
+    documents: List[Document], embeddings: Embeddings, path: str
+) -> FAISS:
+    """
+    Embeds documents into an inner-product index and saves it for `load_faiss_store`.
+
+    Args:
+        documents (List[Document]): The documents to index, with their `source` metadata.
+        embeddings (Embeddings): The embedding model, the same one that embeds the queries.
+        path (str): The folder receiving `vectors.npy` and `index.pkl`.
+
+    Returns:
+        FAISS: The vector store of the saved index.
+
+    Vectors are L2-normalized, so the inner product the index returns is the cosine similarity, the score of a
+    Pinecone index with the cosine metric. Queries are not normalized, OpenAI embeddings have unit length.
+    """
+    vectors = np.asarray(
+        embeddings.embed_documents([doc.page_content for doc in documents]),
+        dtype=np.float32,
+    )
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+
+    ids = [str(i) for i in range(len(documents))]
+    docstore = InMemoryDocstore(dict(zip(ids, documents)))
+    index_to_docstore_id = dict(enumerate(ids))
+
+    os.makedirs(path, exist_ok=True)
+    np.save(os.path.join(path, VECTORS_FILE), vectors)
+    with open(os.path.join(path, DOCSTORE_FILE), "wb") as f:
+        pickle.dump((docstore, index_to_docstore_id), f)
+    return load_faiss_store(path, embeddings)
+
+
+def load_faiss_store(path: str, embeddings: Embeddings) -> FAISS:
+    """
+    Loads an index saved by `build_faiss_store` with its vectors memory-mapped.
+
+    Args:
+        path (str): The folder holding `vectors.npy` and `index.pkl`.
+        embeddings (Embeddings): The embedding model of the queries.
+
+    Returns:
+        FAISS: A vector store scoring documents like the Pinecone store it replaces.
+
+    The vectors are read through a read-only memory map instead of being copied into the process, so every worker
+    of the host shares the same pages of the OS page cache and startup does not depend on the index size.
+    """
+    vectors = np.load(os.path.join(path, VECTORS_FILE), mmap_mode="r")
+    with open(os.path.join(path, DOCSTORE_FILE), "rb") as f:
+        docstore, index_to_docstore_id = pickle.load(f)
+    # Raw scores are cosine similarities, as with Pinecone, so the retriever's score_threshold keeps its meaning
+    return FAISS(
+        embeddings,
+        MemmapFlatIndex(vectors),
+        docstore,
+        index_to_docstore_id,
+        distance_strategy=DistanceStrategy.COSINE,
+    )
+
+
+def main():
+    """
+    Builds the index of `VECTOR_STORE="faiss"` from the chunks of the Pinecone index, or of a JSON Lines corpus.
+
+    Run from the backend folder:
+        python -m utils.faiss_store FAISS_INDEX_PATH [--corpus BM25_CORPUS_PATH]
+    """
+    import pinecone
+    from langchain.embeddings.openai import OpenAIEmbeddings
+    from langchain.vectorstores import Pinecone
+    from config import settings
+    from utils.retrievers import export_pinecone_corpus, read_corpus
+
+    parser = argparse.ArgumentParser(description=main.__doc__.strip().splitlines()[0])
+    parser.add_argument("path", help="folder receiving the index")
+    parser.add_argument(
+        "--corpus",
+        help="JSON Lines file of the chunks, see `write_corpus`. Defaults to the chunks of the Pinecone index",
+    )
+    args = parser.parse_args()
+
+    embeddings = OpenAIEmbeddings(
+        model=settings.EMBEDDING_NAME, openai_api_key=settings.OPENAI_API_KEY
+    )
+    if args.corpus:
+        documents = read_corpus(args.corpus)
+    else:
+        pinecone.init(
+            api_key=settings.PINECONE_API_KEY, environment=settings.PINECONE_ENV
+        )
+        documents = export_pinecone_corpus(
+            Pinecone.from_existing_index(settings.INDEX_NAME, embeddings)
+        )
+    build_faiss_store(documents, embeddings, args.path)
+    print(f"Indexed {len(documents)} chunks in {args.path}")
+
+
+if __name__ == "__main__":
+    main()
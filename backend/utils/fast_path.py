@@ -0,0 +1,313 @@
+import asyncio
+import logging
+from contextlib import suppress
+from typing import AsyncIterator, List, Optional
+from langchain.schema import Document
+from utils.callback_handler_agent import (
+    AsyncCallbackHandler,
+    NOT_RETRIEVED,
+    create_gen,
+    document_source,
+    run_call_no_stream,
+)
+from utils.callback_handler_chain import (
+    AsyncCallbackHandler_LLM,
+    llm_create_gen,
+    llm_run_call_no_stream,
+)
+from utils.deadline import Budget
+from utils.speculative import Prefetch, start_prefetch
+from utils.stream_buffer import metadata_event
+
+# Paths reported in the metadata of an answer, the agent path reports "agent" itself
+FAST_PATH = "fast"
+CACHE_PATH = "cache"
+
+
+class RouteStats:
+    """
+    Counters of the path taken by the answered queries.
+
+    Attributes:
+        fast (int): Number of queries answered by the retrieval-augmented LLM chain.
+        agent (int): Number of queries answered by the ReAct agent.
+    """
+
+    def __init__(self) -> None:
+        self.fast = 0
+        self.agent = 0
+
+    def as_dict(self) -> dict:
+        """
+        Returns the counters and the share of queries that skipped the agent.
+
+        Returns:
+            dict: Number of queries per path and fast path ratio.
+        """
+        total = self.fast + self.agent
+        return {
+            "fast": self.fast,
+            "agent": self.agent,
+            "fast_ratio": self.fast / total if total else 0.0,
+        }
+
+
+async def retrieve(
+    retriever: object, query: str, prefetch: Optional[Prefetch] = None
+) -> Optional[List[Document]]:
+    """
+    Retrieves the documents the routing decision is based on.
+
+    Args:
+        retriever (object): The retriever of the Doc_search tool.
+        query (str): The query string.
+        prefetch (Prefetch, optional): A retrieval already started, used instead of retrieving for the query.
+            Defaults to None.
+
+    Returns:
+        Optional[List[Document]]: The retrieved documents, None if the retrieval failed.
+    """
+    try:
+        if prefetch is not None:
+            return await prefetch.take()
+        return await retriever.aget_relevant_documents(query)
+    except Exception as e:
+        logging.warning(f"Routing retrieval failed, falling back to the agent: {e}")
+        return None
+
+
+def is_confident(docs: List[Document], min_similarity: float) -> bool:
+    """
+    Tells whether the retrieved documents are good enough to answer without the agent.
+
+    Args:
+        docs (List[Document]): The retrieved documents, best first.
+        min_similarity (float): Minimal cosine similarity of the best document.
+
+    Returns:
+        bool: True if the best document is an SDK documentation page matched by a lexical short-circuit of the hybrid
+        retriever or close enough to the query.
+    """
+    if not docs or document_source(docs)["source"] == NOT_RETRIEVED:
+        return False
+    metadata = docs[0].metadata
+    return (
+        metadata.get("retrieval") == "lexical"
+        or metadata.get("score", 0.0) >= min_similarity
+    )
+
+
+def build_context(docs: List[Document]) -> str:
+    return "\n\n".join(doc.page_content for doc in docs)
+
+
+def agent_gen(
+    agent: object,
+    llm: object,
+    query: str,
+    prefetch: Optional[Prefetch] = None,
+    budget: Optional[Budget] = None,
+) -> AsyncIterator[str]:
+    """
+    Streams the answer of the agent within the budget of the request.
+
+    Args:
+        agent (object): The conversational agent.
+        llm (object): The retrieval-augmented LLM chain.
+        query (str): The query string.
+        prefetch (Prefetch, optional): Documents retrieved ahead for the query. Defaults to None.
+        budget (Budget, optional): The deadline and iteration budget of the request. Defaults to None, the limits of
+            the agent.
+
+    Returns:
+        An asynchronous generator yielding the answer tokens, then a metadata event, see `create_gen`.
+
+    When the agent is stopped near the deadline or after its last iteration, the LLM chain answers from the
+    documents the agent retrieved so far.
+    """
+    time_limit = None
+    if budget is not None:
+        agent, time_limit = budget.agent(agent), budget.time_limit()
+    return create_gen(
+        agent,
+        query,
+        AsyncCallbackHandler(),
+        prefetch,
+        fallback=lambda docs: llm_create_gen(
+            llm, query, build_context(docs), AsyncCallbackHandler_LLM()
+        ),
+        time_limit=time_limit,
+    )
+
+
+async def agent_call_no_stream(
+    agent: object,
+    llm: object,
+    query: str,
+    prefetch: Optional[Prefetch] = None,
+    budget: Optional[Budget] = None,
+) -> dict:
+    """
+    Answers a query with the agent within the budget of the request, without streaming.
+
+    Args:
+        agent (object): The conversational agent.
+        llm (object): The retrieval-augmented LLM chain.
+        query (str): The query string.
+        prefetch (Prefetch, optional): Documents retrieved ahead for the query. Defaults to None.
+        budget (Budget, optional): The deadline and iteration budget of the request. Defaults to None.
+
+    Returns:
+        dict: The response of `run_call_no_stream`.
+    """
+
+    async def fallback(docs: List[Document]) -> str:
+        response = await llm_run_call_no_stream(llm, query, build_context(docs))
+        return response["text"]
+
+    time_limit = None
+    if budget is not None:
+        agent, time_limit = budget.agent(agent), budget.time_limit()
+    return await run_call_no_stream(agent, query, prefetch, fallback, time_limit)
+
+
+async def routed_gen(
+    agent: object,
+    llm: object,
+    retriever: object,
+    query: str,
+    min_similarity: float,
+    stats: RouteStats,
+    budget: Optional[Budget] = None,
+    prefetch: Optional[Prefetch] = None,
+    speculative: bool = False,
+) -> AsyncIterator[str]:
+    """
+    Streams the answer to a query from the fast path or from the agent.
+
+    Args:
+        agent (object): The conversational agent.
+        llm (object): The retrieval-augmented LLM chain.
+        retriever (object): The retriever of the Doc_search tool.
+        query (str): The query string.
+        min_similarity (float): Minimal similarity of the best document for the fast path, see `is_confident`.
+        stats (RouteStats): The counters to update.
+        budget (Budget, optional): The deadline and iteration budget of the request, see `agent_gen`.
+            Defaults to None.
+        prefetch (Prefetch, optional): The retrieval of the question, started before the query was built, e.g. while
+            loading the chat history. Defaults to None, retrieving for the query.
+        speculative (bool, optional): Whether the agent starts planning while the routing retrieval runs.
+            Defaults to False.
+
+    Returns:
+        An asynchronous generator yielding the answer tokens, then a metadata event with the source, score and path.
+
+    Documentation questions with a confident retrieval are answered by a single LLM chain call on the retrieved
+    documents, instead of an agent call planning the Doc_search call and another one writing the answer. Otherwise
+    the agent answers, its Doc_search tool is served the routing retrieval when it searches for the query.
+    A speculative agent saves the retrieval time on the agent path, but its planning call is billed and counted in
+    the rate limits on the fast path too, where it is cancelled.
+    """
+    prefetch = prefetch or start_prefetch(retriever, query)
+    tokens, first = None, None
+    if speculative:
+        tokens = agent_gen(agent, llm, query, prefetch.share(), budget)
+        first = asyncio.ensure_future(anext(tokens))
+    try:
+        docs = await retrieve(retriever, query, prefetch)
+        if is_confident(docs, min_similarity):
+            stats.fast += 1
+            await cancel_agent(first, tokens)
+            answer = llm_create_gen(
+                llm, query, build_context(docs), AsyncCallbackHandler_LLM()
+            )
+            async for token in answer:
+                yield token
+            yield metadata_event({**document_source(docs), "path": FAST_PATH})
+        else:
+            stats.agent += 1
+            if tokens is None:
+                tokens = agent_gen(agent, llm, query, prefetch.share(), budget)
+            else:
+                yield await first
+            async for token in tokens:
+                yield token
+    finally:
+        # The consumer went away, e.g. the client disconnected
+        await cancel_agent(first, tokens)
+        prefetch.close()
+
+
+async def cancel_agent(
+    first: Optional[asyncio.Future], tokens: Optional[AsyncIterator[str]]
+):
+    # Stops the agent, waiting for its first token or not started yet
+    if tokens is None:
+        return
+    if first is not None and not first.done():
+        first.cancel()
+        with suppress(asyncio.CancelledError, StopAsyncIteration):
+            await first
+    await tokens.aclose()
+
+
+async def routed_call_no_stream(
+    agent: object,
+    llm: object,
+    retriever: object,
+    query: str,
+    min_similarity: float,
+    stats: RouteStats,
+    budget: Optional[Budget] = None,
+    prefetch: Optional[Prefetch] = None,
+    speculative: bool = False,
+) -> dict:
+    """
+    Answers a query from the fast path or from the agent, without streaming.
+
+    Args:
+        agent (object): The conversational agent.
+        llm (object): The retrieval-augmented LLM chain.
+        retriever (object): The retriever of the Doc_search tool.
+        query (str): The query string.
+        min_similarity (float): Minimal similarity of the best document for the fast path, see `is_confident`.
+        stats (RouteStats): The counters to update.
+        budget (Budget, optional): The deadline and iteration budget of the request. Defaults to None.
+        prefetch (Prefetch, optional): The retrieval of the question, started before the query was built.
+            Defaults to None, retrieving for the query.
+        speculative (bool, optional): Whether the agent starts while the routing retrieval runs, see `routed_gen`.
+            Defaults to False.
+
+    Returns:
+        dict: The input, empty chat history, output, source, score and path, as returned by `run_call_no_stream`.
+    """
+    prefetch = prefetch or start_prefetch(retriever, query)
+    agent_call = None
+    if speculative:
+        agent_call = asyncio.ensure_future(
+            agent_call_no_stream(agent, llm, query, prefetch.share(), budget)
+        )
+    try:
+        docs = await retrieve(retriever, query, prefetch)
+        if is_confident(docs, min_similarity):
+            stats.fast += 1
+            if agent_call is not None:
+                agent_call.cancel()
+            response = await llm_run_call_no_stream(llm, query, build_context(docs))
+            return {
+                "input": query,
+                "chat_history": [],
+                "output": response["text"],
+                **document_source(docs),
+                "path": FAST_PATH,
+            }
+        stats.agent += 1
+        if agent_call is None:
+            return await agent_call_no_stream(
+                agent, llm, query, prefetch.share(), budget
+            )
+        return await agent_call
+    finally:
+        if agent_call is not None and not agent_call.done():
+            agent_call.cancel()
+        prefetch.close()
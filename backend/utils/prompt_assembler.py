@@ -0,0 +1,125 @@
+import threading
+from typing import List, Optional, Tuple
+from cachetools import LRUCache
+from utils.cache_stats import CacheStats
+from utils.token_budget import context_window, count_tokens, encoding_name
+
+# Sent once per call in the system message of the agent and of the LLM chain, see `setup_llm_chains`
+CODE_INSTRUCTION = (
+    "Whenever the user asks a question that requires a Python script for the answer, "
+    "format your response by beginning and ending the Python code with triple tildes (~~~). "
+    "This formatting should be used consistently for all Python code responses. Whenever you are requested "
+    'to provide a Python script by prompt "output python", "provide python", etc, always output the complete script '
+    "directly in the response instead of referring to external links, regardless of its length. "
+    'If there is only a question in the sense of outputting a Python script such as "output python", '
+    "focus on your last response in the chat history."
+)
+
+
+def format_turn(turn: List[str]) -> str:
+    """
+    Formats a past exchange of the chat history.
+
+    Args:
+        turn (List[str]): The user's question and the assistant's answer.
+
+    Returns:
+        str: The exchange with one labelled line per message.
+    """
+    question, answer = (list(turn) + ["", ""])[:2]
+    return f"User: {question}\nAssistant: {answer}"
+
+
+class PromptAssembler:
+    """
+    Builds the input of the agent and of the LLM chain from a query and as much recent chat history as fits a
+    token budget.
+
+    Args:
+        max_history_tokens (int): Maximal number of tokens of history, at most a quarter of the context window of
+            the model.
+        cache_size (int): Maximal number of exchanges whose token count is cached.
+
+    The token count of each exchange is cached per encoding, so packing the history of a growing conversation only
+    counts the exchanges added since the previous turn.
+    """
+
+    def __init__(self, max_history_tokens: int, cache_size: int) -> None:
+        self.max_history_tokens = max_history_tokens
+        self.stats = CacheStats()
+        self.counts = LRUCache(cache_size)
+        self.lock = threading.Lock()
+
+    def history_budget(self, model: str) -> int:
+        """
+        Returns the number of tokens of history sent to a model.
+
+        Args:
+            model (str): The model name.
+
+        Returns:
+            int: The smallest of the configured budget and a quarter of the context window of the model.
+        """
+        return min(self.max_history_tokens, context_window(model) // 4)
+
+    def turn_tokens(self, text: str, model: str) -> int:
+        key = (encoding_name(model), text)
+        with self.lock:
+            count = self.counts.get(key)
+            if count is not None:
+                self.stats.hits += 1
+                return count
+            self.stats.misses += 1
+        count = count_tokens(text, model)
+        with self.lock:
+            self.counts[key] = count
+        return count
+
+    def assemble(
+        self,
+        query: str,
+        history: Optional[List[List[str]]],
+        model: str,
+        summary: Optional[dict] = None,
+    ) -> Tuple[str, int]:
+        """
+        Combines a query with the summary of the conversation and the most recent exchanges of the chat history
+        that fit the budget of the model.
+
+        Args:
+            query (str): The user's question.
+            history (List[List[str]], optional): The past questions and answers, oldest first.
+            model (str): The name of the model answering the query.
+            summary (dict, optional): The summary of the `turns` first exchanges of the history, see
+                `ConversationSummarizer`. Only the exchanges after them are added verbatim. Defaults to None.
+
+        Returns:
+            Tuple[str, int]: The input of the model, and the number of exchanges of history it includes. The query
+            alone if there is no history or none fits.
+        """
+        budget = self.history_budget(model)
+        history = history or []
+        parts = []
+        if summary and summary.get("text"):
+            history = history[summary["turns"] :]
+            text = f"Summary of the earlier conversation: {summary['text']}"
+            budget -= self.turn_tokens(text, model)
+            parts.append(text)
+
+        turns, used = [], 0
+        for turn in reversed(history):
+            text = format_turn(turn)
+            tokens = self.turn_tokens(text, model)
+            if used + tokens > budget:
+                break
+            turns.append(text)
+            used += tokens
+        if not turns and not parts:
+            return query, 0
+
+        history_text = "\n\n".join(parts + turns[::-1])
+        return (
+            f"Chat history:\n{history_text}\n\n"
+            f"Keep in mind the above chat history to answer the following input question: {query}",
+            len(turns),
+        )
@@ -0,0 +1,130 @@
+import hashlib
+import sqlite3
+import threading
+import time
+from typing import Optional
+from cachetools import TTLCache
+from utils.cache_stats import CacheStats
+
+
+def normalize_query(query: str) -> str:
+    """
+    Normalizes a query so that trivially different spellings share a cache key.
+
+    Args:
+        query (str): The query string.
+
+    Returns:
+        str: The lower-cased query with collapsed whitespace.
+    """
+    return " ".join(query.lower().split())
+
+
+def response_cache_key(query: str, context: str, model: str) -> str:
+    """
+    Builds the cache key of an LLM chain answer.
+
+    Args:
+        query (str): The query string.
+        context (str): The context the query is answered from.
+        model (str): The name of the model generating the answer.
+
+    Returns:
+        str: Hashes of the normalized query and of the context, followed by the model name.
+    """
+    query_hash = hashlib.sha256(normalize_query(query).encode("utf-8")).hexdigest()
+    context_hash = hashlib.sha256(context.encode("utf-8")).hexdigest()
+    return f"{query_hash}:{context_hash}:{model}"
+
+
+class EvictionCountingTTLCache(TTLCache):
+    """
+    TTLCache (LRU with per-entry expiry) counting the entries evicted because the cache is full.
+    """
+
+    def __init__(self, maxsize: int, ttl: float, stats: CacheStats) -> None:
+        super().__init__(maxsize, ttl)
+        self.stats = stats
+
+    def popitem(self):
+        item = super().popitem()
+        self.stats.evictions += 1
+        return item
+
+
+class ResponseCache:
+    """
+    Exact-match cache of LLM chain answers with an optional on-disk tier.
+
+    Args:
+        max_size (int): Maximal number of answers kept in memory. The least recently used one is evicted first.
+        ttl (float): Time to live of an answer in seconds, in memory and on disk.
+        path (str, optional): Path of an SQLite file used as second tier. The answers stored there survive restarts
+            and are shared by all workers of the host. Defaults to None, which keeps the cache in memory only.
+
+    The chain runs with temperature 0, so the same query, context and model always produce the same answer.
+    """
+
+    def __init__(self, max_size: int, ttl: float, path: Optional[str] = None) -> None:
+        self.ttl = ttl
+        self.stats = CacheStats()
+        self.memory = EvictionCountingTTLCache(max_size, ttl, self.stats)
+        self.lock = threading.Lock()
+        self.db = None
+        if path:
+            self.db = sqlite3.connect(path, check_same_thread=False)
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS responses "
+                "(key TEXT PRIMARY KEY, answer TEXT NOT NULL, created REAL NOT NULL)"
+            )
+            self.db.execute(
+                "DELETE FROM responses WHERE created < ?", (time.time() - ttl,)
+            )
+            self.db.commit()
+
+    def get(self, key: str) -> Optional[str]:
+        """
+        Looks up a cached answer, first in memory and then on disk.
+
+        Args:
+            key (str): The key built by `response_cache_key`.
+
+        Returns:
+            Optional[str]: The cached answer, or None.
+        """
+        answer = self.memory.get(key)
+        if answer is None and self.db is not None:
+            with self.lock:
+                row = self.db.execute(
+                    "SELECT answer FROM responses WHERE key = ? AND created >= ?",
+                    (key, time.time() - self.ttl),
+                ).fetchone()
+            if row:
+                answer = row[0]
+                self.memory[key] = answer
+
+        if answer is None:
+            self.stats.misses += 1
+        else:
+            self.stats.hits += 1
+        return answer
+
+    def set(self, key: str, answer: str) -> None:
+        """
+        Stores an answer in memory and on disk.
+
+        Args:
+            key (str): The key built by `response_cache_key`.
+            answer (str): The answer to cache.
+        """
+        if not answer:
+            return
+        self.memory[key] = answer
+        if self.db is not None:
+            with self.lock:
+                self.db.execute(
+                    "INSERT OR REPLACE INTO responses (key, answer, created) VALUES (?, ?, ?)",
+                    (key, answer, time.time()),
+                )
+                self.db.commit()
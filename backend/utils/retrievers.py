@@ -0,0 +1,347 @@
+import json
+import os
+from typing import List, Optional, Tuple
+from langchain.callbacks.manager import (
+    AsyncCallbackManagerForRetrieverRun,
+    CallbackManagerForRetrieverRun,
+)
+from langchain.schema import BaseRetriever, Document
+from langchain.schema.vectorstore import VectorStore, VectorStoreRetriever
+from langchain.vectorstores import FAISS, Pinecone
+from utils.bm25 import BM25Index, identifiers
+from utils.tool_executor import ToolExecutor
+
+# Maximal number of matches of a Pinecone query with metadata
+PINECONE_MAX_TOP_K = 1000
+
+
+class ScoredVectorStoreRetriever(VectorStoreRetriever):
+    """
+    Vector store retriever that keeps the score of each retrieved document.
+
+    With `search_type="similarity_score_threshold"` every document gets a `score` metadata field, the raw score of the
+    store, which is the cosine similarity for a Pinecone cosine index and for the store of `build_faiss_store`: the
+    higher, the more relevant. Documents less similar to the query than `score_threshold` are dropped. LangChain's
+    relevance score of these stores is `1 - similarity`, as if they returned a distance, so it is not used. Other
+    search types behave as in VectorStoreRetriever.
+
+    With an `executor`, asynchronous searches embed the query with the async client of the embeddings, and only
+    the search itself, blocking for Pinecone and FAISS, runs in the thread pool of the executor within its timeout.
+    """
+
+    executor: Optional[ToolExecutor] = None
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        if self.search_type != "similarity_score_threshold":
+            return super()._get_relevant_documents(query, run_manager=run_manager)
+        docs_and_similarities = self.vectorstore.similarity_search_with_score(
+            query, **self.search_params()
+        )
+        return self.with_scores(docs_and_similarities)
+
+    async def _aget_relevant_documents(
+        self, query: str, *, run_manager: AsyncCallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        if self.search_type != "similarity_score_threshold":
+            return await super()._aget_relevant_documents(
+                query, run_manager=run_manager
+            )
+        if self.executor is None:
+            docs_and_similarities = (
+                await self.vectorstore.asimilarity_search_with_score(
+                    query, **self.search_params()
+                )
+            )
+            return self.with_scores(docs_and_similarities)
+
+        search = search_by_vector(self.vectorstore)
+        if search is None or self.vectorstore.embeddings is None:
+            docs_and_similarities = await self.executor.run(
+                self.vectorstore.similarity_search_with_score,
+                query,
+                **self.search_params(),
+            )
+        else:
+            vector = await self.vectorstore.embeddings.aembed_query(query)
+            docs_and_similarities = await self.executor.run(
+                search, vector, **self.search_params()
+            )
+        return self.with_scores(docs_and_similarities)
+
+    def search_params(self) -> dict:
+        return {k: v for k, v in self.search_kwargs.items() if k != "score_threshold"}
+
+    def with_scores(self, docs_and_similarities: list) -> List[Document]:
+        """
+        Stores the similarities in the metadata of the documents and drops those below the score threshold.
+
+        Args:
+            docs_and_similarities (list): Pairs of document and raw score of the store.
+
+        Returns:
+            List[Document]: The documents, each with its cosine similarity in the `score` metadata field.
+        """
+        threshold = self.search_kwargs.get("score_threshold")
+        docs = []
+        for doc, similarity in docs_and_similarities:
+            if threshold is None or similarity >= threshold:
+                doc.metadata["score"] = float(similarity)
+                docs.append(doc)
+        return docs
+
+
+def search_by_vector(vectorstore: VectorStore):
+    """
+    Returns the search of a vector store by query embedding, with the raw scores.
+
+    Args:
+        vectorstore (VectorStore): The vector store.
+
+    Returns:
+        Optional[Callable]: The search method, named differently by Pinecone and FAISS, or None if the store has none.
+    """
+    return getattr(
+        vectorstore, "similarity_search_by_vector_with_score", None
+    ) or getattr(vectorstore, "similarity_search_with_score_by_vector", None)
+
+
+class HybridRetriever(BaseRetriever):
+    """
+    Retriever fusing a BM25 index over the documentation chunks with the dense vector retriever.
+
+    Attributes:
+        vector_retriever (ScoredVectorStoreRetriever): The dense retriever, returning up to `fetch_k` documents.
+        documents (List[Document]): The chunks indexed by `index`, the same ones as in the vector store.
+        index (BM25Index): The inverted index of the chunks.
+        k (int): Number of documents returned.
+        fetch_k (int): Number of candidates taken from each retriever before fusion.
+        lexical_margin (float): How much the best BM25 score must exceed the second one for a lexical match to be
+            trusted alone.
+        rrf_k (int): Rank offset of reciprocal rank fusion.
+
+    When every SDK identifier of the query (`generate_async`, `TextGenerationParameters`, ...) occurs in the best BM25
+    chunk and that chunk clearly leads, it is returned without embedding the query or searching the vector store.
+    Otherwise the BM25 and dense rankings are merged with reciprocal rank fusion. Each returned document carries a
+    `retrieval` metadata field set to `lexical` or `hybrid`, its cosine similarity in `score` if the dense search
+    found it, and its BM25 score over the maximal score of the query in `bm25_score` if BM25 found it. The two
+    scores are not comparable, so a document found by BM25 only has no `score`.
+    """
+
+    vector_retriever: ScoredVectorStoreRetriever
+    documents: List[Document]
+    index: BM25Index
+    k: int = 1
+    fetch_k: int = 4
+    lexical_margin: float = 1.5
+    rrf_k: int = 60
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    @classmethod
+    def from_documents(
+        cls,
+        documents: List[Document],
+        vector_retriever: ScoredVectorStoreRetriever,
+        **kwargs,
+    ) -> "HybridRetriever":
+        """
+        Indexes the chunks and builds the retriever.
+
+        Args:
+            documents (List[Document]): The chunks of the vector store.
+            vector_retriever (ScoredVectorStoreRetriever): The dense retriever.
+            **kwargs: The other attributes of the retriever.
+
+        Returns:
+            HybridRetriever: The retriever.
+        """
+        return cls(
+            vector_retriever=vector_retriever,
+            documents=documents,
+            index=BM25Index([doc.page_content for doc in documents]),
+            **kwargs,
+        )
+
+    @property
+    def vectorstore(self) -> VectorStore:
+        return self.vector_retriever.vectorstore
+
+    def lexical_match(
+        self, query: str
+    ) -> Tuple[List[Tuple[int, float]], Optional[Document]]:
+        """
+        Searches the BM25 index and decides whether its best chunk answers the query alone.
+
+        Args:
+            query (str): The query string.
+
+        Returns:
+            tuple: The BM25 results, and the best chunk if the match is strong enough to skip the dense search.
+        """
+        results = self.index.search(query, self.fetch_k)
+        query_identifiers = identifiers(query)
+        if not results or not query_identifiers:
+            return results, None
+        best, score = results[0]
+        if not all(self.index.contains(best, term) for term in query_identifiers):
+            return results, None
+        if len(results) > 1 and score < self.lexical_margin * results[1][1]:
+            return results, None
+        return results, self._document(
+            best, {"bm25_score": score / self.index.max_score(query)}, "lexical"
+        )
+
+    def fuse(
+        self, query: str, lexical: List[Tuple[int, float]], dense: List[Document]
+    ) -> List[Document]:
+        """
+        Merges the BM25 and dense rankings with reciprocal rank fusion.
+
+        Args:
+            query (str): The query string.
+            lexical (List[Tuple[int, float]]): The BM25 results.
+            dense (List[Document]): The documents of the dense retriever, best first, with their `score`.
+
+        Returns:
+            List[Document]: The `k` best documents, with the `score` of the dense search and the `bm25_score` of the
+            documents each one found.
+        """
+        fused, lexical_ids = {}, {}
+        max_score = self.index.max_score(query) if lexical else 1.0
+        for rank, (doc_id, score) in enumerate(lexical):
+            key = self.documents[doc_id].page_content
+            fused[key] = fused.get(key, 0.0) + 1 / (self.rrf_k + rank + 1)
+            lexical_ids[key] = (doc_id, score / max_score)
+        dense_docs = {}
+        for rank, doc in enumerate(dense):
+            key = doc.page_content
+            fused[key] = fused.get(key, 0.0) + 1 / (self.rrf_k + rank + 1)
+            dense_docs[key] = doc
+        best = sorted(fused, key=fused.get, reverse=True)[: self.k]
+        docs = []
+        for key in best:
+            scores = {}
+            if key in lexical_ids:
+                scores["bm25_score"] = lexical_ids[key][1]
+            if key in dense_docs:
+                metadata = {**dense_docs[key].metadata, **scores, "retrieval": "hybrid"}
+                docs.append(Document(page_content=key, metadata=metadata))
+            else:
+                docs.append(self._document(lexical_ids[key][0], scores, "hybrid"))
+        return docs
+
+    def _document(self, doc_id: int, scores: dict, retrieval: str) -> Document:
+        doc = self.documents[doc_id]
+        return Document(
+            page_content=doc.page_content,
+            metadata={**doc.metadata, **scores, "retrieval": retrieval},
+        )
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        lexical, match = self.lexical_match(query)
+        if match is not None:
+            return [match]
+        dense = self.vector_retriever.get_relevant_documents(query)
+        return self.fuse(query, lexical, dense)
+
+    async def _aget_relevant_documents(
+        self, query: str, *, run_manager: AsyncCallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        lexical, match = self.lexical_match(query)
+        if match is not None:
+            return [match]
+        dense = await self.vector_retriever.aget_relevant_documents(query)
+        return self.fuse(query, lexical, dense)
+
+
+def load_corpus(vectordb: VectorStore, path: Optional[str] = None) -> List[Document]:
+    """
+    Returns the chunks of the vector store, to be indexed by BM25.
+
+    Args:
+        vectordb (VectorStore): The vector store. The chunks of a FAISS store are read from its docstore, those of a
+            Pinecone index are exported from it, see `export_pinecone_corpus`.
+        path (str, optional): A JSON Lines file with one `{"page_content": ..., "metadata": {...}}` object per chunk,
+            read instead of exporting the chunks of Pinecone again, and written by the export. Defaults to None.
+
+    Returns:
+        List[Document]: The chunks, empty if none are available.
+    """
+    if isinstance(vectordb, FAISS):
+        return [
+            vectordb.docstore.search(doc_id)
+            for doc_id in vectordb.index_to_docstore_id.values()
+        ]
+    if path and os.path.exists(path):
+        return read_corpus(path)
+    if not isinstance(vectordb, Pinecone):
+        return []
+    documents = export_pinecone_corpus(vectordb)
+    if path:
+        write_corpus(documents, path)
+    return documents
+
+
+def export_pinecone_corpus(vectordb: Pinecone) -> List[Document]:
+    """
+    Lists the chunks of a Pinecone index with a single query returning all its vectors, Pinecone cannot list them.
+
+    Args:
+        vectordb (Pinecone): The vector store.
+
+    Returns:
+        List[Document]: The chunks of the namespace of the store.
+
+    Raises:
+        ValueError: If the namespace holds more vectors than a query returns, PINECONE_MAX_TOP_K.
+    """
+    stats = vectordb._index.describe_index_stats()
+    namespace = stats["namespaces"].get(vectordb._namespace or "")
+    count = namespace["vector_count"] if namespace else 0
+    if count > PINECONE_MAX_TOP_K:
+        raise ValueError(
+            f"The Pinecone index holds {count} chunks, at most {PINECONE_MAX_TOP_K} can be exported, "
+            "write them to BM25_CORPUS_PATH instead"
+        )
+    if not count:
+        return []
+    # Any vector ranks all the vectors of the namespace, the scores do not matter
+    probe = [1.0] * stats["dimension"]
+    docs_and_scores = vectordb.similarity_search_by_vector_with_score(probe, k=count)
+    return [doc for doc, _ in docs_and_scores]
+
+
+def read_corpus(path: str) -> List[Document]:
+    """
+    Reads chunks from a JSON Lines file written by `write_corpus`.
+
+    Args:
+        path (str): The file.
+
+    Returns:
+        List[Document]: The chunks.
+    """
+    with open(path, encoding="utf-8") as f:
+        return [Document(**json.loads(line)) for line in f if line.strip()]
+
+
+def write_corpus(documents: List[Document], path: str) -> None:
+    """
+    Writes chunks to a JSON Lines file read by `load_corpus`.
+
+    Args:
+        documents (List[Document]): The chunks.
+        path (str): The file.
+    """
+    with open(path, "w", encoding="utf-8") as f:
+        for doc in documents:
+            record = {"page_content": doc.page_content, "metadata": doc.metadata}
+            f.write(json.dumps(record) + "\n")
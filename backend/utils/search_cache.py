@@ -0,0 +1,117 @@
+import asyncio
+import logging
+import time
+from typing import Callable
+from utils.cache_stats import CacheStats
+from utils.response_cache import EvictionCountingTTLCache, normalize_query
+from utils.tool_executor import ToolExecutor
+
+
+class SearchCache:
+    """
+    Cache of the results of the web search tool, keyed by normalized query.
+
+    Args:
+        max_size (int): Maximal number of results kept. The least recently used one is evicted first.
+        ttl (float): Seconds during which a result is served without searching again.
+        stale_ttl (float): Seconds during which an older result is kept, served only when a new search fails.
+        max_concurrency (int): Maximal number of searches running at once, the others wait for their turn.
+        timeout (float): Seconds allowed to a search, waiting for its turn included.
+        executor (ToolExecutor): The thread pool running the blocking search provider.
+
+    Queries waiting for their turn are looked up again once it comes, so identical queries arriving together
+    only search once if the search limit makes them wait. The cache is only used from the event loop.
+    """
+
+    def __init__(
+        self,
+        max_size: int,
+        ttl: float,
+        stale_ttl: float,
+        max_concurrency: int,
+        timeout: float,
+        executor: ToolExecutor,
+    ) -> None:
+        self.ttl = ttl
+        self.timeout = timeout
+        self.executor = executor
+        self.stats = CacheStats()
+        self.results = EvictionCountingTTLCache(
+            max_size, max(ttl, stale_ttl), self.stats
+        )
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.stale = 0
+        self.failures = 0
+
+    def fresh(self, key: str):
+        entry = self.results.get(key)
+        if entry is not None and time.time() - entry[1] <= self.ttl:
+            return entry[0]
+        return None
+
+    async def search(self, query: str, provider: Callable[[str], str]) -> str:
+        """
+        Returns the results of a query, from the cache when they are recent enough.
+
+        Args:
+            query (str): The search query written by the agent.
+            provider (Callable[[str], str]): The blocking search, e.g. `DuckDuckGoSearchRun().run`.
+
+        Returns:
+            str: The search results.
+
+        Raises:
+            ToolException: If the search failed or timed out and no earlier result of the query is kept, so that
+                the agent gets an observation instead of the request failing.
+        """
+        key = normalize_query(query)
+        result = self.fresh(key)
+        if result is not None:
+            self.stats.hits += 1
+            return result
+        self.stats.misses += 1
+
+        try:
+            return await asyncio.wait_for(
+                self._search(key, query, provider), self.timeout
+            )
+        except Exception as e:
+            from langchain.tools.base import ToolException
+
+            self.failures += 1
+            entry = self.results.get(key)
+            if entry is not None:
+                self.stale += 1
+                logging.warning(f"Web search failed, serving an older result: {e!r}")
+                return entry[0]
+            raise ToolException(
+                f"The web search failed ({type(e).__name__}), "
+                "use another tool or answer with the information you have"
+            )
+
+    async def _search(
+        self, key: str, query: str, provider: Callable[[str], str]
+    ) -> str:
+        async with self.semaphore:
+            # Another request may have searched the same query while this one was waiting
+            result = self.fresh(key)
+            if result is not None:
+                return result
+            result = await self.executor.run(provider, query)
+        self.results[key] = (result, time.time())
+        return result
+
+    def as_dict(self) -> dict:
+        """
+        Returns the counters of the cache.
+
+        Returns:
+            dict: The hit, miss and eviction counters with the hit ratio, the number of failed searches and of
+            older results served instead, and the number of results kept.
+        """
+        return {
+            **self.stats.as_dict(),
+            "stale": self.stale,
+            "failures": self.failures,
+            "size": len(self.results),
+        }
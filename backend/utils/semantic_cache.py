@@ -0,0 +1,123 @@
+import time
+from collections import OrderedDict
+from typing import List, Optional
+import numpy as np
+from utils.cache_stats import CacheStats
+
+
+class SemanticCacheEntry:
+    """
+    A cached answer together with the normalized embedding of the query that produced it.
+    """
+
+    def __init__(self, vector: np.ndarray, answer: str) -> None:
+        self.vector = vector
+        self.answer = answer
+        self.created = time.monotonic()
+
+
+class SemanticCache:
+    """
+    In-process semantic cache of agent answers, looked up by embedding similarity of the query.
+
+    Args:
+        threshold (float): Minimal cosine similarity between two queries to reuse the answer of the first one.
+        max_size (int): Maximal number of answers kept, all scopes together. The least recently used answer is
+            evicted first, whatever its scope, and a scope is dropped with its last answer.
+        ttl (float): Time to live of an answer in seconds.
+
+    Answers are kept in a separate namespace per scope, e.g. the API key fingerprint and model name, so a user never
+    gets answers generated with another key or model. Within a namespace, the query vectors are stacked in a matrix,
+    so a lookup is a single matrix-vector product.
+    """
+
+    def __init__(self, threshold: float, max_size: int, ttl: float) -> None:
+        self.threshold = threshold
+        self.max_size = max_size
+        self.ttl = ttl
+        self.stats = CacheStats()
+        self.namespaces = {}
+        self.matrices = {}
+        # (scope, id) of every answer, least recently used first
+        self.order = OrderedDict()
+        self.next_id = 0
+
+    @staticmethod
+    def normalize(vector: List[float]) -> np.ndarray:
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def lookup(self, scope: str, vector: List[float]) -> Optional[str]:
+        """
+        Looks for a cached answer to a query similar to the given one.
+
+        Args:
+            scope (str): The namespace of the answer, e.g. the API key fingerprint and model it was generated with.
+            vector (List[float]): The embedding of the query.
+
+        Returns:
+            Optional[str]: The cached answer of the most similar query above the threshold, or None.
+        """
+        entries = self.namespaces.get(scope)
+        if entries:
+            self._expire(scope)
+        if not entries:
+            self.stats.misses += 1
+            return None
+
+        keys, matrix = self._matrix(scope)
+        scores = matrix @ self.normalize(vector)
+        best = int(np.argmax(scores))
+        if scores[best] < self.threshold:
+            self.stats.misses += 1
+            return None
+
+        entries.move_to_end(keys[best])
+        self.order.move_to_end((scope, keys[best]))
+        self.stats.hits += 1
+        return entries[keys[best]].answer
+
+    def store(self, scope: str, vector: List[float], answer: str) -> None:
+        """
+        Stores the answer to a query.
+
+        Args:
+            scope (str): The namespace of the answer, see `lookup`.
+            vector (List[float]): The embedding of the query.
+            answer (str): The answer to cache.
+        """
+        if not answer:
+            return
+        entries = self.namespaces.setdefault(scope, OrderedDict())
+        entries[self.next_id] = SemanticCacheEntry(self.normalize(vector), answer)
+        self.order[(scope, self.next_id)] = None
+        self.next_id += 1
+        self.matrices.pop(scope, None)
+        while len(self.order) > self.max_size:
+            self._remove(*self.order.popitem(last=False)[0])
+            self.stats.evictions += 1
+
+    def _remove(self, scope: str, key: int) -> None:
+        entries = self.namespaces[scope]
+        del entries[key]
+        self.order.pop((scope, key), None)
+        self.matrices.pop(scope, None)
+        if not entries:
+            del self.namespaces[scope]
+
+    def _expire(self, scope: str) -> None:
+        now = time.monotonic()
+        entries = self.namespaces[scope]
+        expired = [k for k, e in entries.items() if now - e.created > self.ttl]
+        for key in expired:
+            self._remove(scope, key)
+        self.stats.evictions += len(expired)
+
+    def _matrix(self, scope: str):
+        # Rebuilt only after the namespace changed, LRU reordering does not change the set of rows
+        if scope not in self.matrices:
+            entries = self.namespaces[scope]
+            keys = list(entries.keys())
+            self.matrices[scope] = (keys, np.stack([entries[k].vector for k in keys]))
+        return self.matrices[scope]
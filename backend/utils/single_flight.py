@@ -0,0 +1,135 @@
+import asyncio
+from typing import AsyncIterator, Callable
+
+
+class Flight:
+    """
+    One in-flight generation whose tokens are fanned out to every request attached to it.
+
+    Attributes:
+        tokens (list): All tokens produced so far, kept so that late joiners can replay them.
+        done (bool): Flag indicating that the generation has finished.
+        error (Exception): The exception raised by the generation, if any.
+        subscribers (int): Number of requests attached to the generation and still streaming it.
+    """
+
+    def __init__(self) -> None:
+        self.tokens = []
+        self.done = False
+        self.error = None
+        self.task = None
+        self.subscribers = 0
+        self.event = asyncio.Event()
+
+    def notify(self) -> None:
+        # Wake up the current waiters and give the next ones a fresh event
+        event, self.event = self.event, asyncio.Event()
+        event.set()
+
+    async def subscribe(self) -> AsyncIterator[str]:
+        """
+        Streams the tokens of the generation from its very first one.
+
+        Returns:
+            An asynchronous generator yielding the tokens already produced, then the new ones as they arrive.
+        """
+        i = 0
+        while True:
+            while i < len(self.tokens):
+                yield self.tokens[i]
+                i += 1
+            if self.done:
+                if self.error is not None:
+                    raise self.error
+                return
+            await self.event.wait()
+
+
+class SingleFlight:
+    """
+    Coalesces identical concurrent generations into a single upstream call.
+
+    The first request for a key starts the generation in its own task; requests with the same key arriving while
+    it runs attach to it and receive a copy of its token stream instead of calling the LLM again. When the last
+    attached request goes away, e.g. because its client disconnected, the generation is cancelled.
+
+    Attributes:
+        flights (dict): The generations in flight by key.
+        started (int): Number of generations started.
+        joined (int): Number of requests attached to a generation started by another request.
+        cancelled (int): Number of generations cancelled because no request was streaming them anymore.
+    """
+
+    def __init__(self) -> None:
+        self.flights = {}
+        self.started = 0
+        self.joined = 0
+        self.cancelled = 0
+
+    async def stream(
+        self, key: str, factory: Callable[[], AsyncIterator[str]]
+    ) -> AsyncIterator[str]:
+        """
+        Attaches to the generation in flight for the key, or starts a new one.
+
+        Args:
+            key (str): The key identifying identical requests, e.g. their kind, API key fingerprint, model and
+                normalized query.
+            factory (Callable[[], AsyncIterator[str]]): Creates the token stream of a new generation. It is called
+                only when no generation is in flight for the key.
+
+        Returns:
+            An asynchronous generator yielding all tokens of the generation. The request attaches when the generator
+            is first iterated, a stream never read neither starts nor holds a generation. Closing it before the end,
+            or cancelling the task iterating it, detaches the request.
+        """
+        flight = self.flights.get(key)
+        if flight is None:
+            flight = Flight()
+            self.flights[key] = flight
+            flight.task = asyncio.create_task(self._run(key, flight, factory()))
+            self.started += 1
+        else:
+            self.joined += 1
+        flight.subscribers += 1
+        try:
+            async for token in flight.subscribe():
+                yield token
+        finally:
+            flight.subscribers -= 1
+            if flight.subscribers == 0 and not flight.done:
+                # Nobody reads the generation anymore, stop it and keep new requests from joining it
+                if self.flights.get(key) is flight:
+                    del self.flights[key]
+                flight.task.cancel()
+                self.cancelled += 1
+
+    async def _run(self, key: str, flight: Flight, source: AsyncIterator[str]):
+        try:
+            async for token in source:
+                flight.tokens.append(token)
+                flight.notify()
+        except Exception as e:
+            flight.error = e
+        except asyncio.CancelledError as e:
+            flight.error = e
+            raise
+        finally:
+            flight.done = True
+            flight.notify()
+            if self.flights.get(key) is flight:
+                del self.flights[key]
+
+    def as_dict(self) -> dict:
+        """
+        Returns the counters of the coalesced generations.
+
+        Returns:
+            dict: Number of generations started, requests joined, generations cancelled and generations in flight.
+        """
+        return {
+            "started": self.started,
+            "joined": self.joined,
+            "cancelled": self.cancelled,
+            "in_flight": len(self.flights),
+        }
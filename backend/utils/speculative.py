@@ -0,0 +1,159 @@
+import asyncio
+from contextvars import ContextVar
+from typing import List, Optional
+from langchain.callbacks.manager import (
+    AsyncCallbackManagerForRetrieverRun,
+    CallbackManagerForRetrieverRun,
+)
+from langchain.schema import BaseRetriever, Document
+from langchain.schema.vectorstore import VectorStore
+from utils.response_cache import normalize_query
+
+
+class SpeculationStats:
+    """
+    Counters of the speculative retrievals.
+
+    Attributes:
+        used (int): Number of prefetched results returned to the Doc_search tool.
+        unused (int): Number of prefetched results discarded, their retrieval cancelled if still running.
+    """
+
+    def __init__(self) -> None:
+        self.used = 0
+        self.unused = 0
+
+    def as_dict(self) -> dict:
+        """
+        Returns the counters of the speculative retrievals.
+
+        Returns:
+            dict: Number of used and unused prefetches.
+        """
+        return {"used": self.used, "unused": self.unused}
+
+
+speculation_stats = SpeculationStats()
+
+
+class Prefetch:
+    """
+    A retrieval started for the user query before the agent asks for it.
+
+    Args:
+        query (str): The query the documents are retrieved for.
+        result (asyncio.Future): The task retrieving the documents, or a future already holding them.
+    """
+
+    def __init__(self, query: str, result: asyncio.Future) -> None:
+        self.query = normalize_query(query)
+        self.result = result
+        self.used = False
+
+    def matches(self, query: str) -> bool:
+        return not self.used and normalize_query(query) == self.query
+
+    async def take(self) -> List[Document]:
+        """
+        Returns the prefetched documents, waiting for the retrieval if it is still running.
+
+        Returns:
+            List[Document]: The retrieved documents.
+        """
+        self.used = True
+        speculation_stats.used += 1
+        return await self.result
+
+    def share(self) -> "Prefetch":
+        """
+        Returns another prefetch of the same retrieval, e.g. for an agent running next to the fast-path router.
+
+        Returns:
+            Prefetch: The prefetch. Closing it does not cancel the retrieval, which is left to this one.
+        """
+        return Prefetch(self.query, asyncio.shield(self.result))
+
+    def close(self) -> None:
+        """
+        Discards the prefetch once the agent is done, cancelling the retrieval if nobody used it.
+        """
+        if not self.used:
+            self.used = True
+            speculation_stats.unused += 1
+            if not self.result.done():
+                self.result.cancel()
+            elif not self.result.cancelled():
+                # Fetch the error of a failed retrieval so that asyncio does not log it as never retrieved
+                self.result.exception()
+
+
+def start_prefetch(retriever: BaseRetriever, query: str) -> Prefetch:
+    """
+    Starts retrieving the documents of a query in the background.
+
+    Args:
+        retriever (BaseRetriever): The retriever of the Doc_search tool.
+        query (str): The user query.
+
+    Returns:
+        Prefetch: The running retrieval.
+    """
+    return Prefetch(
+        query, asyncio.create_task(retriever.aget_relevant_documents(query))
+    )
+
+
+def resolved_prefetch(query: str, docs: List[Document]) -> Prefetch:
+    """
+    Wraps documents already retrieved for a query, e.g. by the fast-path router.
+
+    Args:
+        query (str): The user query.
+        docs (List[Document]): Its retrieved documents.
+
+    Returns:
+        Prefetch: The completed retrieval.
+    """
+    result = asyncio.get_running_loop().create_future()
+    result.set_result(docs)
+    return Prefetch(query, result)
+
+
+# The prefetch of the agent call running in the current task, set by `run_acall`
+current_prefetch: ContextVar[Optional[Prefetch]] = ContextVar(
+    "current_prefetch", default=None
+)
+
+
+class PrefetchingRetriever(BaseRetriever):
+    """
+    Retriever of the Doc_search tool serving the prefetched documents of the current agent call.
+
+    Attributes:
+        retriever (BaseRetriever): The retriever used when the tool input differs from the prefetched query.
+
+    Agent calls run in their own task, so each request only sees its own prefetch.
+    """
+
+    retriever: BaseRetriever
+
+    @property
+    def vectorstore(self) -> VectorStore:
+        return self.retriever.vectorstore
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        return self.retriever.get_relevant_documents(query)
+
+    async def _aget_relevant_documents(
+        self, query: str, *, run_manager: AsyncCallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        prefetch = current_prefetch.get()
+        if prefetch is not None and prefetch.matches(query):
+            try:
+                return await prefetch.take()
+            except Exception:
+                # The speculative retrieval failed, retry it for the tool
+                pass
+        return await self.retriever.aget_relevant_documents(query)
@@ -0,0 +1,103 @@
+import subprocess
+import sys
+import threading
+import time
+from typing import List, Tuple
+
+
+class StartupProfile:
+    """
+    Durations of the steps of the chain initialization.
+
+    Steps are recorded with `lap` between `start` and `stop`, each one lasting from the end of the previous step.
+    Laps recorded outside, e.g. by chain pool builds serving a session, are ignored.
+    """
+
+    def __init__(self) -> None:
+        self.timings = {}
+        self.running = False
+        self.last = 0.0
+        self.lock = threading.Lock()
+
+    def start(self) -> None:
+        with self.lock:
+            self.timings = {}
+            self.running = True
+            self.last = time.perf_counter()
+
+    def lap(self, step: str) -> None:
+        with self.lock:
+            if not self.running:
+                return
+            now = time.perf_counter()
+            self.timings[step] = self.timings.get(step, 0.0) + now - self.last
+            self.last = now
+
+    def stop(self) -> None:
+        with self.lock:
+            self.running = False
+
+    def as_dict(self) -> dict:
+        """
+        Returns the duration of each step.
+
+        Returns:
+            dict: Seconds spent in each step, in order, and their total.
+        """
+        return {**self.timings, "total": sum(self.timings.values())}
+
+
+startup_profile = StartupProfile()
+
+
+def import_times(
+    module: str, max_depth: int = 3, min_seconds: float = 0.01
+) -> List[Tuple[int, str, float]]:
+    """
+    Measures the import time of a module and of the modules it imports, in a fresh interpreter.
+
+    Args:
+        module (str): The module to import.
+        max_depth (int, optional): Deepest level of nested imports reported. Defaults to 3.
+        min_seconds (float, optional): Imports faster than this are not reported. Defaults to 0.01.
+
+    Returns:
+        List[Tuple[int, str, float]]: The nesting level, name and cumulative import time in seconds of each module,
+        in import order, each one after the modules it imported.
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+    )
+    times = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        _, cumulative, name = line[len("import time:") :].split("|")
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        seconds = int(cumulative) / 1e6
+        if depth <= max_depth and seconds >= min_seconds:
+            times.append((depth, name.strip(), seconds))
+    return times
+
+
+def print_startup_profile(module: str, build) -> None:
+    """
+    Prints the import time of the application modules and the initialization time of each chain component.
+
+    Args:
+        module (str): The module of the application.
+        build (Callable): Initializes the chains, recording its steps in `startup_profile`.
+    """
+    print(f"Import time of {module} (cumulative, nested imports indented)")
+    for depth, name, seconds in import_times(module):
+        print(f"{seconds * 1000:10.1f} ms  {'  ' * depth}{name}")
+
+    print("\nInitialization time per component")
+    try:
+        build()
+    except Exception as e:
+        print(f"Initialization failed: {e}")
+    for step, seconds in startup_profile.as_dict().items():
+        print(f"{seconds * 1000:10.1f} ms  {step}")
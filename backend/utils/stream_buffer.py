@@ -0,0 +1,200 @@
+import asyncio
+import json
+from typing import AsyncIterator, Callable, Optional, Tuple
+
+_END = object()
+# ASCII record separator, it starts the trailing metadata event of a stream and never occurs in LLM answers
+METADATA_SEPARATOR = "\x1e"
+
+
+def metadata_event(metadata: dict) -> str:
+    """
+    Formats the metadata event appended to an answer stream.
+
+    Args:
+        metadata (dict): The metadata of the answer, e.g. its source and score.
+
+    Returns:
+        str: The record separator followed by the metadata as JSON.
+    """
+    return METADATA_SEPARATOR + json.dumps(metadata)
+
+
+def split_metadata(text: str) -> Tuple[str, Optional[dict]]:
+    """
+    Splits a complete streamed response into the answer and its trailing metadata event.
+
+    Args:
+        text (str): The streamed response.
+
+    Returns:
+        tuple: The answer and the metadata, None if the response has no metadata event.
+    """
+    answer, separator, metadata = text.partition(METADATA_SEPARATOR)
+    return answer, json.loads(metadata) if separator else None
+
+
+async def strip_metadata(source: AsyncIterator[str]) -> AsyncIterator[str]:
+    """
+    Removes the trailing metadata event from a token stream, for clients that did not ask for it.
+
+    Args:
+        source (AsyncIterator[str]): The token stream.
+
+    Returns:
+        An asynchronous generator yielding the answer tokens only. The source is still read to its end, so that the
+        streams it wraps, e.g. `record_stream`, see it complete.
+    """
+    stripped = False
+    async for token in source:
+        if stripped:
+            continue
+        if METADATA_SEPARATOR in token:
+            answer = token.partition(METADATA_SEPARATOR)[0]
+            if answer:
+                yield answer
+            stripped = True
+            continue
+        yield token
+
+
+async def coalesce_stream(
+    source: AsyncIterator[str],
+    flush_bytes: int,
+    flush_ms: float,
+    delay: float = 0.0,
+) -> AsyncIterator[str]:
+    """
+    Coalesces the tokens of a stream into larger chunks before they are written to the client.
+
+    Args:
+        source (AsyncIterator[str]): The token stream, e.g. the generator returned by `create_gen`.
+        flush_bytes (int): A chunk is flushed as soon as it holds at least this many UTF-8 bytes.
+        flush_ms (float): A chunk is flushed at the latest this many milliseconds after its first token arrived.
+        delay (float, optional): Pause in seconds after each flushed chunk, used to pace the output. Defaults to 0.0.
+
+    Returns:
+        An asynchronous generator yielding the coalesced chunks.
+
+    Every chunk written to a StreamingResponse costs an HTTP chunk write, a proxy write and a rerender in the
+    frontend, so tokens are buffered until one of the two limits is reached. The first token is flushed alone as
+    soon as it arrives, so that buffering does not delay the time to first byte, and the metadata event is never
+    merged with the answer text. The source is consumed by a separate task, which keeps reading tokens while a chunk
+    is being written or paced.
+    """
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue()
+
+    async def pump():
+        try:
+            async for token in source:
+                queue.put_nowait(token)
+        except Exception as e:
+            queue.put_nowait(e)
+        finally:
+            queue.put_nowait(_END)
+
+    task = asyncio.create_task(pump())
+    buffer = []
+    size = 0
+    deadline = None
+    flushed = False
+
+    try:
+        while True:
+            if queue.empty() and buffer:
+                timeout = deadline - loop.time()
+                try:
+                    if timeout <= 0:
+                        raise asyncio.TimeoutError
+                    item = await asyncio.wait_for(queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    item = None
+            else:
+                item = await queue.get()
+
+            if item is _END:
+                break
+            if isinstance(item, Exception):
+                raise item
+            if item and METADATA_SEPARATOR in item:
+                # The metadata event is written as a chunk of its own, after the text buffered before it
+                text, _, metadata = item.partition(METADATA_SEPARATOR)
+                if text:
+                    buffer.append(text)
+                if buffer:
+                    yield "".join(buffer)
+                    buffer, size, flushed = [], 0, True
+                yield METADATA_SEPARATOR + metadata
+                continue
+            if item:
+                if not buffer:
+                    deadline = loop.time() + flush_ms / 1000
+                buffer.append(item)
+                size += len(item.encode("utf-8"))
+
+            if buffer and (item is None or size >= flush_bytes or not flushed):
+                yield "".join(buffer)
+                buffer, size, flushed = [], 0, True
+                if delay > 0:
+                    await asyncio.sleep(delay)
+
+        if buffer:
+            yield "".join(buffer)
+        await task
+    finally:
+        if not task.done():
+            task.cancel()
+
+
+async def record_stream(
+    source: AsyncIterator[str], on_complete: Callable[[str], None]
+) -> AsyncIterator[str]:
+    """
+    Passes a token stream through and hands the complete text over once the stream ended.
+
+    Args:
+        source (AsyncIterator[str]): The token stream.
+        on_complete (Callable[[str], None]): Called with the concatenated tokens if the stream finished without error.
+
+    Returns:
+        An asynchronous generator yielding the tokens of the source unchanged.
+    """
+    parts = []
+    async for token in source:
+        parts.append(token)
+        yield token
+    on_complete("".join(parts))
+
+
+async def finally_stream(
+    source: AsyncIterator[str], on_end: Callable[[], None]
+) -> AsyncIterator[str]:
+    """
+    Passes a token stream through and calls a cleanup once it ended, failed or was closed by the client.
+
+    Args:
+        source (AsyncIterator[str]): The token stream.
+        on_end (Callable[[], None]): The cleanup.
+
+    Returns:
+        An asynchronous generator yielding the tokens of the source unchanged.
+    """
+    try:
+        async for token in source:
+            yield token
+    finally:
+        on_end()
+
+
+async def replay_text(text: str) -> AsyncIterator[str]:
+    """
+    Streams an already known answer, e.g. one served from a cache.
+
+    Args:
+        text (str): The answer to stream.
+
+    Returns:
+        An asynchronous generator yielding the whole answer as a single chunk.
+    """
+    yield text
@@ -0,0 +1,220 @@
+import re
+from json.decoder import scanstring
+
+# Parser states
+SEEK_FINAL_ANSWER = 0
+SEEK_ACTION_INPUT = 1
+SEEK_COLON = 2
+SEEK_QUOTE = 3
+IN_STRING = 4
+IN_ESCAPE = 5
+IN_UNICODE = 6
+DONE = 7
+
+JSON_ESCAPES = {
+    '"': '"',
+    "\\": "\\",
+    "/": "/",
+    "b": "\b",
+    "f": "\f",
+    "n": "\n",
+    "r": "\r",
+    "t": "\t",
+}
+STRING_SPECIALS = re.compile(r'["\\]')
+WHITESPACE = " \t\r\n"
+
+
+class PatternMatcher:
+    """
+    Incremental Knuth-Morris-Pratt matcher that consumes one character at a time.
+
+    Args:
+        pattern (str): The pattern to look for in the character stream.
+
+    Each character is inspected once and no buffer of the stream is kept, so the cost of finding the
+    pattern is linear in the length of the stream.
+    """
+
+    def __init__(self, pattern: str) -> None:
+        self.pattern = pattern
+        self.failure = [0] * len(pattern)
+        k = 0
+        for i in range(1, len(pattern)):
+            while k and pattern[i] != pattern[k]:
+                k = self.failure[k - 1]
+            if pattern[i] == pattern[k]:
+                k += 1
+            self.failure[i] = k
+        self.matched = 0
+
+    def reset(self) -> None:
+        self.matched = 0
+
+    def step(self, char: str) -> bool:
+        """
+        Consumes one character.
+
+        Args:
+            char (str): The next character of the stream.
+
+        Returns:
+            bool: True if the pattern ends at this character.
+        """
+        k = self.matched
+        while k and char != self.pattern[k]:
+            k = self.failure[k - 1]
+        if char == self.pattern[k]:
+            k += 1
+        if k == len(self.pattern):
+            self.matched = 0
+            return True
+        self.matched = k
+        return False
+
+
+class FinalAnswerParser:
+    """
+    Streaming state machine extracting the final answer of a ReAct agent from its token stream.
+
+    The agent answers with a JSON blob such as `{"action": "Final Answer", "action_input": "..."}`.
+    The parser waits for the `Final Answer` marker, then for the `"action_input"` key, and emits the
+    decoded content of its JSON string value as it arrives. JSON escapes (including `\\uXXXX` and
+    surrogate pairs) are decoded even when they are split across tokens, and the closing quote and
+    braces of the blob are never emitted.
+
+    Every character is examined once, so the cost per response is linear in its length.
+    """
+
+    def __init__(self) -> None:
+        self.final_answer_matcher = PatternMatcher("Final Answer")
+        self.action_input_matcher = PatternMatcher('"action_input"')
+        self.reset()
+
+    def reset(self) -> None:
+        """
+        Resets the parser before a new LLM call.
+        """
+        self.state = SEEK_FINAL_ANSWER
+        self.final_answer_matcher.reset()
+        self.action_input_matcher.reset()
+        self.unicode_digits = ""
+        self.high_surrogate = None
+
+    @property
+    def final_answer(self) -> bool:
+        """
+        bool: True once the `Final Answer` marker has been seen in the current LLM call.
+        """
+        return self.state != SEEK_FINAL_ANSWER
+
+    def feed(self, token: str) -> str:
+        """
+        Consumes one token of the LLM output.
+
+        Args:
+            token (str): The new token.
+
+        Returns:
+            str: The decoded part of the final answer contained in this token, possibly empty.
+        """
+        if self.state == IN_STRING and self.high_surrogate is None:
+            if '"' not in token and "\\" not in token:
+                return token
+            # Short escapes complete within the token are decoded by the C scanner of the json module, as long as the
+            # string does not end within the token
+            if "\\u" not in token and not token.endswith("\\"):
+                try:
+                    text, end = scanstring(f'"{token}"', 1, False)
+                    if end == len(token) + 2:
+                        return text
+                except ValueError:
+                    pass
+        out = []
+        i, n = 0, len(token)
+        while i < n:
+            state = self.state
+            if state == IN_STRING:
+                # Copy plain text up to the next quote or backslash in one slice
+                match = STRING_SPECIALS.search(token, i)
+                end = match.start() if match else n
+                if end > i:
+                    if self.high_surrogate is not None:
+                        self._flush_surrogate(out)
+                    out.append(token[i:end])
+                if not match:
+                    break
+                if token[end] == '"':
+                    self._flush_surrogate(out)
+                    self.state = DONE
+                    break
+                # A short escape within the token is decoded without going through IN_ESCAPE
+                escaped = token[end + 1 : end + 2]
+                if escaped in JSON_ESCAPES:
+                    if self.high_surrogate is not None:
+                        self._flush_surrogate(out)
+                    out.append(JSON_ESCAPES[escaped])
+                    i = end + 2
+                else:
+                    self.state = IN_ESCAPE
+                    i = end + 1
+                continue
+            if state == DONE:
+                break
+
+            char = token[i]
+            i += 1
+            if state == SEEK_FINAL_ANSWER:
+                if self.final_answer_matcher.step(char):
+                    self.state = SEEK_ACTION_INPUT
+            elif state == SEEK_ACTION_INPUT:
+                if self.action_input_matcher.step(char):
+                    self.state = SEEK_COLON
+            elif state == SEEK_COLON:
+                if char == ":":
+                    self.state = SEEK_QUOTE
+                elif char not in WHITESPACE:
+                    self.state = SEEK_ACTION_INPUT
+            elif state == SEEK_QUOTE:
+                if char == '"':
+                    self.state = IN_STRING
+                elif char not in WHITESPACE:
+                    self.state = SEEK_ACTION_INPUT
+            elif state == IN_ESCAPE:
+                if char == "u":
+                    self.unicode_digits = ""
+                    self.state = IN_UNICODE
+                else:
+                    self._flush_surrogate(out)
+                    out.append(JSON_ESCAPES.get(char, char))
+                    self.state = IN_STRING
+            elif state == IN_UNICODE:
+                self.unicode_digits += char
+                if len(self.unicode_digits) == 4:
+                    self._emit_code_unit(out)
+                    self.state = IN_STRING
+        return "".join(out)
+
+    def _emit_code_unit(self, out: list) -> None:
+        try:
+            code = int(self.unicode_digits, 16)
+        except ValueError:
+            self._flush_surrogate(out)
+            out.append("�")
+            return
+        if 0xD800 <= code <= 0xDBFF:
+            self._flush_surrogate(out)
+            self.high_surrogate = code
+        elif 0xDC00 <= code <= 0xDFFF and self.high_surrogate is not None:
+            pair = 0x10000 + ((self.high_surrogate - 0xD800) << 10) + (code - 0xDC00)
+            self.high_surrogate = None
+            out.append(chr(pair))
+        else:
+            self._flush_surrogate(out)
+            out.append(chr(code) if not 0xD800 <= code <= 0xDFFF else "�")
+
+    def _flush_surrogate(self, out: list) -> None:
+        # A high surrogate that is not followed by a low one cannot be encoded on its own
+        if self.high_surrogate is not None:
+            out.append("�")
+            self.high_surrogate = None
@@ -0,0 +1,89 @@
+import logging
+from functools import lru_cache
+from typing import Optional
+
+# Context windows of the chat models offered by the frontend, in tokens. Longest prefix first
+CONTEXT_WINDOWS = {
+    "gpt-4-1106-preview": 128000,
+    "gpt-4-32k": 32768,
+    "gpt-4": 8192,
+    "gpt-3.5-turbo-1106": 16385,
+    "gpt-3.5-turbo-16k": 16385,
+    "gpt-3.5-turbo": 4096,
+}
+DEFAULT_CONTEXT_WINDOW = 4096
+# Characters per token of English text, used when the tiktoken encoding cannot be loaded
+CHARACTERS_PER_TOKEN = 4
+
+
+def context_window(model: str) -> int:
+    """
+    Returns the context window of a model.
+
+    Args:
+        model (str): The model name.
+
+    Returns:
+        int: The maximal number of prompt and completion tokens, DEFAULT_CONTEXT_WINDOW for unknown models.
+    """
+    for prefix, window in CONTEXT_WINDOWS.items():
+        if model.startswith(prefix):
+            return window
+    return DEFAULT_CONTEXT_WINDOW
+
+
+@lru_cache(maxsize=None)
+def get_encoding(model: str) -> Optional[object]:
+    """
+    Loads the tiktoken encoding of a model once per process.
+
+    Args:
+        model (str): The model name.
+
+    Returns:
+        Optional[Encoding]: The encoding of the model, `cl100k_base` for models unknown to tiktoken, or None if it
+        cannot be loaded, e.g. without network access to download it.
+    """
+    import tiktoken
+
+    try:
+        try:
+            return tiktoken.encoding_for_model(model)
+        except KeyError:
+            return tiktoken.get_encoding("cl100k_base")
+    except Exception as e:
+        logging.warning(
+            f"Unable to load the tiktoken encoding, token counts are estimated: {e}"
+        )
+        return None
+
+
+def encoding_name(model: str) -> str:
+    """
+    Returns the name of the encoding of a model, models sharing it share their token counts.
+
+    Args:
+        model (str): The model name.
+
+    Returns:
+        str: The name of the tiktoken encoding, or "estimate" if it cannot be loaded.
+    """
+    encoding = get_encoding(model)
+    return encoding.name if encoding is not None else "estimate"
+
+
+def count_tokens(text: str, model: str) -> int:
+    """
+    Counts the tokens of a text for a model.
+
+    Args:
+        text (str): The text.
+        model (str): The model name.
+
+    Returns:
+        int: The number of tokens, estimated from the number of characters if the encoding cannot be loaded.
+    """
+    encoding = get_encoding(model)
+    if encoding is None:
+        return -(-len(text) // CHARACTERS_PER_TOKEN)
+    return len(encoding.encode(text, disallowed_special=()))
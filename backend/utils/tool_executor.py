@@ -0,0 +1,123 @@
+import asyncio
+import contextvars
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from inspect import signature
+from typing import Any, Callable, Optional
+
+
+class ToolExecutor:
+    """
+    Bounded thread pool running the blocking calls of the agent tools and of the retriever off the event loop.
+
+    Args:
+        max_workers (int): Maximal number of blocking calls running at once, the others wait for a free thread.
+        timeout (float): Seconds allowed to a call, waiting for a thread included.
+
+    Python threads cannot be stopped: a call past its timeout is abandoned and keeps its thread until it returns,
+    so a hanging service occupies at most `max_workers` threads instead of growing the default executor of the
+    event loop. Calls run in a copy of the context of the caller, as with `asyncio.to_thread`.
+    """
+
+    def __init__(self, max_workers: int, timeout: float) -> None:
+        self.timeout = timeout
+        self.pool = ThreadPoolExecutor(max_workers, thread_name_prefix="tool")
+        self.lock = threading.Lock()
+        self.calls = 0
+        self.timeouts = 0
+        self.busy = 0
+
+    async def run(
+        self, func: Callable, *args: Any, timeout: Optional[float] = None, **kwargs: Any
+    ) -> Any:
+        """
+        Runs a blocking function in the pool.
+
+        Args:
+            func (Callable): The function.
+            *args: Its positional arguments.
+            timeout (float, optional): Seconds allowed to the call. Defaults to None, the timeout of the executor.
+            **kwargs: Its keyword arguments.
+
+        Returns:
+            Any: The result of the function.
+
+        Raises:
+            asyncio.TimeoutError: If the call did not return in time.
+        """
+        context = contextvars.copy_context()
+
+        def call():
+            with self.lock:
+                self.busy += 1
+            try:
+                return context.run(func, *args, **kwargs)
+            finally:
+                with self.lock:
+                    self.busy -= 1
+
+        self.calls += 1
+        future = asyncio.get_running_loop().run_in_executor(self.pool, call)
+        try:
+            return await asyncio.wait_for(future, timeout or self.timeout)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            raise
+
+    def as_dict(self) -> dict:
+        """
+        Returns the counters of the executor.
+
+        Returns:
+            dict: The number of tool and retriever calls, of calls past their timeout and of threads running a call.
+        """
+        return {"calls": self.calls, "timeouts": self.timeouts, "busy": self.busy}
+
+
+def offload_tool(tool: object, executor: ToolExecutor) -> object:
+    """
+    Wraps a tool so that the agent calls it without blocking the event loop and within the executor timeout.
+
+    Args:
+        tool (Tool): The tool. Its coroutine is used when it has one, its function runs in the pool otherwise.
+        executor (ToolExecutor): The pool and timeout of the calls.
+
+    Returns:
+        Tool: The same tool with a bounded coroutine. A call past the timeout returns an observation telling the
+        agent so, instead of failing the whole request.
+    """
+    from langchain.tools import Tool
+    from langchain.tools.base import ToolException
+
+    func, coroutine = tool.func, tool.coroutine
+
+    # Declared so that the tool passes the callbacks of the run, e.g. the retriever handlers reporting the source
+    async def call(*args, callbacks=None, **kwargs):
+        target = func if coroutine is None else coroutine
+        if signature(target).parameters.get("callbacks"):
+            kwargs["callbacks"] = callbacks
+        try:
+            if coroutine is None:
+                return await executor.run(func, *args, **kwargs)
+            executor.calls += 1
+            try:
+                return await asyncio.wait_for(
+                    coroutine(*args, **kwargs), executor.timeout
+                )
+            except asyncio.TimeoutError:
+                executor.timeouts += 1
+                raise
+        except asyncio.TimeoutError:
+            raise ToolException(
+                f"{tool.name} did not answer within {executor.timeout:g} seconds, "
+                "use another tool or answer with the information you have"
+            )
+
+    return Tool(
+        name=tool.name,
+        description=tool.description,
+        func=func,
+        coroutine=call,
+        args_schema=tool.args_schema,
+        handle_tool_error=True,
+    )
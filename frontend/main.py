@@ -18,10 +18,9 @@ from routers.common import (
 )
 
 from routers.ibm_generative_sdk import handle_ibm_sdk
-from routers.other_files import handle_other_files, upload_f
+from routers.other_files import handle_other_files, upload_document
 from utils.token_validation import inputAPI_token
 from utils.retrieve_function import get_source
-from utils.chat_history_api_client import get_chat_history, save_chat_history
 
 load_dotenv()
 ENDPOINT = os.getenv("ENDPOINT")
@@ -51,9 +50,17 @@ if st.session_state.token_valid:
             uploaded_file = st.sidebar.file_uploader(
                 "Choose a file (PDF, CSV, TXT)", type=["pdf", "csv", "txt"]
             )
-            if uploaded_file is not None:
+            # The script reruns on every interaction, a file is only parsed and uploaded when it changes
+            if uploaded_file is not None and st.session_state.uploaded_file_key != (
+                uploaded_file.name,
+                uploaded_file.size,
+            ):
                 # reset_conversation(selected_option,st.session_state)
-                st.session_state.text_data = upload_f(uploaded_file)
+                st.session_state.document_id = upload_document(uploaded_file, ENDPOINT)
+                st.session_state.uploaded_file_key = (
+                    uploaded_file.name,
+                    uploaded_file.size,
+                )
             if st.sidebar.button("Reset Conversation"):
                 reset_conversation(selected_option, st.session_state)
 
@@ -62,54 +69,42 @@ if st.session_state.token_valid:
 
             # Input field for new message
             if prompt := st.chat_input("Write input to chatbot"):
-                st.session_state.prompt  = prompt
-                st.session_state.full_response = handle_other_files(
-                 ENDPOINT
-                )
+                st.session_state.prompt = prompt
+                st.session_state.full_response = handle_other_files(ENDPOINT)
                 st.session_state.parsed_message = parse_response(
                     st.session_state.full_response
                 )
                 try:
                     chat_m(
-                                   st.session_state.full_response,
-                                   is_user=False,
-                                   avatar_style="thumbs",
-                                   allow_html=True,
-                               )
-                               # Append the response to the session state
+                        st.session_state.full_response,
+                        is_user=False,
+                        avatar_style="thumbs",
+                        allow_html=True,
+                    )
+                    # Append the response to the session state
                     st.session_state.messages.append(
-                                   {
-                                       "id": "",
-                                       "role": "assistant",
-                                       "content": st.session_state.full_response,
-                                   }
-                               )
-                    save_chat_history(
-                                   str(st.session_state.session_id),
-                                   [[st.session_state.prompt, st.session_state.full_response]],
-                                   ENDPOINT,
-                               )
-                    
+                        {
+                            "id": "",
+                            "role": "assistant",
+                            "content": st.session_state.full_response,
+                        }
+                    )
+
                 except:
-                          chat_m(
-                              st.session_state.parsed_message,
-                              is_user=False,
-                              avatar_style="thumbs",
-                              allow_html=True,
-                          )
-                          # Append the response to the session state
-                          st.session_state.messages.append(
-                              {
-                                  "id": "",
-                                  "role": "assistant",
-                                  "content": st.session_state.parsed_message,
-                              }
-                          )
-                          save_chat_history(
-                              str(st.session_state.session_id),
-                              [[st.session_state.prompt, st.session_state.parsed_message]],
-                              ENDPOINT,
-                          )
+                    chat_m(
+                        st.session_state.parsed_message,
+                        is_user=False,
+                        avatar_style="thumbs",
+                        allow_html=True,
+                    )
+                    # Append the response to the session state
+                    st.session_state.messages.append(
+                        {
+                            "id": "",
+                            "role": "assistant",
+                            "content": st.session_state.parsed_message,
+                        }
+                    )
 
     if selected_option == "IBM Generative SDK":
         # Reset conversation button
@@ -120,11 +115,11 @@ if st.session_state.token_valid:
         display_messages(st.session_state)
 
         if prompt := st.chat_input("Write input to chatbot"):
-            st.session_state.prompt  = prompt
+            st.session_state.prompt = prompt
             st.session_state.full_response, st.session_state.source = handle_ibm_sdk(
-                #st.session_state.prompt, 
-                ENDPOINT, 
-                #st.session_state
+                # st.session_state.prompt,
+                ENDPOINT,
+                # st.session_state
             )
             st.session_state.parsed_message = parse_response(
                 st.session_state.full_response
@@ -145,11 +140,6 @@ if st.session_state.token_valid:
                         + st.session_state.source,
                     }
                 )
-                save_chat_history(
-                    str(st.session_state.session_id),
-                    [[st.session_state.prompt, st.session_state.parsed_message]],
-                    ENDPOINT,
-                )
             except:
                 chat_m(
                     st.session_state.full_response + st.session_state.source,
@@ -167,8 +157,3 @@ if st.session_state.token_valid:
                         + st.session_state.source,
                     }
                 )
-                save_chat_history(
-                    str(st.session_state.session_id),
-                    [[st.session_state.prompt, st.session_state.full_response]],
-                    ENDPOINT,
-                )
@@ -2,8 +2,6 @@
 import streamlit as st
 from streamlit_chat import message as chat_m
 import bson
-import ast
-import re
 
 
 def reset_conversation(selected_option, session_state):
@@ -44,55 +42,18 @@ def display_messages(session_state):
             chat_m(message["content"], is_user=False, avatar_style="thumbs", key=i + 2)
 
 
-def parse_prompt_code(input_prompt):
-    """
-    Formats a given input prompt for Python code responses.
-    It adds a specific instruction to the prompt asking for Python code to be enclosed in triple tildes.
-
-    Args:
-        input_prompt: The initial prompt to which the formatting instruction will be appended.
-
-    Returns:
-        str: The formatted prompt with additional instructions for Python code responses.
-    """
-    return (
-        """Whenever I ask a question that requires a Python script for the answer,"""
-        """please format your response by beginning and ending the Python code with triple tildes (~~~). """
-        """This formatting should be used consistently for all Python code responses. Whenever you are requested""" 
-        """to provide a Python script by prompt "output python", "provide python", etc, always output the complete script """
-        """directly in the response instead of referring to external links, regardless of its"""
-        """length. If there is only question in sense of outputing python script such as "output python", focus on your last response in your chat history. {}""".format(
-            input_prompt
-        )
-    )
-
-
 def parse_response(full_response):
     """
     Parses the full response text to format and clean it for display.
-    It tries to replace specific characters and handle Python literal structures to ensure the response text is cleanly formatted.
+    The backend already streams decoded text, so only code fences are normalized and surrounding whitespace is removed.
 
     Args:
-        full_response: The raw response text that needs to be parsed and cleaned.
+        full_response: The response text that needs to be parsed and cleaned.
 
     Returns:
         str: The parsed and cleaned response text.
-
-    Note:
-        This function attempts multiple parsing strategies and falls back to returning the raw response if parsing fails.
     """
-    try:
-        current_message = full_response.replace("```", "~~~")
-        parsed_message_strip = current_message.strip("'\"\n ")
-        parsed_message = ast.literal_eval(f'"{parsed_message_strip}"')
-        return parsed_message
-    except:
-        try:
-            full_response = full_response.replace("\\n", "\n")
-            parsed_message = re.sub(r'`|"|}|{', " ", str(full_response))
-            return parsed_message
-        except:
-            return full_response
+    return full_response.replace("```", "~~~").strip()
 
 
 def on_select_change():
@@ -106,22 +67,3 @@ def on_select_change():
     """
     selected_option = st.session_state["selectbox_key"]
     reset_conversation(selected_option, st.session_state)
-
-
-def set_history_prompt(query, history, level=1):
-    """
-    Formats a prompt that includes the chat history and the current query.
-    It generates a prompt string that combines the recent chat history with a new query for the conversational agent.
-
-    Args:
-        query: The current query or question to be answered.
-        history: The chat history list containing past message exchanges.
-        level (int, optional): The number of recent chat messages to include from the history. Defaults to 2.
-
-    Returns:
-        str: A formatted prompt string combining the chat history and the current query.
-    """
-    # TODO:calculate max number of tokens dynamically
-    return "Chat history: {}.\nKeep in mind the above chat history to answer following input question: {}".format(
-        str(history[-level::]), query
-    )
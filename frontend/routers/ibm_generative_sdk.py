@@ -1,11 +1,13 @@
 # ibm_generative_sdk.py
+import json
 import requests
-from routers.common import parse_prompt_code, set_history_prompt
 from streamlit_chat import message as chat_m
 import streamlit as st
-from utils.chat_history_api_client import get_chat_history
 from utils.retrieve_function import get_source
 
+# Starts the trailing metadata event of the /chat stream, followed by the source and score as JSON
+METADATA_SEPARATOR = "\x1e"
+
 
 def handle_ibm_sdk(end_point):
     """
@@ -19,34 +21,38 @@ def handle_ibm_sdk(end_point):
     Returns:
         str: The full response from the IBM SDK service.
 
-    This function appends the user's prompt to the session state, fetches chat history, and sends the prompt to the IBM SDK service. It then streams and displays the response.
+    This function appends the user's prompt to the session state and sends the prompt to the IBM SDK service. It then streams and displays the response. The backend reads the chat history of the session and saves the exchange itself.
     """
-    st.session_state.messages.append({"role": "user", "content": st.session_state.prompt})
+    st.session_state.messages.append(
+        {"role": "user", "content": st.session_state.prompt}
+    )
     chat_m(st.session_state.prompt, is_user=True, avatar_style="big-smile")
 
-    try:
-        st.session_state.history = get_chat_history(st.session_state.session_id, end_point)["chat_history"]
-    except:
-        st.session_state.history = []
-
-    st.session_state.prompt_history = set_history_prompt(st.session_state.prompt, st.session_state.history, level=1)
-    st.session_state.prompt_parsed = parse_prompt_code(st.session_state.prompt_history)
-    
-
     with st.spinner("Generating..."):
         message_placeholder = st.empty()
         st.session_state.full_response = ""
+        metadata = None
         try:
             with requests.get(
                 "http://{}/chat".format(end_point),
                 stream=True,
-                json={"text": st.session_state.prompt_parsed},
+                params={
+                    "include_source": "true",
+                    "session_id": st.session_state.session_id,
+                    "client_id": st.session_state.client_id,
+                },
+                # The backend adds the history of the session and its own formatting instructions
+                json={"text": st.session_state.prompt},
                 timeout=60,
             ) as r:
                 r.raise_for_status()
-                for line in r.iter_content(chunk_size=1024):
-                    if line:
-                        part = line.decode("utf-8")  # .replace("`","~")
+                r.encoding = "utf-8"
+                for part in r.iter_content(chunk_size=1024, decode_unicode=True):
+                    if metadata is not None:
+                        metadata += part
+                    elif part:
+                        if METADATA_SEPARATOR in part:
+                            part, _, metadata = part.partition(METADATA_SEPARATOR)
                         st.session_state.full_response += part
                         try:
                             message_placeholder.markdown(
@@ -61,9 +67,14 @@ def handle_ibm_sdk(end_point):
         except Exception as e:
             print(f"An unexpected error occurred: {e}")
         finally:
-            st.session_state.source = "\n\nSource: {}".format(
-                get_source(st.session_state.prompt+st.session_state.full_response, end_point)
+            try:
+                source = json.loads(metadata)["source"]
+            except Exception:
+                # Older backends do not send the metadata event
+                source = get_source(
+                    st.session_state.prompt + st.session_state.full_response, end_point
                 )
-            
+            st.session_state.source = "\n\nSource: {}".format(source)
+
             message_placeholder.markdown("")
             return st.session_state.full_response, st.session_state.source
@@ -32,9 +32,11 @@ def initialize_session_state(selected_option: str, session_state: dict):
         "full_response": "",
         "parsed_message": "",
         "text_data": "",
+        "document_id": None,
+        "uploaded_file_key": None,
         "chat_index": 0,
         "source": "",
-        "history":""
+        "history": "",
     }
 
     for key, value in default_values.items():
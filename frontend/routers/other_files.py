@@ -3,9 +3,7 @@ import streamlit as st
 import pandas as pd
 import requests
 from streamlit_chat import message as chat_m
-from routers.common import parse_prompt_code, set_history_prompt
 import PyPDF2
-from utils.chat_history_api_client import get_chat_history
 
 
 def upload_f(uploaded_file):
@@ -34,6 +32,34 @@ def upload_f(uploaded_file):
         return uploaded_file.read().decode("utf-8")
 
 
+def upload_document(uploaded_file, end_point):
+    """
+    Extracts the text of an uploaded file and stores it in the backend, once per file.
+
+    Args:
+        uploaded_file (UploadedFile): The file uploaded by the user.
+        end_point (str): The endpoint URL of the backend.
+
+    Returns:
+        str: The id of the stored document, or None if the backend could not store it.
+
+    The text is sent in the body of a single request. Each question then only sends the document id, instead of the
+    whole text as a query parameter.
+    """
+    st.session_state.text_data = upload_f(uploaded_file)
+    try:
+        response = requests.post(
+            "http://{}/upload_document/".format(end_point),
+            json={"text": st.session_state.text_data, "name": uploaded_file.name},
+            timeout=60,
+        )
+        response.raise_for_status()
+        return response.json()["document_id"]
+    except requests.exceptions.RequestException as e:
+        print(f"Document upload failed, the text is sent with each question: {e}")
+        return None
+
+
 def handle_other_files(end_point):
     """
     Handles the processing of user prompts and additional text data using an external service.
@@ -46,18 +72,12 @@ def handle_other_files(end_point):
     Returns:
         str: The full response from the external service.
 
-    This function sends the user's prompt and the additional text data to the specified endpoint. It streams and displays the response in the Streamlit app.
+    This function sends the user's prompt and the additional text data to the specified endpoint. It streams and displays the response in the Streamlit app. The backend reads the chat history of the session and saves the exchange itself.
     """
-    st.session_state.messages.append({"role": "user", "content": st.session_state.prompt})
+    st.session_state.messages.append(
+        {"role": "user", "content": st.session_state.prompt}
+    )
     chat_m(st.session_state.prompt, is_user=True, avatar_style="big-smile")
-    try:
-        history = get_chat_history(st.session_state.session_id, end_point)[
-            "chat_history"
-        ]
-    except:
-        history = []
-    st.session_state.prompt_history = set_history_prompt(st.session_state.prompt, history, level=1)
-    st.session_state.prompt_parsed = parse_prompt_code(st.session_state.prompt_history)
     with st.spinner("Generating..."):
         message_placeholder = st.empty()
         st.session_state.full_response = ""
@@ -65,7 +85,16 @@ def handle_other_files(end_point):
             with requests.get(
                 "http://{}/llm_chat".format(end_point),
                 stream=True,
-                params={"query": st.session_state.prompt_parsed, "context": st.session_state.text_data},
+                params={
+                    "query": st.session_state.prompt,
+                    "session_id": st.session_state.session_id,
+                    "client_id": st.session_state.client_id,
+                    **(
+                        {"document_id": st.session_state.document_id}
+                        if st.session_state.document_id
+                        else {"context": st.session_state.text_data}
+                    ),
+                },
                 timeout=60,
             ) as r:
                 r.raise_for_status()
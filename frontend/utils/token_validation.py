@@ -1,9 +1,10 @@
 import requests
 import json
+import bson
 import streamlit as st
 
 
-def validate_token(token, model, end_point):
+def validate_token(token, model, end_point, client_id):
     """
     Validates the provided API token by sending a request to the specified endpoint.
 
@@ -11,6 +12,7 @@ def validate_token(token, model, end_point):
         token (str): The API token to be validated.
         model (str): The model associated with the API token.
         end_point (str): The endpoint URL for token validation.
+        client_id (str): The browser using the token and model in all its conversations, other browsers keep their own.
 
     Returns:
         Response or str: The response object from the server if the request is successful, or an error message string in case of a RequestException.
@@ -20,7 +22,7 @@ def validate_token(token, model, end_point):
     url = "http://{}/update_api_key/".format(end_point)
     headers = {"accept": "application/json", "Content-Type": "application/json"}
     # data = json.dumps(token)
-    data = {"api_key": token, "model": model}
+    data = {"api_key": token, "model": model, "client_id": client_id}
 
     try:
         response = requests.post(url, headers=headers, params=data)
@@ -60,7 +62,16 @@ def inputAPI_token(ENDPOINT, session_state):
         confirm_button = st.sidebar.button("Confirm")
 
         if user_api_key and confirm_button:
-            message = validate_token(user_api_key.strip(), model_option, ENDPOINT)
+            # The backend answers the requests of this browser with its token and model. Unlike the session id,
+            # the client id is kept when the conversation is reset.
+            if "client_id" not in session_state:
+                session_state["client_id"] = str(bson.ObjectId())
+            message = validate_token(
+                user_api_key.strip(),
+                model_option,
+                ENDPOINT,
+                session_state["client_id"],
+            )
             try:
                 if message.status_code == 200:
                     session_state["token_valid"] = True